@@ -61,6 +61,14 @@ import { Task } from '../../../models/task';
                 <mat-label>Max. Missing Peaks</mat-label>
                 <input type="number" min="0" step="1" matInput formControlName="maximumMissingPeakCount">
               </mat-form-field>
+              <mat-form-field class="half-width" [floatLabel]="'always'">
+                <mat-label>Sizing Method</mat-label>
+                <mat-select matInput formControlName="sizingMethod">
+                  <mat-option *ngFor="let method of SIZING_METHODS" [value]="method.value">
+                    {{method.label}}
+                  </mat-option>
+                </mat-select>
+              </mat-form-field>
               <mat-form-field class="half-width" [floatLabel]="'always'">
                 <mat-label>Color</mat-label>
                 <mat-select matInput formControlName="color">
@@ -127,6 +135,19 @@ import { Task } from '../../../models/task';
                 <mat-label>Tophat Factor</mat-label>
                 <input type="number" min="0" step=".001" matInput formControlName="tophatFactor">
               </mat-form-field>
+              <mat-form-field class="half-width" [floatLabel]="'always'">
+                <mat-label>Baseline Method</mat-label>
+                <mat-select matInput formControlName="baselineMethod">
+                  <mat-option *ngFor="let method of BASELINE_METHODS" [value]="method.value">
+                    {{method.label}}
+                  </mat-option>
+                </mat-select>
+              </mat-form-field>
+              <mat-form-field class="half-width" [floatLabel]="'always'"
+                              *ngIf="ladderForm.get('baselineMethod').value === 'rolling_percentile'">
+                <mat-label>Baseline Percentile</mat-label>
+                <input type="number" min="0" max="100" step="1" matInput formControlName="baselinePercentile">
+              </mat-form-field>
             </div>
           </mat-tab>
         </mat-tab-group>
@@ -182,6 +203,16 @@ export class LadderEditorComponent implements OnChanges {
     {value: 'relmax', label: 'Relative Maximum'}
   ]
 
+  BASELINE_METHODS = [
+    {value: 'tophat', label: 'Tophat'},
+    {value: 'rolling_percentile', label: 'Rolling Percentile'}
+  ]
+
+  SIZING_METHODS = [
+    {value: 'combinatorial', label: 'Combinatorial'},
+    {value: 'alignment', label: 'Alignment'}
+  ]
+
   constructor(private fb: FormBuilder) {
     this.createForm();
   }
@@ -221,12 +252,15 @@ export class LadderEditorComponent implements OnChanges {
       color: ladderModel.color,
       allow_bleedthrough: ladderModel.allowBleedthrough,
       remove_outliers: ladderModel.removeOutliers,
+      sizing_method: ladderModel.sizingMethod,
       scanning_method: ladderModel.scanningMethod,
       maxima_window: ladderModel.maximaWindow,
       argrelmax_window: ladderModel.argrelmaxWindow,
       trace_smoothing_window: ladderModel.traceSmoothingWindow,
       trace_smoothing_order: ladderModel.traceSmoothingOrder,
       tophat_factor: ladderModel.tophatFactor,
+      baseline_method: ladderModel.baselineMethod,
+      baseline_percentile: ladderModel.baselinePercentile,
       cwt_min_width: ladderModel.cwtMinWidth,
       cwt_max_width: ladderModel.cwtMaxWidth,
       min_snr: ladderModel.minSNR,
@@ -265,12 +299,15 @@ export class LadderEditorComponent implements OnChanges {
       color: ladder.color,
       allowBleedthrough: ladder.allow_bleedthrough,
       removeOutliers: ladder.remove_outliers,
+      sizingMethod: ladder.sizing_method,
       scanningMethod: ladder.scanning_method,
       maximaWindow: ladder.maxima_window,
       argrelmaxWindow: ladder.argrelmax_window,
       traceSmoothingWindow: ladder.trace_smoothing_window,
       traceSmoothingOrder: ladder.trace_smoothing_order,
       tophatFactor: ladder.tophat_factor,
+      baselineMethod: ladder.baseline_method,
+      baselinePercentile: ladder.baseline_percentile,
       cwtMinWidth: ladder.cwt_min_width,
       cwtMaxWidth: ladder.cwt_max_width,
       minSNR: ladder.min_snr,
@@ -295,12 +332,15 @@ export class LadderEditorComponent implements OnChanges {
       color: ['red', Validators.required],
       allowBleedthrough: [true, Validators.required],
       removeOutliers: [true, Validators.required],
+      sizingMethod: ['combinatorial', Validators.required],
       scanningMethod: ['relmax', Validators.required],
       maximaWindow: [10, Validators.required],
       argrelmaxWindow: [6, Validators.required],
       traceSmoothingWindow: [11, Validators.required],
       traceSmoothingOrder: [7, Validators.required],
       tophatFactor: [0.005, Validators.required],
+      baselineMethod: ['tophat', Validators.required],
+      baselinePercentile: [10, Validators.required],
       cwtMinWidth: [4, Validators.required],
       cwtMaxWidth: [15, Validators.required],
       minSNR: [3, Validators.required],
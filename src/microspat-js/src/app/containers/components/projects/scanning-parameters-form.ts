@@ -79,6 +79,21 @@ import { FormGroupDirective, ControlContainer, FormBuilder, Validators } from '@
           <input type="number" min="0" step=".001" matInput formControlName="tophat_factor">
         </mat-form-field>
 
+        <mat-form-field class="half-width" [floatLabel]="'always'">
+          <mat-label>Baseline Method</mat-label>
+          <mat-select matInput formControlName="baseline_method">
+            <mat-option *ngFor="let method of BASELINE_METHODS" [value]="method.value">
+              {{ method.label }}
+            </mat-option>
+          </mat-select>
+        </mat-form-field>
+
+        <mat-form-field class="half-width" [floatLabel]="'always'"
+                        *ngIf="form.get('scanning_parameters').get('baseline_method').value === 'rolling_percentile'">
+          <mat-label>Baseline Percentile</mat-label>
+          <input type="number" min="0" max="100" step="1" matInput formControlName="baseline_percentile">
+        </mat-form-field>
+
       </div>
 
     </div>
@@ -96,6 +111,11 @@ export class ScanningParametersFormComponent extends AbstractParameterComponent
     {value: 'cwt', label: 'Continuous Wavelet Transform'},
   ]
 
+  public BASELINE_METHODS = [
+    {value: 'tophat', label: 'Tophat'},
+    {value: 'rolling_percentile', label: 'Rolling Percentile'},
+  ]
+
   protected parameterValidators = {
     scanning_method: [Validators.required, Validators.min(0)],
     maxima_window: [Validators.required, Validators.min(0)],
@@ -103,6 +123,8 @@ export class ScanningParametersFormComponent extends AbstractParameterComponent
     trace_smoothing_window: [Validators.required, Validators.min(0)],
     trace_smoothing_order: [Validators.required, Validators.min(0)],
     tophat_factor: [Validators.required, Validators.min(0)],
+    baseline_method: [Validators.required],
+    baseline_percentile: [Validators.required, Validators.min(0), Validators.max(100)],
     cwt_min_width: [Validators.required, Validators.min(0)],
     cwt_max_width: [Validators.required, Validators.min(0)],
     min_snr: [Validators.required, Validators.min(0)],
@@ -82,6 +82,8 @@ export class QuantificationBiasEstimatorProjectAnalysisSettingsComponent impleme
     trace_smoothing_window: 11,
     trace_smoothing_order: 7,
     tophat_factor: .005,
+    baseline_method: 'tophat',
+    baseline_percentile: 10,
     cwt_min_width: 4,
     cwt_max_width: 15,
     min_snr: 3,
@@ -17,6 +17,8 @@ export interface PeakScanner {
   trace_smoothing_window: number;
   trace_smoothing_order: number;
   tophat_factor: number;
+  baseline_method: 'tophat' | 'rolling_percentile';
+  baseline_percentile: number;
   cwt_min_width: number;
   cwt_max_width: number;
   min_snr: number;
@@ -16,4 +16,5 @@ export interface Ladder extends BaseModel, PeakScanner, Colored {
   maximum_missing_peak_count: number;
   allow_bleedthrough: boolean;
   remove_outliers: boolean;
+  sizing_method: string;
 }
@@ -29,7 +29,15 @@ export class PlateService extends WebSocketBaseService<Plate> {
   }
 
   public uploadPlate(plateFiles: FileList, ladderID: number) {
-    this.uploadFiles('upload_plate', plateFiles, {ladder_id: ladderID}).subscribe()
+    // ladder_id is sent as a query parameter so the server can begin processing before the upload completes.
+    const formData = new FormData();
+    for (let i = 0; i < plateFiles.length; i++) {
+      const file = plateFiles[i];
+      formData.append('files', file, file['name']);
+    }
+    this.http.post(`${this.API_PATH}/${this.namespace}/upload_plate_stream/`, formData, {
+      params: {ladder_id: `${ladderID}`}
+    }).subscribe()
   }
 
   public uploadPlateMap(plateMapFile: File, plateID: number, createNonExistentSamples) {
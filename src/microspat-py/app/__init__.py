@@ -54,4 +54,11 @@ def create_app(config_name):
 
     db.create_all()
 
+    # Databases created by earlier versions gain any columns added since, and derived columns are filled in.
+    from app.utils.utils import add_missing_columns
+    add_missing_columns(db.engine, db.metadata)
+
+    from app.microspat.models import Well
+    Well.store_missing_sizing_digests()
+
     return app
@@ -18,7 +18,9 @@
 
 import bz2
 import json
+import zlib
 
+import numpy as np
 import sqlalchemy.types as types
 
 
@@ -48,3 +50,112 @@ class CompressedJSONEncodedData(types.TypeDecorator):
         if value is not None:
             value = json.loads(bz2.decompress(value).decode('utf-8'))
         return value
+
+
+class BinaryJSONEncodedData(types.TypeDecorator):
+    """
+    JSON stored as uncompressed UTF-8 bytes, for small values that are read with every row. Values stored by
+    CompressedJSONEncodedData are still read.
+    """
+    impl = types.LargeBinary
+
+    BZ2_HEADER = b'BZh'
+
+    def process_bind_param(self, value, dialect):
+        if value is not None:
+            value = json.dumps(value).encode('utf-8')
+        return value
+
+    def process_result_value(self, value, dialect):
+        if value is not None:
+            value = bytes(value)
+            if value.startswith(self.BZ2_HEADER):
+                value = bz2.decompress(value)
+            value = json.loads(value.decode('utf-8'))
+        return value
+
+
+class NumericArrayEncodedData(types.TypeDecorator):
+    """
+    Numeric array stored as a dtype header followed by zlib compressed little-endian bytes. Integer arrays are stored
+    using the smallest integer type that holds their range. Values are decoded directly to 64 bit NumPy arrays, so
+    arithmetic on decoded values behaves as it did on the python lists previously stored. Values stored by
+    CompressedJSONEncodedData are still read.
+    """
+    impl = types.LargeBinary
+
+    HEADER = b'NPA'
+    INTEGER_TYPES = (np.int8, np.int16, np.int32, np.int64)
+
+    @classmethod
+    def is_encoded(cls, value):
+        return value is not None and bytes(value[:len(cls.HEADER)]) == cls.HEADER
+
+    @staticmethod
+    def widen(values):
+        if values.dtype.kind in 'biu':
+            return values.astype(np.int64)
+        return values.astype(np.float64)
+
+    @classmethod
+    def decode_legacy(cls, value):
+        return cls.widen(np.asarray(json.loads(bz2.decompress(value).decode('utf-8'))))
+
+    def process_bind_param(self, value, dialect):
+        if value is not None:
+            values = np.asarray(value)
+            if values.dtype.kind in 'biu':
+                low, high = (int(values.min()), int(values.max())) if values.size else (0, 0)
+                dtype = next(np.dtype(_) for _ in self.INTEGER_TYPES
+                             if np.iinfo(_).min <= low and high <= np.iinfo(_).max)
+            else:
+                dtype = np.dtype(np.float64)
+            dtype = dtype.newbyteorder('<')
+            dtype_str = dtype.str.encode('ascii')
+            value = self.HEADER + bytes([len(dtype_str)]) + dtype_str + zlib.compress(values.astype(dtype).tobytes(), 1)
+        return value
+
+    def process_result_value(self, value, dialect):
+        if value is not None:
+            if not self.is_encoded(value):
+                return self.decode_legacy(value)
+            offset = len(self.HEADER) + 1
+            dtype = np.dtype(bytes(value[offset:offset + value[offset - 1]]).decode('ascii'))
+            value = self.widen(np.frombuffer(zlib.decompress(value[offset + value[offset - 1]:]), dtype=dtype))
+        return value
+
+    def compare_values(self, x, y):
+        if x is None or y is None:
+            return x is y
+        return np.array_equal(x, y)
+
+
+class FixedPointEncodedData(NumericArrayEncodedData):
+    """
+    Array of floats stored as zlib compressed, delta encoded, little-endian int64 fixed point values. The number of
+    decimal places is detected on bind and stored in the header, so values that were rounded before being stored are
+    recovered exactly. Values stored by CompressedJSONEncodedData are still read.
+    """
+    HEADER = b'FXP'
+    MAX_PRECISION = 6
+
+    def process_bind_param(self, value, dialect):
+        if value is not None:
+            values = np.asarray(value, dtype=np.float64)
+            precision = 0
+            while precision < self.MAX_PRECISION and not np.allclose(
+                    values * 10 ** precision, np.round(values * 10 ** precision), rtol=0, atol=1e-6):
+                precision += 1
+            fixed_point = np.round(values * 10 ** precision).astype('<i8')
+            deltas = np.diff(fixed_point, prepend=0).astype('<i8')
+            value = self.HEADER + bytes([precision]) + zlib.compress(deltas.tobytes(), 1)
+        return value
+
+    def process_result_value(self, value, dialect):
+        if value is not None:
+            if not self.is_encoded(value):
+                return self.decode_legacy(value).astype(np.float64)
+            precision = value[len(self.HEADER)]
+            deltas = np.frombuffer(zlib.decompress(value[len(self.HEADER) + 1:]), dtype='<i8')
+            value = np.cumsum(deltas) / 10 ** precision
+        return value
@@ -16,8 +16,25 @@
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+import os
+
 
 # Default config settings
 class MicroSPATConfig(object):
     CONTAMINATION_LIMIT = 500
 
+    # Number of worker processes used to parse and size uploaded plates. The default of 1 parses plates in process,
+    # larger values opt in to a pool of spawned workers.
+    EXTRACTION_PROCESSES = int(os.environ.get('MICROSPAT_EXTRACTION_PROCESSES', 1))
+
+    # Number of smoothed and baseline corrected traces kept in memory, and an optional directory, one per database,
+    # in which they are persisted between sessions.
+    SIGNAL_CACHE_SIZE = int(os.environ.get('MICROSPAT_SIGNAL_CACHE_SIZE', 512))
+    SIGNAL_CACHE_DIR = os.environ.get('MICROSPAT_SIGNAL_CACHE_DIR') or None
+
+    # Number of plate and color combinations for which neighbouring crosstalk signal is kept in memory. Each entry holds
+    # 2 to 4 bytes per point of every trace on the plate, about 8 to 16 MB for a 384 well plate of 10,000 point traces.
+    CROSSTALK_CACHE_SIZE = int(os.environ.get('MICROSPAT_CROSSTALK_CACHE_SIZE', 8))
+
+    # Number of channel peak annotation results kept in memory, shared by all projects.
+    CHANNEL_RESULT_CACHE_SIZE = int(os.environ.get('MICROSPAT_CHANNEL_RESULT_CACHE_SIZE', 10000))
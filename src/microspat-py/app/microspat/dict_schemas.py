@@ -40,6 +40,8 @@ class ProjectLocusParamsSchema(BaseSchema, TimeStamped):
     trace_smoothing_window = fields.Integer()
     trace_smoothing_order = fields.Integer()
     tophat_factor = fields.Float()
+    baseline_method = fields.String()
+    baseline_percentile = fields.Float()
 
     # CWT Scanning Params
     cwt_min_width = fields.Integer()
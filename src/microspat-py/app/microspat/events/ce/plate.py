@@ -2,13 +2,16 @@ import csv
 import tempfile
 import os
 import io
+from collections import deque
 
 from flask import request, jsonify, copy_current_request_context
 from sqlalchemy import exists
-from sqlalchemy.orm import defer
+from sqlalchemy.orm import defer, subqueryload
+from werkzeug.formparser import FormDataParser
 
 from app import socketio, db
-from app.microspat.fsa_tools.PlateExtractor import ExtractedPlate
+from app.microspat.config import MicroSPATConfig
+from app.microspat.fsa_tools.ExtractionPool import ExtractionPool, DuplicatePlateException
 from app.microspat.schemas import PlateSchema, PlateListSchema, WellSchema, WellListSchema, ChannelListSchema
 from app.microspat.models import Plate, Well, Channel, Ladder, ProjectChannelAnnotations, Sample, Locus, \
     GenotypingProject, LocusSet, locus_set_association_table, ProjectSampleAnnotations, ProjectLocusParams, Project
@@ -139,87 +142,221 @@ def delete_plate(json):
         return
 
 
-@microspat_api.route('/plate/upload_plate/', methods=['POST', 'OPTIONS'])
-def upload_plates():
-    if request.method == 'OPTIONS':
-        return jsonify({'status': 'Success'})
-
-    @copy_current_request_context
-    def bg_upload_plates(plate_files, ladder_id):
-        extracted_plates = []
-        ladder = Ladder.query.get(ladder_id)
+def bg_upload_plates(plate_files, ladder_id, task_notifier=None):
+    extracted_plates = []
+    ladder = Ladder.query.get(ladder_id)
+    if task_notifier is None:
         task = 'upload_plate'
         task_notifier = TaskNotifier(task=task, namespace=SOCK_NAMESPACE, ladder_id=ladder_id)
-
         task_notifier.emit_task_start()
 
-        for idx, plate_zip_file in enumerate(plate_files):
-            try:
-                with open(plate_zip_file, 'rb') as plate_zip:
-                    extracted_plate = ExtractedPlate.from_zip_and_calculate_base_sizes(
-                        zip_file=plate_zip,
-                        ladder=ladder.base_sizes,
-                        color=ladder.color,
-                        base_size_precision=ladder.base_size_precision,
-                        sq_limit=ladder.sq_limit,
-                        filter_parameters=ladder.filter_parameters,
-                        scanning_parameters=ladder.scanning_parameters
-                    )
-
-                    if not plate_hash_already_exists(extracted_plate.plate_hash):
-                        extracted_plates.append(extracted_plate)
-                        task_notifier.emit_task_progress(progress={
-                                               'style': 'determinate',
-                                               'total': len(plate_files) + 2,
-                                               'current_state': idx + 1,
-                                               'message': f'Parsing {extracted_plate.label}...',
-                                           })
-                        socketio.sleep()
-                    else:
-                        task_notifier.emit_task_progress(progress={
-                            'style': 'determinate',
-                            'total': len(plate_files),
-                            'current_state': idx + 1,
-                            'message': f"Cannot Process {extracted_plate.label}, Already Exists In Database."
-                        })
-                        socketio.sleep()
-            except Exception as e:
-                # print("Exception Not Caught", e)
+    extraction_pool = ExtractionPool(processes=MicroSPATConfig.EXTRACTION_PROCESSES)
+    extracted = extraction_pool.extract_plates(
+        zip_paths=plate_files,
+        ladder=ladder.base_sizes,
+        color=ladder.color,
+        base_size_precision=ladder.base_size_precision,
+        sq_limit=ladder.sq_limit,
+        filter_parameters=ladder.filter_parameters,
+        scanning_parameters=ladder.scanning_parameters,
+        known_fsa_hashes=known_fsa_hashes
+    )
+
+    for idx, (plate_zip_file, extracted_plate, error) in enumerate(extracted):
+        try:
+            if error:
+                raise error
+
+            if not plate_hash_already_exists(extracted_plate.plate_hash):
+                extracted_plates.append(extracted_plate)
+                task_notifier.emit_task_progress(progress={
+                                       'style': 'determinate',
+                                       'total': len(plate_files) + 2,
+                                       'current_state': idx + 1,
+                                       'message': f'Parsing {extracted_plate.label}...',
+                                   })
+                socketio.sleep()
+            else:
                 task_notifier.emit_task_progress(progress={
                     'style': 'determinate',
                     'total': len(plate_files),
                     'current_state': idx + 1,
-                    'message': f"Cannot Process {plate_zip.filename}",
+                    'message': f"Cannot Process {extracted_plate.label}, Already Exists In Database."
                 })
                 socketio.sleep()
-            finally:
-                os.remove(plate_zip_file)
+        except DuplicatePlateException as e:
+            task_notifier.emit_task_progress(progress={
+                'style': 'determinate',
+                'total': len(plate_files),
+                'current_state': idx + 1,
+                'message': f"Cannot Process {os.path.basename(plate_zip_file)}, {e}"
+            })
+            socketio.sleep()
+        except Exception as e:
+            # print("Exception Not Caught", e)
+            task_notifier.emit_task_progress(progress={
+                'style': 'determinate',
+                'total': len(plate_files),
+                'current_state': idx + 1,
+                'message': f"Cannot Process {os.path.basename(plate_zip_file)}",
+            })
+            socketio.sleep()
+        finally:
+            os.remove(plate_zip_file)
+
+    task_notifier.emit_task_progress(progress={
+        'style': 'determinate',
+        'total': len(plate_files) + 2,
+        'current_state': len(plate_files) + 1,
+        'message': f'Saving Plate Data...',
+    })
+    socketio.sleep()
 
-        task_notifier.emit_task_progress(progress={
-            'style': 'determinate',
-            'total': len(plate_files) + 2,
-            'current_state': len(plate_files) + 1,
-            'message': f'Saving Plate Data...',
-        })
-        socketio.sleep()
+    plate_ids = [Plate.bulk_from_extracted_plate(plate, ladder) for plate in extracted_plates]
+    db.session.commit()
+
+    for plate_id in plate_ids:
+        socketio.emit('created', {
+            'model': PLATE_NAMESPACE,
+            'id': str(plate_id)
+        }, namespace=SOCK_NAMESPACE, broadcast=True)
+    socketio.sleep()
+    task_notifier.emit_task_success(message={'ids': plate_ids})
+    socketio.sleep()
 
-        submitted_plates = [Plate.from_extracted_plate(plate, ladder) for plate in extracted_plates]
-        db.session.commit()
 
-        socketio.sleep()
-        task_notifier.emit_task_success(message={'ids': [plate.id for plate in submitted_plates]})
-        socketio.sleep()
+class PlateUploadSpool(object):
+    """
+    Plate zips spooled to disk as a multipart upload is parsed.  Iterating yields the path of each file once it has
+    been completely received, waiting on the upload as necessary, so plates are processed while later files are still
+    arriving.  len() is the number of files received so far.  The consumer removes each file it is given, and closes
+    the spool once done, removing any files it was not given.
+    """
+
+    def __init__(self, task_notifier=None, poll_interval=.1):
+        self.task_notifier = task_notifier
+        self.poll_interval = poll_interval
+        self.received = []
+        self.ready = deque()
+        self.complete = False
+        self.closed = False
+        self._current = None
+
+    def __len__(self):
+        return len(self.received)
+
+    def __iter__(self):
+        while True:
+            if self.ready:
+                yield self.ready.popleft()
+            elif self.complete:
+                return
+            else:
+                socketio.sleep(self.poll_interval)
+
+    def stream_factory(self, total_content_length=None, content_type=None, filename=None, content_length=None):
+        self._finish_current()
+        handle, tmpfile_path = tempfile.mkstemp()
+        self._current = (os.fdopen(handle, mode='wb+'), tmpfile_path, filename)
+        return self._current[0]
+
+    def receive(self, req):
+        """
+        Parse the body of req, writing each uploaded file to its own temporary file in chunks.
+        :param req: flask request containing the multipart upload
+        """
+        try:
+            parser = FormDataParser(stream_factory=self.stream_factory)
+            parser.parse(req.stream, req.mimetype, req.content_length, req.mimetype_params)
+            self._finish_current()
+        finally:
+            self.complete = True
+            self._discard_current()
+            if self.closed:
+                self._remove_ready()
+
+    def close(self):
+        """
+        Stop spooling files for the consumer, removing those received but not yet consumed.
+        """
+        self.closed = True
+        self._remove_ready()
+
+    def _remove_ready(self):
+        while self.ready:
+            remove_file(self.ready.popleft())
+
+    def _discard_current(self):
+        """
+        Remove the file being written, if the upload failed before it was completely received.
+        """
+        if self._current:
+            tmpfile, tmpfile_path, _ = self._current
+            self._current = None
+            tmpfile.close()
+            remove_file(tmpfile_path)
+
+    def _finish_current(self):
+        if self._current:
+            tmpfile, tmpfile_path, filename = self._current
+            self._current = None
+            tmpfile.close()
+            if self.closed:
+                remove_file(tmpfile_path)
+                return
+            self.received.append(tmpfile_path)
+            self.ready.append(tmpfile_path)
+            if self.task_notifier:
+                self.task_notifier.emit_task_progress(progress={
+                    'style': 'indeterminate',
+                    'total': len(self.received),
+                    'current_state': len(self.received),
+                    'message': f'Received {filename or os.path.basename(tmpfile_path)}...'
+                })
+
+
+@microspat_api.route('/plate/upload_plate/', methods=['POST', 'OPTIONS'])
+def upload_plates():
+    if request.method == 'OPTIONS':
+        return jsonify({'status': 'Success'})
 
     plate_zips = request.files.getlist('files')
     files = []
     for f in plate_zips:
         handle, tmpfile_path = tempfile.mkstemp()
-        tmpfile = os.fdopen(handle, mode='wb')
-        tmpfile.write(f.stream.read())
+        with os.fdopen(handle, mode='wb') as tmpfile:
+            f.save(tmpfile)
         files.append(tmpfile_path)
 
     ladder_id = request.form.get('ladder_id')
-    socketio.start_background_task(bg_upload_plates, files, ladder_id)
+    socketio.start_background_task(copy_current_request_context(bg_upload_plates), files, ladder_id)
+    return jsonify({'status': "Success"})
+
+
+@microspat_api.route('/plate/upload_plate_stream/', methods=['POST', 'OPTIONS'])
+def upload_plates_stream():
+    """
+    Streaming variant of upload_plates.  ladder_id is passed as a query parameter so that processing can begin as soon
+    as the first file has been received.
+    """
+    if request.method == 'OPTIONS':
+        return jsonify({'status': 'Success'})
+
+    ladder_id = request.args.get('ladder_id')
+    task_notifier = TaskNotifier(task='upload_plate', namespace=SOCK_NAMESPACE, ladder_id=ladder_id)
+    task_notifier.emit_task_start()
+
+    spool = PlateUploadSpool(task_notifier=task_notifier)
+
+    @copy_current_request_context
+    def bg_upload_spooled_plates():
+        try:
+            bg_upload_plates(spool, ladder_id, task_notifier)
+        finally:
+            spool.close()
+
+    socketio.start_background_task(bg_upload_spooled_plates)
+    spool.receive(request)
     return jsonify({'status': "Success"})
 
 
@@ -232,7 +369,10 @@ def upload_plate_map():
         task_notifier = TaskNotifier(task=task, namespace=SOCK_NAMESPACE, plate_id=plate_id)
         task_notifier.emit_task_start()
 
-        plate = Plate.query.get(plate_id)
+        # Channel trace summaries bound the maximum data point of each channel assigned a locus.
+        plate = Plate.query.options(
+            subqueryload(Plate.wells).subqueryload(Well.channels).undefer(Channel.trace_summary)
+        ).get(plate_id)
         if not plate:
             task_notifier.emit_task_failure(message="No Plate Map Uploaded")
         else:
@@ -313,10 +453,21 @@ def upload_plate_map():
     return jsonify({'status': "Success"})
 
 
+def remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
 def plate_hash_already_exists(plate_hash):
     return bool(Plate.query.filter(Plate.plate_hash == plate_hash).count())
 
 
+def known_fsa_hashes(fsa_hashes):
+    return [_[0] for _ in Well.query.filter(Well.fsa_hash.in_(fsa_hashes)).values(Well.fsa_hash)]
+
+
 def clear_plate_map(plate_id):
     channel_annotations = ProjectChannelAnnotations.query.join(Channel). \
         join(Well).join(Plate).filter(Plate.id == plate_id).all()
@@ -1,3 +1,5 @@
+from sqlalchemy.orm import subqueryload
+
 from app.microspat.schemas import WellSchema, ChannelSchema, WellListSchema
 from app.microspat.models import Well, Channel
 from ..base import table_to_string_mapping, make_namespace, extract_ids, TaskNotifier, base_get_updated
@@ -60,7 +62,7 @@ def recalculate_ladder(json):
     if not isinstance(peak_indices, list):
         task_notifier.emit_task_failure(message="Peak Indices malformed.")
 
-    well = Well.query.get(well_id)
+    well = Well.query.options(subqueryload(Well.channels).undefer(Channel.trace_summary)).get(well_id)
 
     if not well:
         task_notifier.emit_task_failure(message="Well No Longer Exists. Reload Page.")
@@ -0,0 +1,142 @@
+"""
+    MicroSPAT is a collection of tools for the analysis of Capillary Electrophoresis Data
+    Copyright (C) 2016  Maxwell Murphy
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published
+    by the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import multiprocessing
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+from app import socketio
+from app.microspat.fsa_tools.ExtractionWorkers import (assemble_plate, extract_well, fsa_member_hashes,
+                                                       iter_fsa_member_hashes)
+
+
+class DuplicatePlateException(Exception):
+    pass
+
+
+class ExtractionPool(object):
+    """
+    Parses and sizes the wells of plate zips, by default in process yielding to other greenlets between wells.  With
+    more than one process the wells are handed to spawned worker processes, keeping CPU bound spline fitting off of
+    the socket server, and results are polled from the calling greenlet so that other events continue to be served.
+    Workers are spawned rather than forked as the server process holds eventlet hubs, database connections and socket
+    state that are not safe to share with a forked child.
+    """
+
+    def __init__(self, processes=1, poll_interval=.1):
+        self.processes = max(1, int(processes))
+        self.poll_interval = poll_interval
+
+    def extract_plates(self, zip_paths, ladder, color, base_size_precision, sq_limit, filter_parameters=None,
+                       scanning_parameters=None, creator=None, comments=None, known_fsa_hashes=None):
+        """
+        Generator yielding (zip_path, extracted_plate, exception) for each zip as soon as all of its wells have been
+        processed.  Exactly one of extracted_plate and exception is None.  zip_paths may be any iterable, including one
+        that waits on files still being uploaded.
+
+        FSA files are hashed before being parsed, off of the calling greenlet.  A zip containing any file already known,
+        either returned by known_fsa_hashes or part of a plate earlier in this upload, yields a DuplicatePlateException
+        without any of its wells being parsed or sized.  Partially overlapping plates are rejected rather than reusing
+        the stored sizing of their known wells, as Well.fsa_hash is unique and a stored well can not also belong to a
+        new plate.  A partially rerun plate is uploaded again once the stored plate has been deleted.
+        :param known_fsa_hashes: function taking a list of fsa hashes and returning those already stored
+        """
+        sizing_args = (ladder, color, base_size_precision, sq_limit, filter_parameters or {},
+                       scanning_parameters or {})
+        seen_fsa_hashes = set()
+
+        def new_members(member_hashes):
+            fsa_hashes = list(set(_[1] for _ in member_hashes))
+            known = seen_fsa_hashes.intersection(fsa_hashes)
+            if known_fsa_hashes and fsa_hashes:
+                known.update(known_fsa_hashes(fsa_hashes))
+            if member_hashes and len(known) == len(fsa_hashes):
+                raise DuplicatePlateException("Already Exists In Database.")
+            elif known:
+                raise DuplicatePlateException(f"{len(known)} Of {len(fsa_hashes)} FSA Files Already Exist.")
+            seen_fsa_hashes.update(fsa_hashes)
+            members = {}
+            for member, fsa_hash, spool_path in member_hashes:
+                members.setdefault(fsa_hash, (member, spool_path))
+            return list(members.values())
+
+        if self.processes == 1:
+            for zip_path in zip_paths:
+                spool_dir = tempfile.mkdtemp()
+                try:
+                    member_hashes = []
+                    for member_hash in iter_fsa_member_hashes(zip_path, spool_dir):
+                        member_hashes.append(member_hash)
+                        socketio.sleep()
+                    results = []
+                    for member, spool_path in new_members(member_hashes):
+                        results.append(extract_well(zip_path, member, *sizing_args, spool_path=spool_path))
+                        socketio.sleep()
+                    plate = self._assemble(results, creator, comments)
+                except Exception as e:
+                    yield zip_path, None, e
+                else:
+                    yield zip_path, plate, None
+                finally:
+                    shutil.rmtree(spool_dir, ignore_errors=True)
+            return
+
+        mp_context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=self.processes, mp_context=mp_context) as executor:
+            pending = {}
+            for zip_path in zip_paths:
+                spool_dir = tempfile.mkdtemp()
+                try:
+                    hashing = executor.submit(fsa_member_hashes, zip_path, spool_dir)
+                    while not hashing.done():
+                        socketio.sleep(self.poll_interval)
+                        for res in self._completed(pending, creator, comments):
+                            yield res
+                    pending[zip_path] = ([executor.submit(extract_well, zip_path, member, *sizing_args,
+                                                          spool_path=spool_path)
+                                          for member, spool_path in new_members(hashing.result())], spool_dir)
+                except Exception as e:
+                    shutil.rmtree(spool_dir, ignore_errors=True)
+                    yield zip_path, None, e
+                socketio.sleep()
+                for res in self._completed(pending, creator, comments):
+                    yield res
+
+            while pending:
+                socketio.sleep(self.poll_interval)
+                for res in self._completed(pending, creator, comments):
+                    yield res
+
+    def _completed(self, pending, creator, comments):
+        for zip_path in [_ for _ in pending if all(f.done() for f in pending[_][0])]:
+            futures, spool_dir = pending.pop(zip_path)
+            shutil.rmtree(spool_dir, ignore_errors=True)
+            try:
+                plate = self._assemble([f.result() for f in futures], creator, comments)
+            except Exception as e:
+                yield zip_path, None, e
+            else:
+                yield zip_path, plate, None
+
+    @staticmethod
+    def _assemble(results, creator, comments):
+        if not results:
+            raise ValueError("No FSA files found.")
+        plate_info = results[-1][0]
+        return assemble_plate(plate_info, [_[1] for _ in results], creator=creator, comments=comments)
@@ -0,0 +1,129 @@
+"""
+    MicroSPAT is a collection of tools for the analysis of Capillary Electrophoresis Data
+    Copyright (C) 2016  Maxwell Murphy
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published
+    by the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import hashlib
+import os
+import zipfile
+
+from app.microspat.fsa_tools.FSAExtractor import FSAFile, memory_map, release_memory_map, zip_member_view
+from app.microspat.fsa_tools.PlateExtractor import ExtractedPlate, WellExtractor, ChannelExtractor
+
+SPOOL_CHUNK_SIZE = 1 << 16
+
+
+def fsa_members(zip_path):
+    with zipfile.ZipFile(zip_path) as f:
+        return [_ for _ in f.namelist() if _.endswith('.fsa')]
+
+
+def iter_fsa_member_hashes(zip_path, spool_dir=None):
+    """
+    MD5 of the raw bytes of each FSA file in a plate zip, matching FSAFile.hash, computed without parsing the files.
+    Stored members are hashed in place within the memory mapped archive.  Compressed members are inflated in chunks,
+    and if spool_dir is given written there, so that extract_well need not inflate them again.
+    :return: generator of (member, fsa_hash, spool_path), spool_path None for stored members
+    """
+    mapped_zip = memory_map(zip_path)
+    with zipfile.ZipFile(zip_path) as f:
+        for idx, zip_info in enumerate(f.infolist()):
+            if not zip_info.filename.endswith('.fsa'):
+                continue
+            spool_path = None
+            fsa_view = zip_member_view(mapped_zip, zip_info)
+            if fsa_view is not None:
+                fsa_hash = hashlib.md5(fsa_view).hexdigest()
+                fsa_view.release()
+            else:
+                md5 = hashlib.md5()
+                if spool_dir:
+                    spool_path = os.path.join(spool_dir, f'{idx}.fsa')
+                with f.open(zip_info) as member, open(spool_path or os.devnull, 'wb') as spool:
+                    for chunk in iter(lambda: member.read(SPOOL_CHUNK_SIZE), b''):
+                        md5.update(chunk)
+                        spool.write(chunk)
+                fsa_hash = md5.hexdigest()
+            yield zip_info.filename, fsa_hash, spool_path
+    release_memory_map(mapped_zip)
+
+
+def fsa_member_hashes(zip_path, spool_dir=None):
+    """
+    iter_fsa_member_hashes as a list, for execution in worker processes.
+    """
+    return list(iter_fsa_member_hashes(zip_path, spool_dir))
+
+
+def extract_well(zip_path, member, ladder, color, base_size_precision, sq_limit, filter_parameters,
+                 scanning_parameters, spool_path=None):
+    """
+    Parse a single FSA file from a plate zip and calculate its base sizes.  Executed in worker processes, so only
+    picklable values are returned.
+    :param spool_path: file the member was inflated to by iter_fsa_member_hashes, read in place of the zip member
+    :return: (plate_info, well_info) dicts
+    """
+    if spool_path:
+        mapped_file = memory_map(spool_path)
+        fsa_view = mapped_file
+        if fsa_view is None:
+            with open(spool_path, 'rb') as spool:
+                fsa_view = spool.read()
+    else:
+        mapped_file = memory_map(zip_path)
+        with zipfile.ZipFile(zip_path) as f:
+            zip_info = f.getinfo(member)
+            fsa_view = zip_member_view(mapped_file, zip_info)
+            if fsa_view is None:
+                fsa_view = f.read(zip_info)
+    fsa = FSAFile(fsa_view, lazy=True)
+    well = WellExtractor.from_fsa(fsa)
+    well.calculate_base_sizes(ladder=ladder, color=color, base_size_precision=base_size_precision,
+                              sq_limit=sq_limit, filter_parameters=filter_parameters,
+                              scanning_parameters=scanning_parameters)
+    plate_info = {
+        'label': fsa.plate,
+        'well_arrangement': fsa.plate_size,
+        'date_run': fsa.date_run,
+        'ce_machine': fsa.ce_machine,
+        'temperature': fsa.temperature,
+        'current': fsa.current,
+        'voltage': fsa.voltage,
+        'power': fsa.power
+    }
+    well_info = {
+        'well_label': well.well_label,
+        'base_sizes': well.base_sizes,
+        'ladder_peak_indices': well.ladder_peak_indices,
+        'sizing_quality': well.sizing_quality,
+        'offscale_indices': well.offscale_indices,
+        'fsa_hash': well.fsa_hash,
+        'channels': [{'color': c.color, 'wavelength': c.wavelength, 'data': c.data,
+                      'trace_summary': c.trace_summary} for c in well.channels]
+    }
+    fsa.close()
+    release_memory_map(mapped_file)
+    return plate_info, well_info
+
+
+def assemble_plate(plate_info, well_infos, creator=None, comments=None):
+    wells = []
+    for well_info in sorted(well_infos, key=lambda _: _['well_label']):
+        well_info = dict(well_info)
+        channels = [ChannelExtractor(**_) for _ in well_info.pop('channels')]
+        wells.append(WellExtractor(channels=channels, **well_info))
+    return ExtractedPlate(wells=wells, creator=creator, comments=comments,
+                          plate_hash=ExtractedPlate.calculate_plate_hash(wells), **plate_info)
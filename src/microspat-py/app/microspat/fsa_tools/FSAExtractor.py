@@ -19,9 +19,13 @@
 import csv
 import datetime
 import hashlib
+import mmap
 import struct
+import zipfile
 from collections import defaultdict
 
+import numpy as np
+
 
 def Byte(byte_stream, size):
     return byte_stream[:size]
@@ -118,34 +122,127 @@ structUnpacker = {1: Byte,
                   13: Bool,
                   0: User}
 
+# Element types that may be decoded directly into a numpy view of the underlying buffer when lazily unpacked.
+numpyUnpacker = {4: np.dtype('>i2')}
+
+
+def to_list(data):
+    """
+    Convert unpacked directory data into a list of native python values.
+    """
+    if isinstance(data, np.ndarray):
+        return data.tolist()
+    return list(data)
+
+
+def to_array(data, dtype=None):
+    """
+    Copy unpacked directory data into a native-endian numpy array, which does not reference the buffer the data was
+    decoded from.
+    :param dtype: dtype of the copy, by default that of the data in native byte order
+    """
+    data = np.asarray(data)
+    return np.array(data, dtype=dtype or data.dtype.newbyteorder('='))
+
+
+def memory_map(f):
+    """
+    Memory map a file read-only.
+    :param f: path string or file object backed by a file descriptor
+    :return: mmap, or None if the file can not be mapped
+    """
+    try:
+        if isinstance(f, str):
+            with open(f, 'rb') as fh:
+                return mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+def release_memory_map(mapped_file):
+    """
+    Close a memory map.  Every FSAFile parsed from the map must have been closed, otherwise BufferError is raised.  Maps
+    are only released once parsing succeeds, as views of a map may be referenced by the traceback of an error raised
+    while parsing.  Such maps are closed when collected.
+    """
+    if mapped_file is not None:
+        mapped_file.close()
+
+
+def zip_member_view(mapped_zip, zip_info):
+    """
+    Zero-copy view of a zip member within a memory mapped archive.  Only members that are stored uncompressed and
+    unencrypted can be viewed directly. CRC is not checked.
+    :param mapped_zip: mmap of the full zip archive
+    :param zip_info: ZipInfo of the member
+    :return: memoryview, or None if the member must be read through zipfile
+    """
+    if mapped_zip is None or zip_info.compress_type != zipfile.ZIP_STORED or zip_info.flag_bits & 0x1:
+        return None
+    header = struct.unpack_from(zipfile.structFileHeader, mapped_zip, zip_info.header_offset)
+    if header[0] != zipfile.stringFileHeader:
+        return None
+    # Local file header is followed by the file name and extra field before the member data.
+    data_offset = zip_info.header_offset + zipfile.sizeFileHeader + header[10] + header[11]
+    return memoryview(mapped_zip)[data_offset: data_offset + zip_info.file_size]
+
 
 class FSAFile(object):
     SIGNATURE = b"ABIF"
 
-    def __init__(self, byte_stream, malform_check=True):
-        self._channels = {}
+    def __init__(self, byte_stream, malform_check=True, lazy=False):
+        """
+        :param byte_stream: raw contents of an FSA file
+        :param malform_check: raise IOError if required directories are missing
+        :param lazy: wrap byte_stream in a memoryview and only decode directory entries when their data is first
+        accessed. Trace data is decoded as read-only big-endian numpy views of byte_stream rather than tuples.
+        """
+        if lazy and not isinstance(byte_stream, memoryview):
+            byte_stream = memoryview(byte_stream)
         self.raw = byte_stream
-        self.signature = struct.unpack('>4s', byte_stream[0:4])[0]
-        self.version = struct.unpack('>h', byte_stream[4:6])[0]
+        self.lazy = lazy
         self._channels = None
         self._hash = None
-
-        if self.signature != FSAFile.SIGNATURE:
-            raise IOError('WARNING: Not a valid ABIF File.')
-
-        self.tdir = FSADir(byte_stream, offset=6)
-
+        self.tdir = None
         self.directories = defaultdict(dict)
 
-        # Unpack FSA File.
-        for i in range(0, self.tdir.numElements):
-            directory = FSADir(byte_stream, self.tdir.dataOffset + i * 28)
-            self.directories[directory.name][directory.number] = directory
-
-        if malform_check:
-            for k in ['DyeW', 'DATA']:
-                if k not in self.directories:
-                    raise IOError("ABIF Malformed")
+        try:
+            self.signature = struct.unpack('>4s', byte_stream[0:4])[0]
+            self.version = struct.unpack('>h', byte_stream[4:6])[0]
+
+            if self.signature != FSAFile.SIGNATURE:
+                raise IOError('WARNING: Not a valid ABIF File.')
+
+            self.tdir = FSADir(byte_stream, offset=6, lazy=lazy)
+
+            # Unpack FSA File.
+            for i in range(0, self.tdir.numElements):
+                directory = FSADir(byte_stream, self.tdir.dataOffset + i * 28, lazy=lazy)
+                self.directories[directory.name][directory.number] = directory
+
+            if malform_check:
+                for k in ['DyeW', 'DATA']:
+                    if k not in self.directories:
+                        raise IOError("ABIF Malformed")
+        except Exception:
+            self.close()
+            raise
+
+    def close(self):
+        """
+        Drop decoded directory data and release the view of the underlying buffer, so that a memory map the file was
+        parsed from can be closed.  Arrays decoded from the file that are still referenced keep the map open, causing
+        release_memory_map to raise BufferError, so data must be copied out with to_array before closing.
+        """
+        for directory in self.directories.values():
+            for entry in directory.values():
+                entry.release()
+        if self.tdir is not None:
+            self.tdir.release()
+        self._channels = None
+        if isinstance(self.raw, memoryview):
+            self.raw.release()
 
     def dump_to_csv(self, filename):
         with open(filename, 'w') as f:
@@ -154,7 +251,7 @@ class FSAFile(object):
                 directory = self.directories[dir_key]
                 for entry_key in directory:
                     row = [dir_key, entry_key]
-                    row += list(directory[entry_key].data)
+                    row += to_list(directory[entry_key].data)
                     w.writerow(row)
 
     def _compute_hash(self):
@@ -225,7 +322,7 @@ class FSAFile(object):
     def offscale_indices(self):
         # Indices of data points detected by the machine where the signal is saturated.
         if 'Satd' in self.directories:
-            offscale_indices = list(self.directories['Satd'][1].data)
+            offscale_indices = to_list(self.directories['Satd'][1].data)
         else:
             offscale_indices = []
         return offscale_indices
@@ -242,42 +339,78 @@ class FSAFile(object):
 
     @property
     def voltage(self):
-        voltage = list(self.directories['DATA'][5].data)
+        voltage = to_array(self.directories['DATA'][5].data)
         return voltage
 
     @property
     def current(self):
-        current = list(self.directories['DATA'][6].data)
+        current = to_array(self.directories['DATA'][6].data)
         return current
 
     @property
     def power(self):
-        power = list(self.directories['DATA'][7].data)
+        power = to_array(self.directories['DATA'][7].data)
         return power
 
     @property
     def temperature(self):
-        temperature = list(self.directories['DATA'][8].data)
+        temperature = to_array(self.directories['DATA'][8].data)
         return temperature
 
 
 class FSADir(object):
     """
-    Given a full bytestream and an offset, unpack the directory found within an FSA file.
+    Given a full bytestream and an offset, unpack the directory found within an FSA file.  If lazy, the entry's data is
+    not unpacked until first accessed.
     """
-    def __init__(self, bytestream, offset):
-        self.name = struct.unpack('>4s', bytestream[offset: offset + 4])[0].decode('ascii')
-        self.number = struct.unpack('>i', bytestream[offset + 4: offset + 8])[0]
-        self.elementType = struct.unpack('>h', bytestream[offset + 8: offset + 10])[0]
-        self.elementSize = struct.unpack('>h', bytestream[offset + 10: offset + 12])[0]
-        self.numElements = struct.unpack('>i', bytestream[offset + 12: offset + 16])[0]
-        self.dataSize = struct.unpack('>i', bytestream[offset + 16: offset + 20])[0]
-        self.dataOffset = struct.unpack('>i', bytestream[offset + 20: offset + 24])[0]
-        self.dataHandle = struct.unpack('>i', bytestream[offset + 24: offset + 28])[0]
+    def __init__(self, bytestream, offset, lazy=False):
+        (name, self.number, self.elementType, self.elementSize, self.numElements,
+         self.dataSize, self.dataOffset, self.dataHandle) = struct.unpack_from('>4sihhiiii', bytestream, offset)
+        self.name = name.decode('ascii')
+        self.lazy = lazy
+        self._offset = offset
+        self._bytestream = bytestream
+        self._data = None
+        if not lazy:
+            self._data = self._unpack()
+            self._bytestream = None
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = self._unpack()
+            self._bytestream = None
+        return self._data
+
+    def release(self):
+        self._data = None
+        self._bytestream = None
+
+    def _unpack(self):
         if self.dataSize > 4:
-            self.data = structUnpacker.get(self.elementType, User)(bytestream[self.dataOffset:], self.dataSize)
+            data_offset = self.dataOffset
         else:
-            self.data = structUnpacker.get(self.elementType, User)(bytestream[offset + 20: offset + 24], self.dataSize)
+            data_offset = self._offset + 20
+
+        if not self.lazy:
+            if self.dataSize > 4:
+                return structUnpacker.get(self.elementType, User)(self._bytestream[data_offset:], self.dataSize)
+            else:
+                return structUnpacker.get(self.elementType, User)(self._bytestream[data_offset: data_offset + 4],
+                                                                  self.dataSize)
+
+        if self.name == 'DATA' and self.elementType in numpyUnpacker:
+            dtype = numpyUnpacker[self.elementType]
+            if self.dataSize % dtype.itemsize != 0:
+                raise IOError('Bytestream not multiple of {}'.format(dtype.itemsize))
+            return np.frombuffer(self._bytestream, dtype=dtype, count=self.dataSize // dtype.itemsize,
+                                 offset=data_offset)
+
+        # Slicing a memoryview does not copy the underlying buffer.
+        data = structUnpacker.get(self.elementType, User)(self._bytestream[data_offset:], self.dataSize)
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        return data
 
     def __repr__(self):
         if len(self.data) > 25:
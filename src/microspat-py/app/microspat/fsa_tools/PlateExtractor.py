@@ -17,12 +17,23 @@
 """
 
 import hashlib
+import os
 import zipfile
+from functools import lru_cache
 from io import IOBase
 
 from app import socketio
-from app.microspat.fsa_tools.FSAExtractor import FSAFile
+from app.microspat.fsa_tools.FSAExtractor import (
+    FSAFile,
+    memory_map,
+    release_memory_map,
+    to_array,
+    to_list,
+    zip_member_view,
+)
 from app.microspat.peak_annotator.PeakAnnotators import *
+from app.microspat.peak_annotator.PeakTable import PeakTable, PeakRow
+from app.microspat.signal_processor.SignalProcessor import summarize_trace
 from app.microspat.signal_processor.TraceProcessor import LadderProcessor, MicrosatelliteProcessor, NoLadderException
 
 
@@ -202,7 +213,10 @@ class ExtractedPlate(object):
         return quad, quad_well_label
 
     @classmethod
-    def from_zip(cls, zip_file, creator=None, comments=None):
+    def from_fsa_files(cls, fsa_files, creator=None, comments=None):
+        """
+        Build a plate from an iterable of FSAFile objects belonging to the same run.
+        """
         label = ''
         wells = []
         well_arrangement = 0
@@ -212,26 +226,71 @@ class ExtractedPlate(object):
         current = None
         voltage = None
         power = None
-        with zipfile.ZipFile(zip_file) as f:
-            for member in f.namelist():
-                if member.endswith('.fsa'):
-                    with f.open(member) as fsa:
-                        fsa = FSAFile(fsa.read())
-                        well = WellExtractor.from_fsa(fsa)
-                        wells.append(well)
-                        well_arrangement = fsa.plate_size
-                        date_run = fsa.date_run
-                        ce_machine = fsa.ce_machine
-                        label = fsa.plate
-                        temperature = fsa.temperature
-                        current = fsa.current
-                        voltage = fsa.voltage
-                        power = fsa.power
-        well_hashes = "".join([well.fsa_hash for well in sorted(wells, key=lambda x: x.well_label)]).encode('utf-8')
-        plate_hash = hashlib.md5(well_hashes).hexdigest()
+        for fsa in fsa_files:
+            well = WellExtractor.from_fsa(fsa)
+            wells.append(well)
+            well_arrangement = fsa.plate_size
+            date_run = fsa.date_run
+            ce_machine = fsa.ce_machine
+            label = fsa.plate
+            temperature = fsa.temperature
+            current = fsa.current
+            voltage = fsa.voltage
+            power = fsa.power
         return cls(label=label, wells=wells, temperature=temperature, current=current, voltage=voltage, power=power,
                    well_arrangement=well_arrangement, date_run=date_run, creator=creator,
-                   comments=comments, ce_machine=ce_machine, plate_hash=plate_hash)
+                   comments=comments, ce_machine=ce_machine, plate_hash=cls.calculate_plate_hash(wells))
+
+    @staticmethod
+    def calculate_plate_hash(wells):
+        well_hashes = "".join([well.fsa_hash for well in sorted(wells, key=lambda x: x.well_label)]).encode('utf-8')
+        return hashlib.md5(well_hashes).hexdigest()
+
+    @classmethod
+    def from_zip(cls, zip_file, creator=None, comments=None, memory_mapped=True):
+        """
+        :param zip_file: path string or file object of zip containing FSA files
+        :param memory_mapped: if possible, memory map the archive and parse stored (uncompressed) members in place
+        rather than reading them into memory.  Compressed members are always read through zipfile.
+        """
+        mapped_zip = memory_map(zip_file) if memory_mapped else None
+
+        def iter_fsa_files(f):
+            for zip_info in f.infolist():
+                if zip_info.filename.endswith('.fsa'):
+                    fsa_view = zip_member_view(mapped_zip, zip_info)
+                    if fsa_view is None:
+                        with f.open(zip_info) as fsa:
+                            fsa_view = fsa.read()
+                    fsa_file = FSAFile(fsa_view, lazy=True)
+                    yield fsa_file
+                    fsa_file.close()
+
+        with zipfile.ZipFile(zip_file) as f:
+            plate = cls.from_fsa_files(iter_fsa_files(f), creator, comments)
+        release_memory_map(mapped_zip)
+        return plate
+
+    @classmethod
+    def from_directory(cls, directory, creator=None, comments=None):
+        """
+        Load a plate from a directory of FSA files, memory mapping each file.
+        """
+        fsa_paths = sorted(os.path.join(directory, _) for _ in os.listdir(directory) if _.endswith('.fsa'))
+
+        def iter_fsa_files():
+            for fsa_path in fsa_paths:
+                mapped_file = memory_map(fsa_path)
+                if mapped_file is None:
+                    with open(fsa_path, 'rb') as fsa:
+                        fsa_file = FSAFile(fsa.read(), lazy=True)
+                else:
+                    fsa_file = FSAFile(mapped_file, lazy=True)
+                yield fsa_file
+                fsa_file.close()
+                release_memory_map(mapped_file)
+
+        return cls.from_fsa_files(iter_fsa_files(), creator, comments)
 
     @classmethod
     def from_zip_and_calculate_base_sizes(cls, zip_file, ladder, color, base_size_precision, sq_limit,
@@ -243,27 +302,17 @@ class ExtractedPlate(object):
         return p
 
     def surrounding_wells(self, well_label, distance):
-        quad = None
-        if self.well_arrangement == 384:
-            quad, well_label = self.convert_to_quad(well_label)
-
-        well_idx = capillary_order.index(well_label)
-        starting_idx = max(0, well_idx - distance)
-        ending_idx = min(96, well_idx + distance + 1)
-
-        surrounding_well_list = capillary_order[starting_idx:ending_idx]
-        surrounding_well_list.remove(well_label)
-
-        if quad:
-            surrounding_well_list = list(map(lambda _: self.convert_from_quad(quad, _), surrounding_well_list))
-
-        surrounding_wells = filter(None, [self.wells_dict.get(x, None) for x in surrounding_well_list])
-        return surrounding_wells
+        neighbours = capillary_neighbours(self.well_arrangement, distance)
+        if well_label not in neighbours:
+            raise ValueError("%s is not a valid well label." % well_label)
+        wells_dict = self.wells_dict
+        return [wells_dict[x] for x in neighbours[well_label] if x in wells_dict]
 
     def crosstalk_annotator(self, well_label, color, max_capillary_distance=2, idx_dist=1):
         surrounding_wells = self.surrounding_wells(well_label, distance=max_capillary_distance)
-        surrounding_signal = [x.channels_dict[color].data for x in surrounding_wells]
-        return annotate_signal_crosstalk(surrounding_signal, idx_dist)
+        surrounding_signal = [x.channels_dict[color].cumulative_data for x in surrounding_wells]
+        return annotate_cumulative_crosstalk(self.wells_dict[well_label].channels_dict[color].cumulative_data,
+                                             surrounding_signal, idx_dist)
 
     def annotate_crosstalk(self, well_labels=None, max_capillary_distance=2, idx_dist=1):
         """
@@ -281,9 +330,10 @@ class ExtractedPlate(object):
         for well_label in well_labels:
             surrounding_wells = self.surrounding_wells(well_label, distance=max_capillary_distance)
             well = self.wells_dict[well_label]
-            for color in list(well.channels_dict):
-                surrounding_signal = [x.channels_dict[color].data for x in surrounding_wells]
-                crosstalk_annotator = annotate_signal_crosstalk(surrounding_signal, idx_dist)
+            for color, channel in well.channels_dict.items():
+                surrounding_signal = [x.channels_dict[color].cumulative_data for x in surrounding_wells]
+                crosstalk_annotator = annotate_cumulative_crosstalk(channel.cumulative_data, surrounding_signal,
+                                                                    idx_dist)
                 self.exec_pre_annotating_function(crosstalk_annotator, [well_label], [color])
         return self
 
@@ -400,6 +450,35 @@ class ExtractedPlate(object):
         return self
 
 
+@lru_cache(maxsize=None)
+def capillary_neighbours(well_arrangement, distance):
+    """
+    Wells fed into capillaries within distance of each well's capillary.  384 well plates are run as four 96 well
+    quads, so neighbours are found within the well's quad.
+    :param well_arrangement: 96 or 384
+    :param distance: number of capillaries on either side
+    :return: dict of well label to tuple of neighbouring well labels
+    """
+    neighbours_96 = {}
+    for well_idx, well_label in enumerate(capillary_order):
+        neighbours_96[well_label] = tuple(capillary_order[max(0, well_idx - distance):well_idx] +
+                                          capillary_order[well_idx + 1:well_idx + distance + 1])
+    if well_arrangement != 384:
+        return neighbours_96
+
+    neighbours_384 = {}
+    for well_label in well_order_384:
+        quad, quad_well_label = ExtractedPlate.convert_to_quad(well_label)
+        neighbours_384[well_label] = tuple(ExtractedPlate.convert_from_quad(quad, _)
+                                           for _ in neighbours_96[quad_well_label])
+    return neighbours_384
+
+
+# Build the neighbour index used by default crosstalk annotation.
+capillary_neighbours(96, 2)
+capillary_neighbours(384, 2)
+
+
 class WellExtractor(object):
     def __init__(self, well_label, plate=None, comments=None, base_sizes=None, sizing_quality=None,
                  offscale_indices=None, ladder_peak_indices=None, channels=None, fsa_hash=None):
@@ -463,19 +542,27 @@ class WellExtractor(object):
         :return:
         """
         if isinstance(fsa, str):
-            with open(fsa, 'r') as f:
-                fsa = FSAFile(f.read())
+            mapped_file = memory_map(fsa)
+            if mapped_file is None:
+                with open(fsa, 'rb') as f:
+                    fsa = FSAFile(f.read(), lazy=True)
+            else:
+                fsa_file = FSAFile(mapped_file, lazy=True)
+                well = cls.from_fsa(fsa_file)
+                fsa_file.close()
+                release_memory_map(mapped_file)
+                return well
         elif isinstance(fsa, IOBase):
-            fsa = FSAFile(fsa.read())
+            fsa = FSAFile(fsa.read(), lazy=True)
 
         if isinstance(fsa, FSAFile):
-            channels = [ChannelExtractor(**c) for c in fsa.channels]
+            channels = [ChannelExtractor(**c).summarize(fsa.offscale_indices) for c in fsa.channels]
             return cls(well_label=fsa.well, channels=channels, fsa_hash=fsa.hash, offscale_indices=fsa.offscale_indices)
         else:
             raise AttributeError("FSA File Not Valid.")
 
     def base_size_annotator(self):
-        if self.base_sizes:
+        if len(self.base_sizes):
             return annotate_base_size(self.base_sizes)
         else:
             return fake_pre_annotation()
@@ -497,8 +584,9 @@ class WellExtractor(object):
 
         other_colors = list(self.channels_dict)
         other_colors.remove(color)
-        other_traces = [self.channels_dict[c].data for c in other_colors]
-        return annotate_signal_crosstalk(other_traces, idx_dist, label='bleedthrough_ratio')
+        other_traces = [self.channels_dict[c].cumulative_data for c in other_colors]
+        return annotate_cumulative_crosstalk(self.channels_dict[color].cumulative_data, other_traces, idx_dist,
+                                             label='bleedthrough_ratio')
 
     def offscale_annotator(self):
         return annotate_member_of('peak_index', 'offscale', self.offscale_indices)
@@ -638,20 +726,37 @@ class WellExtractor(object):
 
 
 class ChannelExtractor(object):
-    def __init__(self, color, wavelength, well=None, data=None, peak_indices=None, peaks=None):
+    def __init__(self, color, wavelength, well=None, data=None, peak_indices=None, peaks=None, trace_summary=None):
         # Prevent data being automatically loaded from db during init
-        if data:
-            self.data = list(data)
+        if data is not None and len(data):
+            # Copied out of the file buffer, widened so that sums of neighbouring points can not overflow.
+            self.data = to_array(data, dtype=np.int32)
+        if trace_summary is not None:
+            self.trace_summary = trace_summary
         if well:
             self.well = well
         self.color = color
         self.wavelength = wavelength
         self.peak_indices = peak_indices
-        self.peaks = peaks
+        self.peaks = PeakTable.from_dicts(peaks) if peaks is not None else None
 
     def __repr__(self):
         return "<Channel {0} {1}>".format(self.color, self.wavelength)
 
+    def summarize(self, offscale_indices=None):
+        self.trace_summary = summarize_trace(getattr(self, 'data', []), offscale_indices)
+        return self
+
+    @property
+    def cumulative_data(self):
+        """
+        Cumulative sums of the trace, computed on first use.  Used for window sums by the crosstalk and bleedthrough
+        annotators of this and neighbouring channels.
+        """
+        if getattr(self, '_cumulative_data', None) is None:
+            self._cumulative_data = cumulative_sums(getattr(self, 'data', []))
+        return self._cumulative_data
+
     def annotate_bleedthrough(self, idx_dist=1):
         bleedthrough_annotator = self.well.bleedthrough_annotator(color=self.color, idx_dist=idx_dist)
         self.pre_annotate_peak_indices(bleedthrough_annotator)
@@ -667,23 +772,24 @@ class ChannelExtractor(object):
     def set_peak_indices(self, peak_indices=None):
         if peak_indices is None:
             peak_indices = []
-        self.peak_indices = peak_indices
-        self.peaks = [{'peak_index': peak_idx} for peak_idx in self.peak_indices]
+        self.peak_indices = to_list(peak_indices)
+        self.peaks = PeakTable.from_peak_indices(self.peak_indices)
 
     def annotate_base_sizes(self):
         base_size_annotator = self.well.base_size_annotator()
         self.pre_annotate_peak_indices(base_size_annotator)
         return self
 
-    def identify_peak_indices(self, scanning_parameters=None):
+    def identify_peak_indices(self, scanning_parameters=None, scan_range=None):
         """
         Search the trace for peaks using a peak processing algorithm configured with scanning_parameters and set
         peak_indices to the returned indices.
+        :param scan_range: (start, stop) indices to which the search is restricted, or None to search the whole trace
         """
         if scanning_parameters is None:
             scanning_parameters = {}
 
-        ms_processor = MicrosatelliteProcessor(self, scanning_parameters)
+        ms_processor = MicrosatelliteProcessor(self, scanning_parameters, scan_range)
         self.set_peak_indices(ms_processor.find_peaks())
         return self
 
@@ -694,39 +800,36 @@ class ChannelExtractor(object):
         self.post_annotate_peak_indices(annotate_relative_peak_height())
 
     def annotate_peak_area(self):
-        self.pre_annotate_peak_indices(annotate_peak_area(self.data))
+        self.pre_annotate_peak_indices(annotate_peak_area(self.data, channel_id=getattr(self, 'id', None)))
 
     def annotate_relative_peak_area(self):
         self.post_annotate_peak_indices(annotate_relative_peak_area())
 
     def pre_annotate_peak_indices(self, peak_annotating_fn):
         """
-        Updates peaks to list of dicts containing peak annotations.  Annotating functions rely only on the peak index
-        and trace data and order in which they are applied should not matter. Order in which peak indices
-        are processed is not guaranteed due to parallelized implementations (Not yet implemented).
-        :param peak_annotating_fn: function with following signature: f(data, peak_index)
-        and returns dict of peak annotation of the form
+        Adds annotation columns to the peak table.  Annotating functions rely only on the peak indices and trace data
+        and order in which they are applied should not matter.
+        :param peak_annotating_fn: function with following signature: f(data, peak_indices)
+        and returns dict of peak annotation arrays, in the order of peak_indices, of the form
 
             {
-                'annotation1': value1,
-                'annotation2': value2
+                'annotation1': values1,
+                'annotation2': values2
             }
 
-        that is then used to update the preceding peak annotation.
+        that is then used to update the peak table.
         :return:
         """
         if self.peaks:
-            for annotated_peak in self.peaks:
-                annotation_update = peak_annotating_fn(self.data, annotated_peak['peak_index'])
-                annotated_peak.update(annotation_update)
+            self.peaks.update(peak_annotating_fn(self.data, self.peaks.peak_indices))
         return self
 
     def post_annotate_peak_indices(self, peak_annotating_fn):
         """
         Annotating function relies on previous annotations. Functions will be applied after pre_annotating functions.
-        Functions alter peak annotations in place.
-        :param peak_annotating_fn: function with following signature: f(peak_annotations)
-        Function returns updated peak_indices
+        Functions alter the peak table in place.
+        :param peak_annotating_fn: function with following signature: f(peak_table)
+        Function returns updated peak table
         :return:
         """
         self.peaks = peak_annotating_fn(self.peaks)
@@ -735,8 +838,15 @@ class ChannelExtractor(object):
     def filter_annotated_peaks(self, filter_fn):
         """
         Apply peak filtering functions to annotated peaks. Functions are applied in order in which they are passed in.
-        :param filter_fn: function that returns filtered annotated peak indices
+        :param filter_fn: function that returns the filtered peak table, or filtered rows of the peak table
         :return:
         """
-        self.peaks = list(filter_fn(self.peaks))
+        peaks = filter_fn(self.peaks)
+        if not isinstance(peaks, PeakTable):
+            peaks = list(peaks)
+            if all(isinstance(_, PeakRow) and _.table is self.peaks for _ in peaks):
+                peaks = self.peaks.select([_.row for _ in peaks])
+            else:
+                peaks = PeakTable.from_dicts(peaks)
+        self.peaks = peaks
         return self
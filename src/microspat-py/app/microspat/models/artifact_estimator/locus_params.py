@@ -34,7 +34,8 @@ class ArtifactEstimatorLocusParams(ProjectLocusParams):
             cls.max_peak_height, cls.min_peak_height_ratio, cls.max_bleedthrough, cls.max_crosstalk,
             cls.min_peak_distance, cls.scanning_parameters_stale, cls.filter_parameters_stale,
             cls.max_secondary_relative_peak_height, cls.min_artifact_peak_frequency,
-            cls.artifact_estimator_parameters_stale, cls.last_updated
+            cls.artifact_estimator_parameters_stale, cls.last_updated,
+            cls.baseline_method, cls.baseline_percentile
         )
 
         res = []
@@ -66,7 +67,9 @@ class ArtifactEstimatorLocusParams(ProjectLocusParams):
                 'max_secondary_relative_peak_height': lp[23],
                 'min_artifact_peak_frequency': lp[24],
                 'artifact_estimator_parameters_stale': lp[25],
-                'last_updated': lp[26]
+                'last_updated': lp[26],
+                'baseline_method': lp[27],
+                'baseline_percentile': lp[28]
             }
             res.append(r)
         return res
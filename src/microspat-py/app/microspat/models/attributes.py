@@ -26,6 +26,8 @@ class PeakScanner(object):
     trace_smoothing_window = db.Column(db.Integer, default=11, nullable=False)
     trace_smoothing_order = db.Column(db.Integer, default=7, nullable=False)
     tophat_factor = db.Column(db.Float, default=.005, nullable=False)
+    baseline_method = db.Column(db.Text, default='tophat', nullable=False)
+    baseline_percentile = db.Column(db.Float, default=10, nullable=False)
 
     # CWT Scanning Params
     cwt_min_width = db.Column(db.Integer, default=4, nullable=False)
@@ -39,6 +41,11 @@ class PeakScanner(object):
         assert scanning_method in ['cwt', 'relmax']
         return scanning_method
 
+    @validates('baseline_method')
+    def validate_baseline_method(self, _, baseline_method):
+        assert baseline_method in ['tophat', 'rolling_percentile']
+        return baseline_method
+
     @property
     def scanning_parameters(self):
         return {
@@ -48,6 +55,8 @@ class PeakScanner(object):
             'trace_smoothing_window': self.trace_smoothing_window,
             'trace_smoothing_order': self.trace_smoothing_order,
             'tophat_factor': self.tophat_factor,
+            'baseline_method': self.baseline_method,
+            'baseline_percentile': self.baseline_percentile,
             'cwt_min_width': self.cwt_min_width,
             'cwt_max_width': self.cwt_max_width,
             'min_snr': self.min_snr,
@@ -33,7 +33,8 @@ class BinEstimatorLocusParams(ProjectLocusParams):
             cls.max_peak_height, cls.min_peak_height_ratio, cls.max_bleedthrough, cls.max_crosstalk,
             cls.min_peak_distance, cls.scanning_parameters_stale, cls.filter_parameters_stale,
             cls.min_peak_frequency, cls.default_bin_buffer,
-            cls.bin_estimator_parameters_stale, cls.last_updated
+            cls.bin_estimator_parameters_stale, cls.last_updated,
+            cls.baseline_method, cls.baseline_percentile
         )
 
         res = []
@@ -65,7 +66,9 @@ class BinEstimatorLocusParams(ProjectLocusParams):
                 'min_peak_frequency': lp[23],
                 'default_bin_buffer': lp[24],
                 'bin_estimator_parameters_stale': lp[25],
-                'last_updated': lp[26]
+                'last_updated': lp[26],
+                'baseline_method': lp[27],
+                'baseline_percentile': lp[28]
             }
             res.append(r)
         return res
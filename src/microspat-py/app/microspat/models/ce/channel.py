@@ -1,9 +1,10 @@
-from sqlalchemy.ext.mutable import MutableList
+import numpy as np
+from sqlalchemy.ext.mutable import MutableDict
 from sqlalchemy.orm import deferred, reconstructor
 
 from app import db
 
-from app.custom_sql_types.custom_types import CompressedJSONEncodedData
+from app.custom_sql_types.custom_types import BinaryJSONEncodedData, NumericArrayEncodedData
 
 from app.microspat.config import MicroSPATConfig
 
@@ -12,15 +13,21 @@ from app.microspat.fsa_tools.PlateExtractor import ChannelExtractor
 from app.microspat.models.attributes import TimeStamped, Colored, Flaggable
 from app.microspat.models.locus.locus import Locus
 
+from app.microspat.peak_annotator.PeakAnnotators import annotate_crosstalk_neighbour_max
+
 from app.microspat.peak_annotator.PeakFilters import (
     base_size_filter,
     bleedthrough_filter,
+    compose_filters,
     crosstalk_filter,
     peak_height_filter,
     peak_proximity_filter,
     relative_peak_height_filter,
+    relative_peak_height_fixed_point_filter,
 )
 
+from app.microspat.signal_processor.SignalProcessor import summary_max
+
 
 class Channel(ChannelExtractor, TimeStamped, Colored, Flaggable, db.Model):
     """
@@ -29,7 +36,8 @@ class Channel(ChannelExtractor, TimeStamped, Colored, Flaggable, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     well_id = db.Column(db.Integer, db.ForeignKey("well.id", ondelete="CASCADE"), index=True)
     wavelength = db.Column(db.Integer, nullable=False)
-    data = deferred(db.Column(MutableList.as_mutable(CompressedJSONEncodedData)))
+    data = deferred(db.Column(NumericArrayEncodedData))
+    trace_summary = deferred(db.Column(MutableDict.as_mutable(BinaryJSONEncodedData)))
     max_data_point = db.Column(db.Integer, default=0)
     ignored = db.Column(db.Boolean, default=False, nullable=False)
     annotations = db.relationship('ProjectChannelAnnotations', lazy='select', cascade='save-update, merge, delete',
@@ -81,7 +89,7 @@ class Channel(ChannelExtractor, TimeStamped, Colored, Flaggable, db.Model):
             }
             if not ignore_data:
                 r.update({
-                    'data': c[9],
+                    'data': c[9].tolist() if c[9] is not None else None,
                 })
             res.append(r)
         return res
@@ -101,22 +109,67 @@ class Channel(ChannelExtractor, TimeStamped, Colored, Flaggable, db.Model):
         self.locus_id = None
 
     def filter_to_locus_range(self):
-        self.filter_annotated_peaks(
-            base_size_filter(min_size=self.locus.min_base_length, max_size=self.locus.max_base_length))
+        self.filter_annotated_peaks(self.locus_range_filter())
+
+    def locus_range_filter(self):
+        return base_size_filter(min_size=self.locus.min_base_length, max_size=self.locus.max_base_length)
+
+    def locus_scan_range(self):
+        """
+        Indices of the trace sized within the locus range, the only indices whose peaks pass filter_to_locus_range.
+        :return: (start, stop) indices, or None if the whole trace must be scanned
+        """
+        base_sizes = self.well.base_sizes
+        if self.locus is None or base_sizes is None or not len(base_sizes):
+            return None
+        base_sizes = np.asarray(base_sizes, dtype=np.float64)
+        if not np.all(np.diff(base_sizes) >= 0):
+            return None
+        return (int(np.searchsorted(base_sizes, self.locus.min_base_length, side='left')),
+                int(np.searchsorted(base_sizes, self.locus.max_base_length, side='right')))
 
     def pre_annotate_and_filter(self, filter_params):
+        """
+        Annotations of each peak do not depend on the other peaks, so all are annotated before the peak filters are
+        applied together in a single pass.
+        """
         self.annotate_base_sizes()
-        self.filter_to_locus_range()
         self.annotate_peak_heights()
-        self.filter_annotated_peaks(peak_height_filter(min_height=filter_params['min_peak_height'],
-                                                       max_height=filter_params['max_peak_height']))
         self.annotate_bleedthrough()
-        self.filter_annotated_peaks(bleedthrough_filter(max_bleedthrough_ratio=filter_params['max_bleedthrough']))
         self.annotate_crosstalk()
-        self.filter_annotated_peaks(crosstalk_filter(max_crosstalk_ratio=filter_params['max_crosstalk']))
+        self.filter_annotated_peaks(compose_filters(
+            self.locus_range_filter(),
+            peak_height_filter(min_height=filter_params['min_peak_height'],
+                               max_height=filter_params['max_peak_height']),
+            bleedthrough_filter(max_bleedthrough_ratio=filter_params['max_bleedthrough']),
+            crosstalk_filter(max_crosstalk_ratio=filter_params['max_crosstalk'])
+        ))
         self.filter_annotated_peaks(peak_proximity_filter(min_peak_distance=filter_params['min_peak_distance']))
         self.annotate_peak_area()
 
+    def post_annotate_and_filter(self, filter_params):
+        """
+        Same peaks and annotations as repeating post_annotate_peaks and post_filter_peaks until no more peaks are
+        removed.
+        """
+        self.filter_annotated_peaks(
+            relative_peak_height_fixed_point_filter(min_relative_peak_height=filter_params['min_peak_height_ratio']))
+        self.post_annotate_peaks()
+
+    def annotate_crosstalk(self, max_capillary_distance=2, idx_dist=1):
+        """
+        Look up neighbouring signal computed once for the whole plate, falling back to annotating from the neighbouring
+        channels when the plate's signal could not be precomputed for this well.
+        """
+        from app.microspat.models.ce.plate_crosstalk import PlateCrosstalk
+
+        neighbour_max = PlateCrosstalk.get(self.well.plate_id, self.color, max_capillary_distance,
+                                           idx_dist).well_neighbour_max(self.well.well_label)
+        if neighbour_max is None:
+            return super(Channel, self).annotate_crosstalk(max_capillary_distance, idx_dist)
+        self.pre_annotate_peak_indices(annotate_crosstalk_neighbour_max(neighbour_max, idx_dist))
+        return self
+
     def post_annotate_peaks(self):
         self.annotate_relative_peak_heights()
         self.annotate_relative_peak_area()
@@ -143,11 +196,24 @@ class Channel(ChannelExtractor, TimeStamped, Colored, Flaggable, db.Model):
             while self.well.base_sizes[self.well.ladder_peak_indices[j]] < self.locus.min_base_length:
                 j += 1
             i = self.well.ladder_peak_indices[j - 1]
+            start = stop = None
             while self.well.base_sizes[i] < self.locus.max_base_length:
                 i += 1
                 if self.well.base_sizes[i] > self.locus.min_base_length:
-                    if self.data[i] > self.max_data_point:
-                        self.max_data_point = self.data[i]
+                    if start is None:
+                        start = i
+                    stop = i + 1
+            if start is not None:
+                self.max_data_point = max(self.max_data_point or 0, self.data_max(start, stop))
+
+    def data_max(self, start, stop):
+        """
+        Maximum of the trace between start and stop.  Uses the envelope of the trace summary when available, the trace
+        is only loaded when an envelope bucket partly outside of the range could hold the maximum.
+        """
+        if self.trace_summary:
+            return summary_max(self.trace_summary, start, stop, lambda a, b: int(np.max(self.data[a:b])))
+        return int(np.max(self.data[start:stop]))
 
     def check_contamination(self):
         if self.sample.designation == 'negative_control':
@@ -176,13 +242,14 @@ class Channel(ChannelExtractor, TimeStamped, Colored, Flaggable, db.Model):
     def non_recursive_details(self):
         res = self.serialize()
         res.update({
-            'data': self.data
+            'data': self.data.tolist() if self.data is not None else None
         })
+        return res
 
     def serialize_details(self):
         res = self.serialize()
         res.update({
-            'data': self.data,
+            'data': self.data.tolist() if self.data is not None else None,
             'other_channels': [_.non_recursive_details() for _ in self.other_channels]
         })
 
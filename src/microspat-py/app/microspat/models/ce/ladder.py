@@ -1,4 +1,5 @@
 from sqlalchemy.ext.mutable import MutableList
+from sqlalchemy.orm import validates
 
 from app import db
 from app.custom_sql_types.custom_types import CompressedJSONEncodedData
@@ -22,12 +23,18 @@ class Ladder(PeakScanner, Colored, TimeStamped, db.Model):
     maximum_missing_peak_count = db.Column(db.Integer, default=5, nullable=False)
     allow_bleedthrough = db.Column(db.Boolean, default=True, nullable=False)
     remove_outliers = db.Column(db.Boolean, default=True, nullable=False)
+    sizing_method = db.Column(db.Text, default='combinatorial', nullable=False)
 
     __table_args__ = {'sqlite_autoincrement': True}
 
     def __repr__(self):
         return "<Ladder {} {}>".format(self.label, self.color.capitalize())
 
+    @validates('sizing_method')
+    def validate_sizing_method(self, _, sizing_method):
+        assert sizing_method in ['combinatorial', 'alignment']
+        return sizing_method
+
     @property
     def filter_parameters(self):
         return {
@@ -39,6 +46,7 @@ class Ladder(PeakScanner, Colored, TimeStamped, db.Model):
             'maximum_missing_peak_count': self.maximum_missing_peak_count,
             'allow_bleedthrough': self.allow_bleedthrough,
             'remove_outliers': self.remove_outliers,
+            'sizing_method': self.sizing_method,
         }
 
     @property
@@ -51,7 +59,8 @@ class Ladder(PeakScanner, Colored, TimeStamped, db.Model):
             'outlierLimit': self.outlier_limit,
             'maximumMissingPeakCount': self.maximum_missing_peak_count,
             'allowBleedthrough': self.allow_bleedthrough,
-            'removeOutliers': self.remove_outliers
+            'removeOutliers': self.remove_outliers,
+            'sizingMethod': self.sizing_method
         }
 
     def v2_serialize(self):
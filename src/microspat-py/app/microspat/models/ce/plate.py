@@ -2,12 +2,12 @@ import csv
 from collections import defaultdict
 from datetime import datetime
 
-from sqlalchemy.ext.mutable import MutableList
+from sqlalchemy import select
 from sqlalchemy.orm import deferred, validates, reconstructor
 
 from app import db, socketio
 
-from app.custom_sql_types.custom_types import CompressedJSONEncodedData
+from app.custom_sql_types.custom_types import NumericArrayEncodedData
 
 from app.microspat.fsa_tools.PlateExtractor import ExtractedPlate
 
@@ -17,6 +17,7 @@ from app.microspat.models.sample.sample import Sample
 from app.microspat.models.ce.well import Well
 from app.microspat.models.ce.channel import Channel
 from app.microspat.models.ce.ladder import Ladder
+from app.microspat.models.utils import sizing_digest
 
 
 class Plate(ExtractedPlate, TimeStamped, Flaggable, db.Model):
@@ -34,10 +35,10 @@ class Plate(ExtractedPlate, TimeStamped, Flaggable, db.Model):
                             lazy="select")
     plate_hash = db.Column(db.String(32), nullable=False, unique=True, index=True)
 
-    power = deferred(db.Column(MutableList.as_mutable(CompressedJSONEncodedData)))
-    current = deferred(db.Column(MutableList.as_mutable(CompressedJSONEncodedData)))
-    voltage = deferred(db.Column(MutableList.as_mutable(CompressedJSONEncodedData)))
-    temperature = deferred(db.Column(MutableList.as_mutable(CompressedJSONEncodedData)))
+    power = deferred(db.Column(NumericArrayEncodedData))
+    current = deferred(db.Column(NumericArrayEncodedData))
+    voltage = deferred(db.Column(NumericArrayEncodedData))
+    temperature = deferred(db.Column(NumericArrayEncodedData))
 
     __table_args__ = {'sqlite_autoincrement': True}
 
@@ -100,6 +101,7 @@ class Plate(ExtractedPlate, TimeStamped, Flaggable, db.Model):
             w = Well(well_label=well.well_label, comments=well.comments, base_sizes=well.base_sizes,
                      ladder_peak_indices=well.ladder_peak_indices, sizing_quality=well.sizing_quality,
                      offscale_indices=well.offscale_indices, fsa_hash=well.fsa_hash)
+            w.sizing_digest = sizing_digest(well.base_sizes)
 
             w.plate = p
             w.ladder = ladder
@@ -107,12 +109,64 @@ class Plate(ExtractedPlate, TimeStamped, Flaggable, db.Model):
             socketio.sleep()
 
             for channel in well.channels:
-                c = Channel(wavelength=channel.wavelength, data=channel.data, color=channel.color)
+                c = Channel(wavelength=channel.wavelength, data=channel.data, color=channel.color,
+                            trace_summary=getattr(channel, 'trace_summary', None))
                 c.well = w
                 db.session.add(c)
                 socketio.sleep()
         return p
 
+    @classmethod
+    def bulk_from_extracted_plate(cls, extracted_plate, ladder):
+        """
+        Insert an extracted plate with a single executemany each for its wells and channels, within the current
+        session transaction.  No ORM objects are created and no per row insert events are fired, so callers are
+        responsible for notifying clients of the new plate.
+        :param extracted_plate: ExtractedPlate
+        :param ladder: Ladder used to size the wells
+        :return: id of the inserted plate
+        """
+        assert extracted_plate.well_arrangement in [96, 384]
+        plate_id = db.session.execute(cls.__table__.insert().values(
+            label=extracted_plate.label, comments=extracted_plate.comments, creator=extracted_plate.creator,
+            date_run=extracted_plate.date_run, well_arrangement=extracted_plate.well_arrangement,
+            ce_machine=extracted_plate.ce_machine, plate_hash=extracted_plate.plate_hash,
+            current=extracted_plate.current, voltage=extracted_plate.voltage,
+            temperature=extracted_plate.temperature, power=extracted_plate.power
+        )).inserted_primary_key[0]
+
+        wells = [{
+            'plate_id': plate_id,
+            'ladder_id': ladder.id,
+            'well_label': well.well_label,
+            'comments': well.comments,
+            'base_sizes': well.base_sizes,
+            'sizing_digest': sizing_digest(well.base_sizes),
+            'ladder_peak_indices': well.ladder_peak_indices,
+            'sizing_quality': well.sizing_quality,
+            'offscale_indices': well.offscale_indices,
+            'fsa_hash': well.fsa_hash
+        } for well in extracted_plate.wells]
+        if wells:
+            db.session.execute(Well.__table__.insert(), wells)
+        socketio.sleep()
+
+        well_ids = dict(db.session.execute(
+            select([Well.fsa_hash, Well.id]).where(Well.plate_id == plate_id)
+        ).fetchall())
+
+        channels = [{
+            'well_id': well_ids[well.fsa_hash],
+            'wavelength': channel.wavelength,
+            'data': channel.data,
+            'color': channel.color,
+            'trace_summary': getattr(channel, 'trace_summary', None)
+        } for well in extracted_plate.wells for channel in well.channels]
+        if channels:
+            db.session.execute(Channel.__table__.insert(), channels)
+        socketio.sleep()
+        return plate_id
+
     @classmethod
     def from_zip(cls, zip_file, ladder, creator=None, comments=None, add_to_db=True):
         extracted_plate = ExtractedPlate.from_zip(zip_file, creator, comments)
@@ -139,6 +193,7 @@ class Plate(ExtractedPlate, TimeStamped, Flaggable, db.Model):
             w = Well(well_label=well.well_label, comments=well.comments, base_sizes=well.base_sizes,
                      ladder_peak_indices=well.ladder_peak_indices, sizing_quality=well.sizing_quality,
                      offscale_indices=well.offscale_indices, fsa_hash=well.fsa_hash)
+            w.sizing_digest = sizing_digest(well.base_sizes)
 
             w.plate = p
             w.ladder = ladder
@@ -147,7 +202,8 @@ class Plate(ExtractedPlate, TimeStamped, Flaggable, db.Model):
                 db.session.add(w)
 
             for channel in well.channels:
-                c = Channel(wavelength=channel.wavelength, data=channel.data, color=channel.color)
+                c = Channel(wavelength=channel.wavelength, data=channel.data, color=channel.color,
+                            trace_summary=getattr(channel, 'trace_summary', None))
                 c.well = w
                 if add_to_db:
                     db.session.add(c)
@@ -0,0 +1,65 @@
+from collections import OrderedDict
+
+from app import db
+
+from app.microspat.config import MicroSPATConfig
+
+from app.microspat.fsa_tools.PlateExtractor import capillary_neighbours
+from app.microspat.peak_annotator.PeakAnnotators import crosstalk_neighbour_max, cumulative_sums
+
+from app.microspat.models.ce.channel import Channel
+from app.microspat.models.ce.plate import Plate
+from app.microspat.models.ce.well import Well
+
+
+class PlateCrosstalk(object):
+    """
+    Largest neighbouring signal at every index of every trace of a plate in one color, computed from a single query
+    for the plate's traces, from which crosstalk ratios are found at the peaks of each channel.  Plate data is
+    immutable and plate ids are never reused, so results are kept in an LRU cache shared by all projects referencing
+    the plate.
+    """
+    _cache = OrderedDict()
+    max_size = MicroSPATConfig.CROSSTALK_CACHE_SIZE
+
+    def __init__(self, plate_id, color, max_capillary_distance=2, idx_dist=1):
+        self.plate_id = plate_id
+        self.color = color
+        self.max_capillary_distance = max_capillary_distance
+        self.idx_dist = idx_dist
+        self.neighbour_max = self.calculate_neighbour_max()
+
+    @classmethod
+    def get(cls, plate_id, color, max_capillary_distance=2, idx_dist=1):
+        key = (plate_id, color, max_capillary_distance, idx_dist)
+        if key in cls._cache:
+            cls._cache.move_to_end(key)
+        else:
+            cls._cache[key] = cls(plate_id, color, max_capillary_distance, idx_dist)
+            while len(cls._cache) > cls.max_size:
+                cls._cache.popitem(last=False)
+        return cls._cache[key]
+
+    @classmethod
+    def clear(cls):
+        cls._cache.clear()
+
+    def calculate_neighbour_max(self):
+        well_arrangement = db.session.query(Plate.well_arrangement).filter(Plate.id == self.plate_id).scalar()
+        traces = db.session.query(Well.well_label, Channel.data).filter(
+            Channel.well_id == Well.id, Well.plate_id == self.plate_id, Channel.color == self.color
+        ).all()
+        trace_sums = {well_label: cumulative_sums(data if data is not None else []) for well_label, data in traces}
+        neighbours = capillary_neighbours(well_arrangement, self.max_capillary_distance)
+
+        neighbour_max = {}
+        for well_label, data_sums in trace_sums.items():
+            surrounding_signal = [trace_sums[_] for _ in neighbours.get(well_label, []) if _ in trace_sums]
+            neighbour_max[well_label] = crosstalk_neighbour_max(data_sums, surrounding_signal, self.idx_dist)
+        return neighbour_max
+
+    def well_neighbour_max(self, well_label):
+        """
+        :return: array of neighbouring signal by index, or None if it could not be precomputed for the well
+        """
+        return self.neighbour_max.get(well_label)
@@ -1,13 +1,15 @@
+from sqlalchemy import bindparam, select
 from sqlalchemy.ext.mutable import MutableList
 from sqlalchemy.orm import deferred, reconstructor
 
 from app import db
 
-from app.custom_sql_types.custom_types import CompressedJSONEncodedData
+from app.custom_sql_types.custom_types import CompressedJSONEncodedData, FixedPointEncodedData
 
 from app.microspat.fsa_tools.PlateExtractor import WellExtractor
 
 from app.microspat.models.attributes import TimeStamped, Flaggable
+from app.microspat.models.utils import sizing_digest
 
 
 class Well(WellExtractor, TimeStamped, Flaggable, db.Model):
@@ -17,9 +19,10 @@ class Well(WellExtractor, TimeStamped, Flaggable, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     plate_id = db.Column(db.Integer, db.ForeignKey("plate.id", ondelete="CASCADE"), nullable=False, index=True)
     well_label = db.Column(db.String(3), nullable=False)
-    base_sizes = deferred(db.Column(MutableList.as_mutable(CompressedJSONEncodedData)))
+    base_sizes = deferred(db.Column(FixedPointEncodedData))
     ladder_peak_indices = db.Column(MutableList.as_mutable(CompressedJSONEncodedData))
     sizing_quality = db.Column(db.Float, default=1000)
+    sizing_digest = db.Column(db.String(32))
     channels = db.relationship('Channel', backref=db.backref('well'),
                                cascade='save-update, merge, delete, delete-orphan')
     offscale_indices = db.Column(MutableList.as_mutable(CompressedJSONEncodedData))
@@ -36,6 +39,21 @@ class Well(WellExtractor, TimeStamped, Flaggable, db.Model):
         else:
             return "<Well {0}>".format(self.well_label)
 
+    @classmethod
+    def store_missing_sizing_digests(cls, batch_size=500):
+        """
+        Store the sizing digest of wells sized by versions that did not record it.
+        :return: number of wells updated
+        """
+        update = cls.__table__.update().where(cls.id == bindparam('_id')).values(sizing_digest=bindparam('_digest'))
+        ids = [_[0] for _ in db.engine.execute(
+            select([cls.id]).where(cls.sizing_digest.is_(None)).where(cls.base_sizes.isnot(None)))]
+        for i in range(0, len(ids), batch_size):
+            rows = db.engine.execute(select([cls.id, cls.base_sizes]).where(cls.id.in_(ids[i:i + batch_size])))
+            db.engine.execute(update, [{'_id': well_id, '_digest': sizing_digest(base_sizes)}
+                                       for well_id, base_sizes in rows])
+        return len(ids)
+
     @reconstructor
     def init_on_load(self):
         super(Well, self).__init__(well_label=self.well_label, comments=self.comments, base_sizes=self.base_sizes,
@@ -54,6 +72,7 @@ class Well(WellExtractor, TimeStamped, Flaggable, db.Model):
                                                base_size_precision=base_size_precision,
                                                sq_limit=sq_limit, filter_parameters=filter_parameters,
                                                scanning_parameters=scanning_parameters)
+        self.sizing_digest = sizing_digest(self.base_sizes)
         for channel in self.channels:
             channel.find_max_data_point()
             for annotation in channel.annotations:
@@ -80,6 +99,6 @@ class Well(WellExtractor, TimeStamped, Flaggable, db.Model):
         res = self.serialize()
         res.update({
             'ladder_peak_indices': self.ladder_peak_indices,
-            'base_sizes': self.base_sizes
+            'base_sizes': self.base_sizes.tolist() if self.base_sizes is not None else None
         })
         return res
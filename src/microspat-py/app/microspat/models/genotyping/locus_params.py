@@ -59,7 +59,8 @@ class GenotypingLocusParams(ProjectLocusParams):
             cls.bleedthrough_filter_limit, cls.crosstalk_filter_limit,
             cls.relative_peak_height_limit, cls.absolute_peak_height_limit, cls.failure_threshold,
             cls.probability_threshold, cls.bootstrap_probability_threshold,
-            cls.genotyping_parameters_stale, cls.last_updated
+            cls.genotyping_parameters_stale, cls.last_updated,
+            cls.baseline_method, cls.baseline_percentile
         )
 
         res = []
@@ -99,7 +100,9 @@ class GenotypingLocusParams(ProjectLocusParams):
                 'probability_threshold': lp[31],
                 'bootstrap_probability_threshold': lp[32],
                 'genotyping_parameters_stale': lp[33],
-                'last_updated': lp[34]
+                'last_updated': lp[34],
+                'baseline_method': lp[35],
+                'baseline_percentile': lp[36]
             }
             res.append(r)
         return res
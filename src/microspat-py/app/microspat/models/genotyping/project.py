@@ -138,19 +138,12 @@ class GenotypingProject(SampleBasedProject, ArtifactEstimating, QuantificationBi
         return self
 
     def filter_parameters_set_stale(self, locus_id):
-        channel_annotations = self.get_locus_channel_annotations(locus_id)
+        # Channel annotations are left in place, recalculate_locus compares their fingerprints to find those needing
+        # recalculation and reannotates the rest.
         self.clear_sample_annotations(locus_id)
-        for c in channel_annotations:
-            assert isinstance(c, ProjectChannelAnnotations)
-            c.annotated_peaks = []
-            c.clear_flags()
         return self
 
     def scanning_parameters_set_stale(self, locus_id):
-        channel_annotations = self.get_locus_channel_annotations(locus_id)
-        for c in channel_annotations:
-            assert isinstance(c, ProjectChannelAnnotations)
-            c.peak_indices = []
         return self
 
     def annotate_channel(self, channel_annotation):
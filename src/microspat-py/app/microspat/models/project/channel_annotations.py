@@ -2,7 +2,7 @@ from sqlalchemy.ext.mutable import MutableList
 
 from app import db
 
-from app.custom_sql_types.custom_types import CompressedJSONEncodedData
+from app.custom_sql_types.custom_types import CompressedJSONEncodedData, NumericArrayEncodedData
 
 from app.microspat.models.attributes import TimeStamped, Flaggable
 
@@ -17,7 +17,9 @@ class ProjectChannelAnnotations(TimeStamped, Flaggable, db.Model):
     channel_id = db.Column(db.Integer, db.ForeignKey("channel.id", ondelete="CASCADE"), index=True, nullable=False)
     project_id = db.Column(db.Integer, db.ForeignKey("project.id", ondelete="CASCADE"), index=True, nullable=False)
     annotated_peaks = db.Column(MutableList.as_mutable(CompressedJSONEncodedData), default=[])
-    peak_indices = db.Column(MutableList.as_mutable(CompressedJSONEncodedData), default=[])
+    peak_indices = db.Column(NumericArrayEncodedData, default=[])
+    scanning_fingerprint = db.Column(db.String(32))
+    filter_fingerprint = db.Column(db.String(32))
     __table_args__ = (
         db.UniqueConstraint('project_id', 'channel_id', name='_project_channel_uc'),
         {'sqlite_autoincrement': True}
@@ -50,6 +52,8 @@ class ProjectChannelAnnotations(TimeStamped, Flaggable, db.Model):
     def reinitialize(self):
         self.annotated_peaks = []
         self.peak_indices = []
+        self.scanning_fingerprint = None
+        self.filter_fingerprint = None
         return self
 
     def serialize(self):
@@ -0,0 +1,42 @@
+import copy
+from collections import OrderedDict
+
+import numpy as np
+
+from app.microspat.config import MicroSPATConfig
+
+
+class ChannelResultCache(object):
+    """
+    Peak indices and annotated peaks of channels, keyed on the channel id and digests of the well sizing, scanning
+    parameters and filter parameters.  Channel traces are immutable and channel ids are never reused, so entries never
+    need invalidating and are shared by all projects analyzing the channel.
+    """
+    _cache = OrderedDict()
+    max_size = MicroSPATConfig.CHANNEL_RESULT_CACHE_SIZE
+
+    @classmethod
+    def get(cls, key):
+        """
+        :return: (peak indices, annotated peaks), copied so that callers may annotate them, or None if not cached
+        """
+        if key not in cls._cache:
+            return None
+        cls._cache.move_to_end(key)
+        peak_indices, annotated_peaks = cls._cache[key]
+        return peak_indices.copy(), copy.deepcopy(annotated_peaks)
+
+    @classmethod
+    def contains(cls, key):
+        return key in cls._cache
+
+    @classmethod
+    def set(cls, key, peak_indices, annotated_peaks):
+        cls._cache[key] = (np.array(peak_indices, dtype=int).reshape(-1), copy.deepcopy(annotated_peaks))
+        cls._cache.move_to_end(key)
+        while len(cls._cache) > cls.max_size:
+            cls._cache.popitem(last=False)
+
+    @classmethod
+    def clear(cls):
+        cls._cache.clear()
@@ -7,9 +7,13 @@ from app.microspat.models.locus.locus import Locus
 from app.microspat.models.locus.locus_set import LocusSet, locus_set_association_table
 from app.microspat.models.ce.channel import Channel
 from app.microspat.models.ce.well import Well
+from app.microspat.models.ce.ladder import Ladder
 from app.microspat.models.attributes import LocusSetAssociatedMixin, TimeStamped
 from app.microspat.models.project.locus_params import ProjectLocusParams
 from app.microspat.models.project.channel_annotations import ProjectChannelAnnotations
+from app.microspat.models.project.channel_results import ChannelResultCache
+from app.microspat.models.utils import params_fingerprint
+from app.microspat.signal_processor.TraceProcessor import BatchMicrosatelliteProcessor
 
 
 class Project(LocusSetAssociatedMixin, TimeStamped, db.Model):
@@ -204,27 +208,102 @@ class Project(LocusSetAssociatedMixin, TimeStamped, db.Model):
         else:
             channel_annotation.set_flag('poor_sizing_quality', False)
 
-        if channel.well.base_sizes:
-            filter_params = self.get_filter_parameters(channel.locus_id)
-            if rescan_peaks:
-                scanning_params = self.get_scanning_parameters(channel.locus_id)
-                channel.identify_peak_indices(scanning_params)
-                channel_annotation.peak_indices = channel.peak_indices
-            else:
-                channel.set_peak_indices(channel_annotation.peak_indices)
-            channel.pre_annotate_and_filter(filter_params)
+        result_key = self.channel_result_key(channel_annotation)
+        scanning_fingerprint, filter_fingerprint = self.channel_fingerprints(channel_annotation, result_key=result_key)
 
-            total_peaks = -1
-            while len(channel.peaks) != total_peaks:
+        if channel.well.base_sizes is not None and len(channel.well.base_sizes):
+            cached_result = ChannelResultCache.get(result_key)
+            if cached_result is not None:
+                channel_annotation.peak_indices, channel_annotation.annotated_peaks = cached_result
+            else:
+                filter_params = self.get_filter_parameters(channel.locus_id)
+                if rescan_peaks or channel_annotation.scanning_fingerprint != scanning_fingerprint:
+                    scanning_params = self.get_scanning_parameters(channel.locus_id)
+                    channel.identify_peak_indices(scanning_params, channel.locus_scan_range())
+                    channel_annotation.peak_indices = channel.peak_indices
+                else:
+                    channel.set_peak_indices(channel_annotation.peak_indices)
+                channel.pre_annotate_and_filter(filter_params)
                 socketio.sleep()
-                channel.post_annotate_peaks()
-                channel.post_filter_peaks(filter_params)
-                total_peaks = len(channel.peaks)
+                channel.post_annotate_and_filter(filter_params)
 
-            channel_annotation.annotated_peaks = channel.peaks[:]
+                channel_annotation.annotated_peaks = channel.peaks.to_dicts()
+                ChannelResultCache.set(result_key, channel_annotation.peak_indices, channel_annotation.annotated_peaks)
+
+        channel_annotation.scanning_fingerprint = scanning_fingerprint
+        channel_annotation.filter_fingerprint = filter_fingerprint
 
         return channel_annotation
 
+    def channel_result_key(self, channel_annotation, locus_parameters=None):
+        """
+        Key of the channel's peaks in the ChannelResultCache.  The channel trace and those of its neighbours are
+        immutable, leaving the well sizing, the channel's locus assignment and the locus parameters.
+        :return: (channel id, sizing digest, scanning digest, filter digest)
+        """
+        channel = channel_annotation.channel
+        locus = channel.locus
+        if locus_parameters is None:
+            locus_parameters = self.get_locus_parameters(channel.locus_id)
+        return self.result_key(channel.id, channel.well.sizing_digest, channel.locus_id,
+                               locus.min_base_length if locus else None, locus.max_base_length if locus else None,
+                               locus_parameters)
+
+    @staticmethod
+    def result_key(channel_id, sizing_digest, locus_id, min_base_length, max_base_length, locus_parameters):
+        return (
+            channel_id,
+            sizing_digest,
+            params_fingerprint(locus_id, min_base_length, max_base_length, locus_parameters.scanning_parameters),
+            params_fingerprint(locus_parameters.filter_parameters)
+        )
+
+    def channel_fingerprints(self, channel_annotation, locus_parameters=None, result_key=None):
+        """
+        Digests of everything the peaks of a channel annotation are calculated from, stored on the annotation once its
+        peaks are calculated.
+        :return: (scanning fingerprint, filter fingerprint), the filter fingerprint covering the scanning fingerprint
+        """
+        well = channel_annotation.channel.well
+        if result_key is None:
+            result_key = self.channel_result_key(channel_annotation, locus_parameters)
+        return self.result_fingerprints(result_key, well.sizing_quality > well.ladder.unusable_sq_limit)
+
+    @staticmethod
+    def result_fingerprints(result_key, poor_sizing_quality):
+        scanning_fingerprint = params_fingerprint(*result_key[:3])
+        filter_fingerprint = params_fingerprint(scanning_fingerprint, result_key[3], poor_sizing_quality)
+        return scanning_fingerprint, filter_fingerprint
+
+    def locus_result_keys(self, locus_id, locus_parameters):
+        """
+        Result keys and fingerprints of all channel annotations of a locus, read with a single column query instead of
+        loading the channel, well and ladder of each annotation.
+        :return: {channel annotation id: (result key, (scanning fingerprint, filter fingerprint))}
+        """
+        rows = db.session.query(
+            ProjectChannelAnnotations.id, Channel.id, Well.sizing_digest, Well.sizing_quality, Ladder.unusable_sq_limit,
+            Locus.min_base_length, Locus.max_base_length
+        ).join(
+            Channel, ProjectChannelAnnotations.channel_id == Channel.id
+        ).join(
+            Well, Channel.well_id == Well.id
+        ).join(
+            Ladder, Well.ladder_id == Ladder.id
+        ).join(
+            Locus, Channel.locus_id == Locus.id
+        ).filter(
+            ProjectChannelAnnotations.project_id == self.id
+        ).filter(
+            Channel.locus_id == locus_id
+        )
+        res = {}
+        for annotation_id, channel_id, digest, sizing_quality, sq_limit, min_base_length, max_base_length in rows:
+            result_key = self.result_key(channel_id, digest, locus_id, min_base_length, max_base_length,
+                                         locus_parameters)
+            res[annotation_id] = result_key, self.result_fingerprints(result_key, sizing_quality > sq_limit)
+        return res
+
     def recalculate_channels(self, channel_annotations, rescan_peaks):
         recalculated_channel_annotations = []
         for channel_annotation in channel_annotations:
@@ -240,7 +319,35 @@ class Project(LocusSetAssociatedMixin, TimeStamped, db.Model):
     def get_scanning_parameters(self, locus_id):
         return self.get_locus_parameters(locus_id).scanning_parameters
 
+    def rescan_channels(self, channel_annotations, scanning_params):
+        """
+        Scan peaks of channel annotations sharing scanning parameters as a single batch, storing the peak indices on
+        the channel annotations.  Channels without base sizes are not scanned, as in recalculate_channel, and peaks are
+        only searched for within the locus range of each channel.
+        """
+        channel_annotations = [_ for _ in channel_annotations
+                               if _.channel.well.base_sizes is not None and len(_.channel.well.base_sizes)]
+        channels = [_.channel for _ in channel_annotations]
+        peak_indices = BatchMicrosatelliteProcessor(channels, scanning_params,
+                                                    [_.locus_scan_range() for _ in channels]).find_peaks()
+        for channel_annotation, channel_peak_indices in zip(channel_annotations, peak_indices):
+            channel_annotation.peak_indices = channel_peak_indices
+            channel_annotation.scanning_fingerprint = self.channel_fingerprints(channel_annotation)[0]
+        return channel_annotations
+
+    def reannotate_channels(self, channel_annotations):
+        """
+        Reapply project level annotations to channel annotations whose peaks are already up to date.  The base project
+        has none.
+        """
+        return channel_annotations
+
     def recalculate_locus(self, locus_id):
+        """
+        Only channel annotations whose fingerprints no longer match are rescanned or refiltered, so adding channels or
+        resizing wells does not recalculate the rest of the locus.  Annotations whose results are already cached, from
+        earlier parameters or another project, are not scanned.
+        """
         locus_parameters = self.get_locus_parameters(locus_id)
         assert isinstance(locus_parameters, ProjectLocusParams)
         locus_parameters.locked = True
@@ -248,15 +355,29 @@ class Project(LocusSetAssociatedMixin, TimeStamped, db.Model):
         socketio.sleep()
         channel_annotations = self.get_locus_channel_annotations(locus_id, append_well=False)
         socketio.sleep()
-        if locus_parameters.scanning_parameters_stale:
-            channel_annotations = self.recalculate_channels(channel_annotations=channel_annotations,
-                                                            rescan_peaks=True)
+        if locus_parameters.scanning_parameters_stale or locus_parameters.filter_parameters_stale:
+            rescan_annotations = []
+            recalculate_annotations = []
+            current_annotations = []
+            result_keys = self.locus_result_keys(locus_id, locus_parameters)
+            for channel_annotation in channel_annotations:
+                result_key, (scanning_fingerprint, filter_fingerprint) = result_keys[channel_annotation.id]
+                if channel_annotation.scanning_fingerprint != scanning_fingerprint and \
+                        not ChannelResultCache.contains(result_key):
+                    rescan_annotations.append(channel_annotation)
+                if channel_annotation.filter_fingerprint != filter_fingerprint:
+                    recalculate_annotations.append(channel_annotation)
+                else:
+                    current_annotations.append(channel_annotation)
             socketio.sleep()
-        else:
-            if locus_parameters.filter_parameters_stale:
-                channel_annotations = self.recalculate_channels(
-                    channel_annotations=channel_annotations,
-                    rescan_peaks=False)
+
+            if rescan_annotations:
+                self.rescan_channels(channel_annotations=rescan_annotations,
+                                     scanning_params=locus_parameters.scanning_parameters)
+                socketio.sleep()
+            self.recalculate_channels(channel_annotations=recalculate_annotations, rescan_peaks=False)
+            socketio.sleep()
+            self.reannotate_channels(current_annotations)
 
         locus_parameters.scanning_parameters_stale = False
         locus_parameters.filter_parameters_stale = False
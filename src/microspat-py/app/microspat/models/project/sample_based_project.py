@@ -254,6 +254,12 @@ class SampleBasedProject(Project):
             self.annotate_channel(channel_annotation)
         return channel_annotations
 
+    def reannotate_channels(self, channel_annotations):
+        for channel_annotation in channel_annotations:
+            socketio.sleep()
+            self.annotate_channel(channel_annotation)
+        return channel_annotations
+
     def serialize(self):
         res = super(SampleBasedProject, self).serialize()
         res.update({
@@ -1,3 +1,8 @@
+import hashlib
+import json
+
+import numpy as np
+
 from sqlalchemy.orm import attributes
 from sqlalchemy.orm.base import object_state
 
@@ -18,3 +23,21 @@ def params_changed(target, params):
             return True
     else:
         return False
+
+
+def params_fingerprint(*params):
+    """
+    :param params: JSON serializable values
+    :return: md5 hex digest identifying the values
+    """
+    return hashlib.md5(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def sizing_digest(base_sizes):
+    """
+    :param base_sizes: base sizes of a well
+    :return: md5 hex digest of the base sizes, or None if unsized
+    """
+    if base_sizes is None:
+        return None
+    return hashlib.md5(np.asarray(base_sizes, dtype=np.float64).tobytes()).hexdigest()
@@ -18,11 +18,11 @@
 
 import numpy as np
 
-from app.microspat.signal_processor.SignalProcessor import smooth_signal, correct_baseline
+from app.microspat.signal_processor.SignalCache import processed_signal
 
 
 def fake_pre_annotation():
-    def fn(data, peak_idx):
+    def fn(data, peak_indices):
         return {}
 
     return fn
@@ -36,53 +36,42 @@ def fake_post_annotation():
 
 
 def annotate_relative(key, label):
-    def fn(peak_annotations):
-        for peak_annotation in peak_annotations:
-            assert key in peak_annotation
-        if peak_annotations:
-            max_val = max([peak_annotation[key] for peak_annotation in peak_annotations])
-            for annotation in peak_annotations:
-                d = {
-                    label: float(annotation[key]) / max(max_val, .000001)
-                }
-                annotation.update(d)
-        return peak_annotations
+    def fn(peak_table):
+        if len(peak_table):
+            assert key in peak_table
+            values = peak_table[key]
+            peak_table[label] = values.astype(float) / max(values.max(), .000001)
+        return peak_table
 
     return fn
 
 
 def annotate_fraction(key, label):
-    def fn(peak_annotations):
-        for peak_annotation in peak_annotations:
-            assert key in peak_annotation
-        if peak_annotations:
-            sum_vals = sum([peak_annotation[key] for peak_annotation in peak_annotations])
-            for annotation in peak_annotations:
-                d = {
-                    label: float(annotation[key]) / sum_vals
-                }
-                annotation.update(d)
-        return peak_annotations
+    def fn(peak_table):
+        if len(peak_table):
+            assert key in peak_table
+            values = peak_table[key]
+            peak_table[label] = values.astype(float) / sum(values.tolist())
+        return peak_table
 
     return fn
 
 
 def annotate_member_of(key, label, member_list):
-    def fn(peak_annotations):
-        for peak_annotation in peak_annotations:
-            assert key in peak_annotation
-        for annotation in peak_annotations:
-            d = {
-                label: annotation[key] in member_list
-            }
-            annotation.update(d)
-        return peak_annotations
+    def fn(peak_table):
+        if len(peak_table):
+            assert key in peak_table
+            peak_table[label] = np.isin(peak_table[key], list(member_list))
+        return peak_table
 
     return fn
 
 
 def annotate_signal_crosstalk(other_traces, idx_dist=1, label='crosstalk_ratio'):
-    def fn(data, peak_index):
+    """
+    Reference implementation of annotate_cumulative_crosstalk, summing the windows around each peak.
+    """
+    def ratio(data, peak_index):
         crosstalk_ratio = 0
         for trace in other_traces:
             if peak_index < len(trace):
@@ -93,25 +82,114 @@ def annotate_signal_crosstalk(other_traces, idx_dist=1, label='crosstalk_ratio')
                 crosstalk_ratio = max(crosstalk_ratio, abs(bleedthrough_strength) / (abs(signal_strength) + 1))
             else:
                 crosstalk_ratio = 0
-        return {label: crosstalk_ratio}
+        return crosstalk_ratio
+
+    def fn(data, peak_indices):
+        return {label: np.array([ratio(data, _) for _ in np.asarray(peak_indices).tolist()], dtype=float)}
+
+    return fn
+
+
+def cumulative_sums(trace):
+    """
+    :return: cumulative sums of the trace with a leading zero, so the sum of trace[i:j] is sums[j] - sums[i]
+    """
+    return np.concatenate(([0], np.cumsum(np.asarray(trace, dtype=np.float64))))
+
+
+def crosstalk_ratios(data_sums, other_trace_sums, peak_indices, idx_dist=1):
+    """
+    Ratios computed by annotate_signal_crosstalk for all peaks at once, from window sums over cumulative sums.
+    :param data_sums: cumulative_sums of the annotated trace
+    :param other_trace_sums: cumulative_sums of each trace that signal may have leaked from
+    :param peak_indices: indices of peaks
+    :return: array of ratios, in the order of peak_indices
+    """
+    peak_indices = np.asarray(peak_indices, dtype=int)
+    data_length = data_sums.size - 1
+    ratios = np.zeros(peak_indices.size)
+    for trace_sums in other_trace_sums:
+        trace_length = trace_sums.size - 1
+        starting_idx = np.clip(peak_indices - idx_dist, 0, trace_length)
+        ending_idx = np.clip(peak_indices + idx_dist, starting_idx, trace_length)
+        signal_strength = data_sums[np.minimum(ending_idx, data_length)] - \
+            data_sums[np.minimum(starting_idx, data_length)]
+        bleedthrough_strength = trace_sums[ending_idx] - trace_sums[starting_idx]
+        ratios = np.where(peak_indices < trace_length,
+                          np.maximum(ratios, np.abs(bleedthrough_strength) / (np.abs(signal_strength) + 1)), 0)
+    return ratios
+
+
+def annotate_cumulative_crosstalk(data_sums, other_trace_sums, idx_dist=1, label='crosstalk_ratio'):
+    """
+    Same annotation as annotate_signal_crosstalk, with every window sum read from cumulative sums computed once per
+    trace.
+    :param data_sums: cumulative_sums of the annotated trace
+    :param other_trace_sums: cumulative_sums of each trace that signal may have leaked from
+    """
+    def fn(data, peak_indices):
+        return {label: crosstalk_ratios(data_sums, other_trace_sums, peak_indices, idx_dist)}
+
+    return fn
+
+
+def crosstalk_neighbour_max(data_sums, other_trace_sums, idx_dist=1):
+    """
+    Largest window sum of the other traces at every index of the trace, from which annotate_crosstalk_neighbour_max
+    gives the ratios of annotate_signal_crosstalk.  Every other trace must be at least as long as the annotated trace,
+    so that the signal window at an index is the same for all of them.  Sums of integer traces are returned in the
+    smallest unsigned integer type holding them, as they are kept for every trace of a plate.
+    :param data_sums: cumulative_sums of the annotated trace
+    :param other_trace_sums: cumulative_sums of each trace that signal may have leaked from
+    :return: array of window sums, or None if any other trace is shorter than the annotated trace
+    """
+    data_length = data_sums.size - 1
+    if any(trace_sums.size < data_sums.size for trace_sums in other_trace_sums):
+        return None
+    idxs = np.arange(data_length)
+    starting_idx = np.maximum(idxs - idx_dist, 0)
+    neighbour_max = np.zeros(data_length)
+    for trace_sums in other_trace_sums:
+        ending_idx = np.clip(idxs + idx_dist, starting_idx, trace_sums.size - 1)
+        neighbour_max = np.maximum(neighbour_max, np.abs(trace_sums[ending_idx] - trace_sums[starting_idx]))
+    if neighbour_max.size and np.array_equal(neighbour_max, np.round(neighbour_max)):
+        neighbour_max = neighbour_max.astype(np.min_scalar_type(int(neighbour_max.max())))
+    return neighbour_max
+
+
+def annotate_crosstalk_neighbour_max(neighbour_max, idx_dist=1, label='crosstalk_ratio'):
+    """
+    Same annotation as annotate_signal_crosstalk, dividing the neighbouring signal precomputed by
+    crosstalk_neighbour_max by the signal of the annotated trace around each peak.
+    :param neighbour_max: crosstalk_neighbour_max of the annotated trace
+    """
+    def fn(data, peak_indices):
+        data_sums = cumulative_sums(data)
+        peak_indices = np.asarray(peak_indices, dtype=int)
+        starting_idx = np.maximum(peak_indices - idx_dist, 0)
+        signal_strength = data_sums[np.clip(peak_indices + idx_dist, starting_idx, data_sums.size - 1)] - \
+            data_sums[starting_idx]
+        return {label: neighbour_max[peak_indices] / (np.abs(signal_strength) + 1)}
 
     return fn
 
 
 def annotate_base_size(base_sizes):
-    def fn(data, peak_index):
+    base_sizes = np.asarray(base_sizes)
+
+    def fn(data, peak_indices):
         assert len(base_sizes) == len(data)
         return {
-            'peak_size': base_sizes[peak_index]
+            'peak_size': base_sizes[peak_indices]
         }
 
     return fn
 
 
 def annotate_peak_height():
-    def fn(data, peak_index):
+    def fn(data, peak_indices):
         return {
-            'peak_height': data[peak_index]
+            'peak_height': np.asarray(data)[peak_indices]
         }
 
     return fn
@@ -125,42 +203,129 @@ def annotate_peak_height_fraction():
     return annotate_fraction('peak_height', 'peak_height_fraction')
 
 
-def annotate_peak_area(data, min_relative_area_contribution=.001, noise_threshold=50):
-    # Pass in data to pre-compute smoothed signal
-    smoothed_data = correct_baseline(smooth_signal(np.array(data)))
-
-    def fn(d, peak_index):
-        left_area = 0
-        right_area = 0
-        i = 0
-
-        while (len(smoothed_data) - peak_index - i > 0 and smoothed_data[
-                peak_index - i] > left_area * min_relative_area_contribution and (
-            smoothed_data[peak_index - i] > smoothed_data[peak_index - i - 2])) \
-                or smoothed_data[peak_index - i] > noise_threshold:
-            left_area += smoothed_data[peak_index - i]
-            i += 1
+def annotate_peak_area(data, min_relative_area_contribution=.001, noise_threshold=50, channel_id=None):
+    """
+    :param data: raw trace
+    :param channel_id: id of the stored channel, used to share the smoothed signal with peak scanning
+    """
+    # Pass in data to pre-compute smoothed signal, shared with peak scanning through the processed signal cache
+    smoothed_data = processed_signal(data, channel_id)
 
-        left_area_tail = int(i)
-        i = 0
+    def fn(d, peak_indices):
+        return peak_areas(smoothed_data, d, peak_indices, min_relative_area_contribution, noise_threshold)
 
-        while ((len(smoothed_data) > peak_index + i + 2) and
-               (smoothed_data[peak_index + i] > right_area * min_relative_area_contribution) and
-               ((smoothed_data[peak_index + i] > smoothed_data[peak_index + i + 2]) or smoothed_data[peak_index + i] > noise_threshold)):
-            right_area += d[peak_index + i]
-            i += 1
-
-        right_area_tail = int(i)
-
-        area = left_area + right_area
+    return fn
 
-        return {
-            'peak_area': area,
-            'left_tail': left_area_tail,
-            'right_tail': right_area_tail
-        }
 
-    return fn
+def peak_area_iterative(smoothed_data, d, peak_index, min_relative_area_contribution=.001, noise_threshold=50):
+    """
+    Walks outwards from the peak one point at a time until the signal stops falling and drops below the noise
+    threshold, or no longer contributes to the area. Reference implementation of peak_areas.
+    """
+    left_area = 0
+    right_area = 0
+    i = 0
+
+    while (len(smoothed_data) - peak_index - i > 0 and smoothed_data[
+            peak_index - i] > left_area * min_relative_area_contribution and (
+        smoothed_data[peak_index - i] > smoothed_data[peak_index - i - 2])) \
+            or smoothed_data[peak_index - i] > noise_threshold:
+        left_area += smoothed_data[peak_index - i]
+        i += 1
+
+    left_area_tail = int(i)
+    i = 0
+
+    while ((len(smoothed_data) > peak_index + i + 2) and
+           (smoothed_data[peak_index + i] > right_area * min_relative_area_contribution) and
+           ((smoothed_data[peak_index + i] > smoothed_data[peak_index + i + 2]) or smoothed_data[peak_index + i] > noise_threshold)):
+        right_area += d[peak_index + i]
+        i += 1
+
+    right_area_tail = int(i)
+
+    area = left_area + right_area
+
+    return {
+        'peak_area': area,
+        'left_tail': left_area_tail,
+        'right_tail': right_area_tail
+    }
+
+
+def peak_areas(smoothed_data, d, peak_indices, min_relative_area_contribution=.001, noise_threshold=50):
+    """
+    Tail boundaries and areas of all peaks at once, giving the same result as peak_area_iterative on each peak. Points
+    that end a tail whatever the area so far are found for the whole trace from the lag 2 slope and the noise
+    threshold. Only points between a peak and that boundary are checked against the area contribution limit, using
+    cumulative sums of the trace.
+    :param smoothed_data: smoothed and baseline corrected trace
+    :param d: raw trace, integrated for the right tail as in peak_area_iterative
+    :param peak_indices: indices of peaks
+    :return: dict of peak_area, left_tail and right_tail arrays, in the order of peak_indices
+    """
+    smoothed_data = np.asarray(smoothed_data, dtype=np.float64)
+    d = np.asarray(d, dtype=np.float64)
+    peak_indices = np.asarray(peak_indices, dtype=int).reshape(-1)
+    n = smoothed_data.size
+    if not peak_indices.size:
+        return {'peak_area': np.zeros(0), 'left_tail': np.zeros(0, dtype=int), 'right_tail': np.zeros(0, dtype=int)}
+
+    in_range = (peak_indices >= 0) & (peak_indices < n)
+    peaks = np.where(in_range, peak_indices, 0)
+    idxs = np.arange(n)
+    above_noise = smoothed_data > noise_threshold
+
+    # Left tail, summing the smoothed trace.  Negative indices wrap as they do when walking the list.
+    rising = smoothed_data > smoothed_data[(idxs - 2) % n]
+    smoothed_sums = np.concatenate(([0], np.cumsum(smoothed_data)))
+    left_stop = np.maximum.accumulate(np.where(above_noise | rising, -1, idxs))[peaks]
+    # Beyond n - peak_index points only the noise threshold extends the left tail.
+    below_noise = np.maximum.accumulate(np.where(above_noise, -1, idxs))
+    limited = 2 * peaks - n >= 0
+    left_stop[limited] = np.maximum(left_stop[limited], below_noise[2 * peaks[limited] - n])
+    seg, pos = _tail_positions(peaks, peaks - left_stop, -1)
+    margin = smoothed_data[pos] - min_relative_area_contribution * (
+        smoothed_sums[peaks[seg] + 1] - smoothed_sums[pos + 1])
+    exhausted = ~above_noise[pos] & (margin <= 0)
+    np.maximum.at(left_stop, seg[exhausted], pos[exhausted])
+    # Differences of cumulative sums carry rounding error that sequential summation does not, so peaks whose tail
+    # depends on a comparison within that error are integrated point by point.
+    rounding_error = 4 * n * np.finfo(np.float64).eps * np.abs(smoothed_data).sum() * min_relative_area_contribution
+    ambiguous = np.zeros(peak_indices.size, dtype=bool)
+    ambiguous[seg[~above_noise[pos] & (np.abs(margin) <= rounding_error) & (pos >= left_stop[seg])]] = True
+    left_area = smoothed_sums[peaks + 1] - smoothed_sums[left_stop + 1]
+
+    # Right tail, summing the raw trace.
+    falling = np.zeros(n, dtype=bool)
+    falling[:-2] = smoothed_data[:-2] > smoothed_data[2:]
+    raw_sums = np.concatenate(([0], np.cumsum(d)))
+    right_stop = np.minimum.accumulate(np.where((falling | above_noise) & (idxs < n - 2), n, idxs)[::-1])[::-1][peaks]
+    seg, pos = _tail_positions(peaks, right_stop - peaks, 1)
+    exhausted = smoothed_data[pos] <= min_relative_area_contribution * (raw_sums[pos] - raw_sums[peaks[seg]])
+    np.minimum.at(right_stop, seg[exhausted], pos[exhausted])
+    right_area = raw_sums[right_stop] - raw_sums[peaks]
+
+    res = {
+        'peak_area': left_area + right_area,
+        'left_tail': peak_indices - left_stop,
+        'right_tail': right_stop - peak_indices
+    }
+    for idx in np.flatnonzero(~in_range | (left_stop < 0) | ambiguous):
+        area = peak_area_iterative(smoothed_data, d, peak_indices[idx], min_relative_area_contribution,
+                                   noise_threshold)
+        for label in res:
+            res[label][idx] = area[label]
+    return res
+
+
+def _tail_positions(peaks, lengths, step):
+    """
+    :return: index of the peak and trace position of every point walked from each peak
+    """
+    seg = np.repeat(np.arange(peaks.size), lengths)
+    offsets = np.arange(seg.size) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return seg, peaks[seg] + step * offsets
 
 
 def annotate_relative_peak_area():
@@ -17,25 +17,45 @@
 """
 
 
-def between_values_filter(lesser, greater, key):
+import numpy as np
+
+from .PeakTable import PeakTable
+
+
+def peak_filter(mask, predicate):
+    """
+    Filter function applying mask to the columns of a PeakTable, or predicate to each peak annotation of any other
+    iterable of peak annotation dicts.
+    Both must depend only on the annotations of each peak, so that filters can be fused by compose_filters.
+    :param mask: function with signature f(peak_table) returning a boolean array, true for the peaks to keep
+    :param predicate: function with signature f(peak_annotation) returning true for a peak to keep
+    :return: peak_filter_fn
+    """
     def fn(peak_annotations):
-        return filter(lambda x: lesser <= x[key] <= greater, peak_annotations)
+        if isinstance(peak_annotations, PeakTable):
+            if not len(peak_annotations):
+                return peak_annotations
+            return peak_annotations.select(mask(peak_annotations))
+        return filter(predicate, peak_annotations)
+    fn.mask = mask
+    fn.predicate = predicate
     return fn
 
 
+def between_values_filter(lesser, greater, key):
+    return peak_filter(lambda t: (lesser <= t[key]) & (t[key] <= greater),
+                       lambda x: lesser <= x[key] <= greater)
+
+
 def less_than_filter(value, key):
-    def fn(peak_annotations):
-        return filter(lambda x: x[key] < value, peak_annotations)
-    return fn
+    return peak_filter(lambda t: t[key] < value, lambda x: x[key] < value)
 
 
 def greater_than_filter(value, key, or_equal=False):
-    def fn(peak_annotations):
-        if or_equal:
-            return filter(lambda x: x[key] >= value, peak_annotations)
-        else:
-            return filter(lambda x: x[key] > value, peak_annotations)
-    return fn
+    if or_equal:
+        return peak_filter(lambda t: t[key] >= value, lambda x: x[key] >= value)
+    else:
+        return peak_filter(lambda t: t[key] > value, lambda x: x[key] > value)
 
 
 def base_size_filter(min_size=0, max_size=1000):
@@ -50,6 +70,30 @@ def relative_peak_height_filter(min_relative_peak_height=0):
     return greater_than_filter(min_relative_peak_height, 'relative_peak_height')
 
 
+def relative_peak_height_fixed_point_filter(min_relative_peak_height=0):
+    """
+    Peaks left by alternately annotating relative peak heights and applying relative_peak_height_filter until no more
+    peaks are removed.  The relative height of every peak is at most that of the tallest peak, so either the tallest
+    peak passes and the maximum height is unchanged by the first pass, or every peak fails.  A single pass against the
+    maximum height therefore reaches the fixed point.
+    :param min_relative_peak_height: minimum ratio of peak height to the maximum peak height
+    :return: peak_filter_fn
+    """
+    def fn(peak_annotations):
+        if isinstance(peak_annotations, PeakTable):
+            if not len(peak_annotations):
+                return peak_annotations
+            peak_heights = peak_annotations['peak_height']
+            return peak_annotations.select(
+                peak_heights.astype(float) / max(peak_heights.max(), .000001) > min_relative_peak_height)
+        peak_annotations = list(peak_annotations)
+        if not peak_annotations:
+            return peak_annotations
+        max_height = max(max([_['peak_height'] for _ in peak_annotations]), .000001)
+        return [_ for _ in peak_annotations if float(_['peak_height']) / max_height > min_relative_peak_height]
+    return fn
+
+
 def bleedthrough_filter(max_bleedthrough_ratio):
     return less_than_filter(max_bleedthrough_ratio, 'bleedthrough_ratio')
 
@@ -63,34 +107,40 @@ def probability_filter(probability_threshold):
 
 
 def artifact_filter(min_peak_height, sd_multiplier):
-    def fn(peak_annotations):
-        return filter(lambda x: (x['peak_height'] - x['artifact_contribution'] - sd_multiplier * x[
-            'artifact_error']) > min_peak_height, peak_annotations)
-    return fn
+    def is_real(x):
+        return (x['peak_height'] - x['artifact_contribution'] - sd_multiplier * x['artifact_error']) > min_peak_height
+    return peak_filter(is_real, is_real)
 
 
 def bin_filter(in_bin):
-    def fn(peak_annotations):
-        return filter(lambda _: _['in_bin'] is in_bin, peak_annotations)
-    return fn
+    def predicate(x):
+        return x['in_bin'] is in_bin
+    return peak_filter(lambda t: _row_mask(predicate, t), predicate)
 
 
 def flag_filter(flag):
-    def fn(peak_annotations):
-        return filter(lambda _: not(_['flags'][flag]), peak_annotations)
-    return fn
+    def predicate(x):
+        return not(x['flags'][flag])
+    return peak_filter(lambda t: _row_mask(predicate, t), predicate)
 
 
 def flags_filter(flags=None):
     if not flags:
-        def fn(peak_annotations):
-            return filter(lambda _: not any(_['flags'].values()), peak_annotations)
-        return fn
+        def predicate(x):
+            return not any(x['flags'].values())
+        return peak_filter(lambda t: _row_mask(predicate, t), predicate)
     else:
         filter_fns = [flag_filter(_) for _ in flags]
         return compose_filters(*filter_fns)
 
 
+def _row_mask(predicate, peak_table):
+    """
+    Mask of a predicate on annotations not held as numbers, evaluated row by row.
+    """
+    return np.fromiter((predicate(_) for _ in peak_table), dtype=bool, count=len(peak_table))
+
+
 def peak_proximity_filter(min_peak_distance):
     """
     Keep tallest peak of peaks that fall within a min_peak_distance of each other.
@@ -98,6 +148,86 @@ def peak_proximity_filter(min_peak_distance):
     :return: peak_filter_fn
     """
 
+    def fn(peak_annotations):
+        if isinstance(peak_annotations, PeakTable):
+            if not len(peak_annotations):
+                return peak_annotations
+            return peak_annotations.select(proximity_filter_rows(peak_annotations['peak_size'],
+                                                                 peak_annotations['peak_height'], min_peak_distance))
+        peak_annotations = list(peak_annotations)
+        rows = proximity_filter_rows([_['peak_size'] for _ in peak_annotations],
+                                     [_['peak_height'] for _ in peak_annotations], min_peak_distance)
+        return [peak_annotations[_] for _ in rows.tolist()]
+
+    return fn
+
+
+def proximity_filter_rows(peak_sizes, peak_heights, min_peak_distance):
+    """
+    Rows kept by peak_proximity_filter_reference, for peaks with distinct peak indices.  Peaks are sorted by size once
+    and split into clusters where consecutive peaks are within min_peak_distance of each other.  A peak alone in its
+    cluster is always kept.  Larger clusters are resolved by the ascending and descending sweeps of the reference,
+    which cannot carry over from one cluster to the next.  Kept peaks are returned by ascending size, followed by
+    peaks kept only by the descending sweep by descending size.
+    :return: array of rows, in the order peak_proximity_filter_reference returns them
+    """
+    peak_sizes = np.asarray(peak_sizes)
+    ascending_rows = np.argsort(peak_sizes, kind='stable')
+    sorted_sizes = peak_sizes[ascending_rows]
+
+    cluster_starts = np.flatnonzero(np.concatenate(([True], np.diff(sorted_sizes) > min_peak_distance)))
+    cluster_stops = np.append(cluster_starts[1:], sorted_sizes.size)
+    ascending_kept = np.zeros(sorted_sizes.size, dtype=bool)
+    ascending_kept[cluster_starts[cluster_stops - cluster_starts == 1]] = True
+    descending_kept = np.zeros(sorted_sizes.size, dtype=bool)
+
+    clustered = cluster_stops - cluster_starts > 1
+    if clustered.any():
+        sorted_sizes_list = sorted_sizes.tolist()
+        sorted_heights = np.asarray(peak_heights)[ascending_rows].tolist()
+        # Equal sizes keep their ascending order in the descending sweep, as in a stable reverse sort
+        tied_sizes = bool((np.diff(sorted_sizes) == 0).any())
+        ascending_positions = []
+        descending_positions = []
+        for start, stop in zip(cluster_starts[clustered].tolist(), cluster_stops[clustered].tolist()):
+            positions = list(range(start, stop))
+            ascending_positions += _proximity_sweep(positions, sorted_sizes_list, sorted_heights, min_peak_distance)
+            if tied_sizes:
+                positions.sort(key=lambda x: sorted_sizes_list[x], reverse=True)
+            else:
+                positions.reverse()
+            descending_positions += _proximity_sweep(positions, sorted_sizes_list, sorted_heights, min_peak_distance)
+        ascending_kept[ascending_positions] = True
+        descending_kept[descending_positions] = True
+
+    descending_kept &= ~ascending_kept
+    return np.concatenate((ascending_rows[ascending_kept], ascending_rows[descending_kept][::-1]))
+
+
+def _proximity_sweep(rows, peak_sizes, peak_heights, min_peak_distance):
+    """
+    :return: rows kept sweeping rows in the given order, each replacing the current peak if it is taller and within
+    min_peak_distance of it
+    """
+    kept_rows = []
+    curr_row = rows[0]
+    for row in rows[1:]:
+        if abs(peak_sizes[row] - peak_sizes[curr_row]) > min_peak_distance:
+            kept_rows.append(curr_row)
+            curr_row = row
+        elif peak_heights[row] > peak_heights[curr_row]:
+            curr_row = row
+    kept_rows.append(curr_row)
+    return kept_rows
+
+
+def peak_proximity_filter_reference(min_peak_distance):
+    """
+    Reference implementation of peak_proximity_filter, on any iterable of peak annotations.
+    :param min_peak_distance: base size distance between two peaks
+    :return: peak_filter_fn
+    """
+
     def fn(peak_annotations):
         filtered_peak_annotations = {}
 
@@ -138,13 +268,54 @@ def peak_proximity_filter(min_peak_distance):
 
 
 def compose_filters(*filters):
+    """
+    Apply filters in order.  Consecutive filters made with peak_filter are compiled into a single filter, evaluating
+    one combined mask over a PeakTable or one combined predicate per peak annotation.
+    """
+    filter_plan = compile_filter_plan(filters)
+
     def f(peak_annotations):
-        for filter_fn in filters:
+        for filter_fn in filter_plan:
             peak_annotations = filter_fn(peak_annotations)
         return peak_annotations
+    if len(filter_plan) == 1 and hasattr(filter_plan[0], 'mask'):
+        f.mask = filter_plan[0].mask
+        f.predicate = filter_plan[0].predicate
     return f
 
 
+def compile_filter_plan(filters):
+    """
+    :param filters: peak filter functions, in the order they are applied
+    :return: list of filter functions with each run of consecutive peak_filter filters fused into one
+    """
+    filter_plan = []
+    fusable = []
+    for filter_fn in list(filters) + [None]:
+        if filter_fn is not None and hasattr(filter_fn, 'mask'):
+            fusable.append(filter_fn)
+            continue
+        if len(fusable) == 1:
+            filter_plan.append(fusable[0])
+        elif fusable:
+            filter_plan.append(fuse_filters(fusable))
+        fusable = []
+        if filter_fn is not None:
+            filter_plan.append(filter_fn)
+    return filter_plan
+
+
+def fuse_filters(filters):
+    """
+    Single filter keeping the peaks kept by every one of filters.  Masks are evaluated over every peak, so must be
+    defined for peaks any earlier filter would have removed.
+    """
+    masks = [_.mask for _ in filters]
+    predicates = [_.predicate for _ in filters]
+    return peak_filter(lambda t: np.logical_and.reduce([mask(t) for mask in masks]),
+                       lambda x: all(predicate(x) for predicate in predicates))
+
+
 def peak_annotations_diff(left, right):
     """
     returns peak annotations of left not contained in right, where peak_annotations are unique by their 'peak_index'
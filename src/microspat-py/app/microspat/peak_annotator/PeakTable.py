@@ -0,0 +1,152 @@
+"""
+    MicroSPAT is a collection of tools for the analysis of Capillary Electrophoresis Data
+    Copyright (C) 2016  Maxwell Murphy
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published
+    by the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+
+
+class PeakTable(object):
+    """
+    Annotated peaks of a channel held as one array per annotation, in place of a list of dicts.  Annotators add
+    columns and filters select rows with boolean masks.  Peaks are converted to dicts with to_dicts only when stored.
+    """
+    __slots__ = ('columns', 'size')
+
+    def __init__(self, columns=None, size=None):
+        """
+        :param columns: dict of annotation label to sequence of values, one per peak
+        :param size: number of peaks, taken from the columns if not given
+        """
+        self.columns = {}
+        if size is None:
+            size = len(next(iter(columns.values()))) if columns else 0
+        self.size = size
+        for label, values in (columns or {}).items():
+            self[label] = values
+
+    @classmethod
+    def from_peak_indices(cls, peak_indices):
+        return cls({'peak_index': np.asarray(peak_indices, dtype=int).reshape(-1)})
+
+    @classmethod
+    def from_dicts(cls, peak_annotations):
+        """
+        :param peak_annotations: list of peak annotation dicts, sharing the same keys
+        """
+        peak_annotations = list(peak_annotations)
+        table = cls(size=len(peak_annotations))
+        for peak_annotation in peak_annotations:
+            for label in peak_annotation:
+                if label not in table.columns:
+                    table[label] = [_.get(label) for _ in peak_annotations]
+        return table
+
+    def to_dicts(self):
+        """
+        :return: list of peak annotation dicts of python values, in row order
+        """
+        labels = list(self.columns)
+        values = [self.columns[_].tolist() for _ in labels]
+        return [dict(zip(labels, row)) for row in zip(*values)] if labels else [{} for _ in range(self.size)]
+
+    @property
+    def peak_indices(self):
+        return self.columns.get('peak_index', np.zeros(0, dtype=int))
+
+    def update(self, columns):
+        for label, values in columns.items():
+            self[label] = values
+        return self
+
+    def select(self, rows):
+        """
+        :param rows: boolean mask or positions of the rows to keep, in the order they are to be kept
+        :return: new table of the selected rows
+        """
+        rows = np.asarray(rows)
+        if rows.dtype != bool:
+            rows = rows.astype(int)
+        table = PeakTable(size=np.arange(self.size)[rows].size)
+        table.columns = {label: values[rows] for label, values in self.columns.items()}
+        return table
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, label):
+        return label in self.columns
+
+    def __getitem__(self, item):
+        if isinstance(item, str):
+            return self.columns[item]
+        if isinstance(item, (int, np.integer)):
+            if not -self.size <= item < self.size:
+                raise IndexError("Peak table row {0} out of range.".format(item))
+            return PeakRow(self, item % self.size)
+        return self.select(item)
+
+    def __setitem__(self, label, values):
+        array = np.asarray(values)
+        if array.ndim == 0:
+            array = np.full(self.size, array.item(), dtype=array.dtype if array.dtype.kind != 'U' else object)
+        elif array.ndim > 1 or array.dtype.kind == 'U':
+            array = np.empty(len(values), dtype=object)
+            for row, value in enumerate(values):
+                array[row] = value
+        values = array
+        if values.size != self.size:
+            raise ValueError("{0} values given for {1} peaks.".format(values.size, self.size))
+        self.columns[label] = values
+
+    def __iter__(self):
+        for row in range(self.size):
+            yield PeakRow(self, row)
+
+    def __repr__(self):
+        return "<PeakTable {0} peaks {1}>".format(self.size, list(self.columns))
+
+
+class PeakRow(object):
+    """
+    Read only view of a single peak of a PeakTable, supporting the dict lookups of per-peak annotations.
+    """
+    __slots__ = ('table', 'row')
+
+    def __init__(self, table, row):
+        self.table = table
+        self.row = row
+
+    def __getitem__(self, label):
+        value = self.table.columns[label][self.row]
+        if isinstance(value, np.generic):
+            value = value.item()
+        return value
+
+    def __contains__(self, label):
+        return label in self.table.columns
+
+    def get(self, label, default=None):
+        return self[label] if label in self else default
+
+    def keys(self):
+        return self.table.columns.keys()
+
+    def to_dict(self):
+        return {label: self[label] for label in self.keys()}
+
+    def __repr__(self):
+        return "<PeakRow {0}>".format(self.to_dict())
@@ -1,3 +1,4 @@
+import numpy as np
 import ujson as json
 from marshmallow import fields
 from marshmallow_sqlalchemy import ModelSchema
@@ -21,6 +22,13 @@ class JSONEncodedField(fields.Field):
         return value
 
 
+class ArrayEncodedField(JSONEncodedField):
+    def _serialize(self, value, attr, obj):
+        if isinstance(value, np.ndarray):
+            value = value.tolist()
+        return value
+
+
 class Flaggable(object):
     flags = JSONEncodedField()
 
@@ -128,15 +136,15 @@ class QuantificationBiasEstimatorLocusParamsSchema(LocusParamsSchema):
 class ProjectChannelAnnotationsSchema(BaseSchema, Flaggable):
     class Meta(BaseSchema.Meta):
         model = ProjectChannelAnnotations
+        exclude = ['peak_indices']
     annotated_peaks = JSONEncodedField()
-    # peak_indices = JSONEncodedField()
 
 
 class DeferredProjectChannelAnnotationsSchema(BaseSchema, Flaggable):
     class Meta(BaseSchema.Meta):
         model = ProjectChannelAnnotations
+        exclude = ['peak_indices']
     annotated_peaks = JSONEncodedField()
-    # peak_indices = JSONEncodedField()
     channel = fields.Integer()
     project = fields.Integer()
 
@@ -212,10 +220,10 @@ class LadderSchema(BaseSchema):
 class PlateSchema(BaseSchema, Flaggable):
     class Meta(BaseSchema.Meta):
         model = Plate
-    power = JSONEncodedField()
-    current = JSONEncodedField()
-    voltage = JSONEncodedField()
-    temperature = JSONEncodedField()
+    power = ArrayEncodedField()
+    current = ArrayEncodedField()
+    voltage = ArrayEncodedField()
+    temperature = ArrayEncodedField()
 
 
 class PlateListSchema(PlateSchema):
@@ -227,7 +235,7 @@ class PlateListSchema(PlateSchema):
 class WellSchema(BaseSchema, Flaggable):
     class Meta(BaseSchema.Meta):
         model = Well
-    base_sizes = JSONEncodedField()
+    base_sizes = ArrayEncodedField()
     ladder_peak_indices = JSONEncodedField()
     offscale_indices = JSONEncodedField()
 
@@ -240,18 +248,20 @@ class WellListSchema(WellSchema):
 class ChannelSchema(BaseSchema, Flaggable):
     class Meta(BaseSchema.Meta):
         model = Channel
-    data = JSONEncodedField()
+        exclude = ['trace_summary']
+    data = ArrayEncodedField()
 
 
 class ChannelListSchema(ChannelSchema):
     class Meta(BaseSchema.Meta):
         model = Channel
-        exclude = ['data']
+        exclude = ['data', 'trace_summary']
 
 
 class DeferredChannelSchema(BaseSchema, Flaggable):
     class Meta(BaseSchema.Meta):
         model = Channel
+        exclude = ['trace_summary']
     locus = fields.Integer()
     well = fields.Integer()
     sample = fields.Integer()
@@ -0,0 +1,131 @@
+"""
+    MicroSPAT is a collection of tools for the analysis of Capillary Electrophoresis Data
+    Copyright (C) 2016  Maxwell Murphy
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published
+    by the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import hashlib
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+from app.microspat.config import MicroSPATConfig
+from .SignalProcessor import smooth_signal, correct_baseline
+
+
+class ProcessedSignalCache(object):
+    """
+    LRU cache of smoothed and baseline corrected traces, keyed on channel id, a digest of the raw trace and the
+    processing parameters. Channel data is immutable once stored, so entries never need invalidating, and the trace
+    digest keeps entries from being reused by an unrelated channel given the same id by a recreated database or by
+    another database sharing cache_dir. If cache_dir is set, entries are also written there as .npy files and reloaded
+    after being evicted or when the application restarts.
+    """
+    def __init__(self, max_size=512, cache_dir=None):
+        self.max_size = max_size
+        self.cache_dir = cache_dir
+        self._entries = OrderedDict()
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _path(self, key):
+        if not self.cache_dir:
+            return None
+        digest = hashlib.md5(repr(key[1:]).encode()).hexdigest()
+        return os.path.join(self.cache_dir, f"{key[0]}-{digest}.npy")
+
+    def get(self, key):
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return self._entries[key]
+        path = self._path(key)
+        if path and os.path.exists(path):
+            try:
+                signal = np.load(path)
+            except (OSError, ValueError):
+                return None
+            return self._insert(key, signal)
+        return None
+
+    def set(self, key, signal):
+        signal = self._insert(key, signal)
+        path = self._path(key)
+        if path and not os.path.exists(path):
+            np.save(path, signal)
+        return signal
+
+    def _insert(self, key, signal):
+        signal = np.array(signal, dtype=np.float64)
+        signal.flags.writeable = False
+        self._entries[key] = signal
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        return signal
+
+    def clear(self):
+        self._entries.clear()
+
+
+processed_signal_cache = ProcessedSignalCache(max_size=MicroSPATConfig.SIGNAL_CACHE_SIZE,
+                                              cache_dir=MicroSPATConfig.SIGNAL_CACHE_DIR)
+
+
+def trace_digest(data):
+    """
+    :param data: raw trace
+    :return: md5 hex digest of the trace values, independent of the integer width they are held in
+    """
+    data = np.asarray(data)
+    data = data.astype(np.int64) if data.dtype.kind in 'biu' else data.astype(np.float64)
+    return hashlib.md5(np.ascontiguousarray(data).tobytes()).hexdigest()
+
+
+def signal_cache_key(channel_id, data, smoothing_window=11, smoothing_order=7, tophat_factor=.005,
+                     baseline_method='tophat', baseline_percentile=10):
+    return (channel_id, trace_digest(data), int(smoothing_window), int(smoothing_order), float(tophat_factor),
+            baseline_method, float(baseline_percentile))
+
+
+def processed_signal(data, channel_id=None, smoothing_window=11, smoothing_order=7, tophat_factor=.005,
+                     baseline_method='tophat', baseline_percentile=10):
+    """
+    Smoothed and baseline corrected trace, read from the processed signal cache when the channel has been processed
+    with the same parameters before.
+    :param data: raw trace
+    :param channel_id: id of the stored channel, None for channels not yet persisted, which are never cached
+    :return: processed trace, read only
+    """
+    if channel_id is None:
+        return _process_signal(data, smoothing_window, smoothing_order, tophat_factor, baseline_method,
+                               baseline_percentile)
+
+    key = signal_cache_key(channel_id, data, smoothing_window, smoothing_order, tophat_factor, baseline_method,
+                           baseline_percentile)
+    signal = processed_signal_cache.get(key)
+    if signal is None:
+        signal = processed_signal_cache.set(key, _process_signal(data, smoothing_window, smoothing_order,
+                                                                 tophat_factor, baseline_method,
+                                                                 baseline_percentile))
+    return signal
+
+
+def _process_signal(data, smoothing_window, smoothing_order, tophat_factor, baseline_method, baseline_percentile):
+    signal = smooth_signal(np.array(data), smoothing_window, smoothing_order)
+    return correct_baseline(signal, tophat_factor, method=baseline_method, percentile=baseline_percentile)
@@ -16,21 +16,284 @@
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+from functools import lru_cache
+
 import numpy as np
 from scipy import ndimage
+from scipy.fftpack import next_fast_len
 from scipy.signal import savgol_filter
+from scipy.stats import scoreatpercentile
 
 
-def smooth_signal(raw_signal, window_size=11, order=7):
+def smooth_signal(raw_signal, window_size=11, order=7, axis=-1):
     """ smooth signal using savitzky_golay algorithm """
-    return savitzky_golay(raw_signal, window_size, order)
+    return savitzky_golay(raw_signal, window_size, order, axis=axis)
+
+
+BASELINE_METHODS = ('tophat', 'rolling_percentile')
+
+
+def baseline_window(signal, tophat_factor=.005, axis=-1):
+    """ width of the baseline structuring element for a signal, at least one sample """
+    return max(int(round(signal.shape[axis] * tophat_factor)), 1)
+
+
+def tophat_baseline(signal, window_size, axis=-1):
+    """
+    Morphological opening of the signal with a flat structuring element, computed as a running minimum followed by a
+    running maximum. Each pass has a constant cost per sample independent of the window size.
+    :param signal: trace or stack of traces
+    :param window_size: width of the structuring element
+    :param axis: axis along which traces run
+    :return: estimated baseline, matching the opening used by ndimage.white_tophat
+    """
+    eroded = ndimage.minimum_filter1d(signal, window_size, axis=axis)
+    # grey_dilation reflects the structuring element, which shifts even width windows by one sample.
+    return ndimage.maximum_filter1d(eroded, window_size, axis=axis, origin=0 if window_size % 2 else -1)
+
+
+def percentile_baseline(signal, window_size, percentile=10, axis=-1):
+    """
+    Rolling percentile of the signal, less sensitive than the opening to isolated low outliers.
+    :param signal: trace or stack of traces
+    :param window_size: width of the rolling window
+    :param percentile: percentile of the window taken as baseline
+    :param axis: axis along which traces run
+    :return: estimated baseline
+    """
+    size = [1] * signal.ndim
+    size[axis] = window_size
+    return ndimage.percentile_filter(signal, percentile, size=size)
+
+
+def correct_baseline(signal, tophat_factor=.005, axis=-1, method='tophat', percentile=10, window_size=None):
+    """
+    subtract the baseline estimated by the selected method, by default a tophat morphological transform. window_size
+    overrides the width derived from tophat_factor, for slices that should be corrected as part of a longer trace.
+    """
+    if window_size is None:
+        window_size = baseline_window(signal, tophat_factor, axis)
+    if method == 'tophat':
+        return signal - tophat_baseline(signal, window_size, axis)
+    elif method == 'rolling_percentile':
+        return signal - percentile_baseline(signal, window_size, percentile, axis)
+    raise ValueError(f"Unknown baseline method {method}.")
+
+
+def correct_baseline_reference(signal, tophat_factor=.005, axis=-1):
+    """ tophat correction through ndimage.white_tophat, kept as the reference for correct_baseline """
+    size = [1] * signal.ndim
+    size[axis] = baseline_window(signal, tophat_factor, axis)
+    return ndimage.white_tophat(signal, size=size)
+
+
+def savitzky_golay(y, window_length, polyorder, derivative=0, rate=1, axis=-1):
+    return savgol_filter(y, window_length=window_length, polyorder=polyorder, deriv=derivative, delta=rate, axis=axis)
+
+
+def ricker(points, a):
+    """ Ricker (mexican hat) wavelet of width a sampled at points, as used by scipy.signal.find_peaks_cwt """
+    amplitude = 2 / (np.sqrt(3 * a) * (np.pi ** 0.25))
+    vec = np.arange(0, points) - (points - 1.0) / 2
+    xsq = vec ** 2
+    wsq = a ** 2
+    return amplitude * (1 - xsq / wsq) * np.exp(-xsq / (2 * wsq))
+
+
+@lru_cache(maxsize=16)
+def wavelet_bank(widths, trace_length):
+    """
+    Frequency domain Ricker wavelets for a set of widths, built once and reused for every trace of the same length.
+    :param widths: tuple of wavelet widths
+    :param trace_length: length of the traces to be transformed
+    :return: FFT length, offset of the centered output for each width, array of wavelet spectra
+    """
+    lengths = [int(min(10 * width, trace_length)) for width in widths]
+    fft_length = next_fast_len(trace_length + max(lengths) - 1)
+    bank = np.empty((len(widths), fft_length // 2 + 1), dtype=np.complex128)
+    for idx, (width, length) in enumerate(zip(widths, lengths)):
+        bank[idx] = np.fft.rfft(ricker(length, width)[::-1], fft_length)
+    bank.flags.writeable = False
+    return fft_length, tuple((length - 1) // 2 for length in lengths), bank
+
+
+def stacked_cwt(traces, widths, max_size=2 ** 23):
+    """
+    Continuous wavelet transform of a stack of traces with Ricker wavelets, computed by FFT convolution against a
+    cached wavelet bank.
+    :param traces: 2-D array, one trace per row
+    :param widths: wavelet widths
+    :param max_size: maximum number of values held in the transform of a batch of traces
+    :return: 3-D array of shape (traces, widths, trace length)
+    """
+    traces = np.asarray(traces, dtype=np.float64)
+    trace_count, trace_length = traces.shape
+    widths = tuple(np.atleast_1d(widths).tolist())
+    fft_length, offsets, bank = wavelet_bank(widths, trace_length)
+
+    res = np.empty((trace_count, len(widths), trace_length))
+    batch_size = max(1, max_size // (len(widths) * fft_length))
+    for start in range(0, trace_count, batch_size):
+        spectra = np.fft.rfft(traces[start:start + batch_size], fft_length)
+        transformed = np.fft.irfft(spectra[:, None, :] * bank[None, :, :], fft_length)
+        for idx, offset in enumerate(offsets):
+            res[start:start + batch_size, idx] = transformed[:, idx, offset:offset + trace_length]
+    return res
+
+
+def find_stacked_peaks_cwt(traces, widths, min_snr=1, noise_perc=10, gap_thresh=None):
+    """
+    find_peaks_cwt for a stack of traces, transforming all of them at once with stacked_cwt before identifying and
+    filtering ridge lines in each.
+    :return: sorted peak indices for each row
+    """
+    widths = np.atleast_1d(np.asarray(widths))
+    if gap_thresh is None:
+        gap_thresh = np.ceil(widths[0])
+    max_distances = widths / 4.0
+
+    res = []
+    for cwt_dat in stacked_cwt(traces, widths):
+        ridge_lines = identify_ridge_lines(cwt_dat, max_distances, gap_thresh)
+        res.append(sorted(filter_ridge_lines(cwt_dat, ridge_lines, min_snr=min_snr, noise_perc=noise_perc)))
+    return res
+
+
+def identify_ridge_lines(matr, max_distances, gap_thresh):
+    """
+    Ridge lines of a wavelet transform, connecting the relative maxima of each row to those of the row above, as
+    identified by find_peaks_cwt.  Adapted from scipy.signal._peak_finding._identify_ridge_lines, which is private to
+    scipy.  Copyright (c) 2001-2002 Enthought, Inc. 2003-2019, SciPy Developers, BSD 3-Clause License.
+    :param matr: 2-D transform, wavelet widths increasing with row
+    :param max_distances: greatest column distance over which a maximum is connected to a ridge line in each row
+    :param gap_thresh: number of rows a ridge line may go without connecting a maximum before it ends
+    :return: list of (rows, cols) arrays of each ridge line
+    """
+    if len(max_distances) < matr.shape[0]:
+        raise ValueError('Max_distances must have at least as many rows as matr')
+
+    # Relative maxima along each row, the first and last columns never being maxima
+    all_max_cols = np.zeros(matr.shape, dtype=bool)
+    all_max_cols[:, 1:-1] = (matr[:, 1:-1] > matr[:, :-2]) & (matr[:, 1:-1] > matr[:, 2:])
+    has_relmax = np.nonzero(all_max_cols.any(axis=1))[0]
+    if len(has_relmax) == 0:
+        return []
+    start_row = has_relmax[-1]
+
+    # Each ridge line is [rows, cols, gap], built from the highest row with maxima downwards
+    ridge_lines = [[[start_row], [col], 0] for col in np.nonzero(all_max_cols[start_row])[0]]
+    final_lines = []
+    cols = np.arange(matr.shape[1])
+    for row in range(start_row - 1, -1, -1):
+        for line in ridge_lines:
+            line[2] += 1
+
+        prev_ridge_cols = np.array([line[1][-1] for line in ridge_lines])
+        for col in cols[all_max_cols[row]]:
+            line = None
+            if len(prev_ridge_cols) > 0:
+                diffs = np.abs(col - prev_ridge_cols)
+                closest = np.argmin(diffs)
+                if diffs[closest] <= max_distances[row]:
+                    line = ridge_lines[closest]
+            if line is not None:
+                line[0].append(row)
+                line[1].append(col)
+                line[2] = 0
+            else:
+                ridge_lines.append([[row], [col], 0])
+
+        for idx in range(len(ridge_lines) - 1, -1, -1):
+            if ridge_lines[idx][2] > gap_thresh:
+                final_lines.append(ridge_lines.pop(idx))
+
+    # A line can connect several maxima in one row, the scatter through argsort is kept from scipy so that lines begin
+    # at the same column as in find_peaks_cwt.
+    res = []
+    for line in final_lines + ridge_lines:
+        sortargs = np.argsort(line[0])
+        rows, cols = np.zeros_like(sortargs), np.zeros_like(sortargs)
+        rows[sortargs] = line[0]
+        cols[sortargs] = line[1]
+        res.append((rows, cols))
+    return res
+
+
+def filter_ridge_lines(cwt_dat, ridge_lines, min_snr=1, noise_perc=10):
+    """
+    Filtering of ridge lines as done by find_peaks_cwt, with the noise floor only computed at the columns of ridge
+    lines long enough to be kept rather than at every column of the transform.
+    :return: column at which each accepted ridge line starts
+    """
+    num_points = cwt_dat.shape[1]
+    min_length = np.ceil(cwt_dat.shape[0] / 4)
+    hf_window, odd = divmod(int(np.ceil(num_points / 20)), 2)
+    row_one = cwt_dat[0, :]
+    noises = {}
+
+    res = []
+    for rows, cols in ridge_lines:
+        if len(rows) < min_length:
+            continue
+        col = cols[0]
+        if col not in noises:
+            noises[col] = scoreatpercentile(row_one[max(col - hf_window, 0):min(col + hf_window + odd, num_points)],
+                                            per=noise_perc)
+        snr = abs(cwt_dat[rows[0], col] / noises[col])
+        if not snr < min_snr:
+            res.append(int(col))
+    return res
 
 
-def correct_baseline(signal, tophat_factor=.005):
-    """ use tophat morphological transform to correct for baseline """
-    footprint = np.repeat([1], int(round(signal.size * tophat_factor)))
-    return ndimage.white_tophat(signal, None, footprint)
+def summarize_trace(data, offscale_indices=None, bucket_size=32, tophat_factor=.005):
+    """
+    Compact summary of a trace, allowing maxima and signal levels to be checked without loading the full trace.
+    :param data: raw trace
+    :param offscale_indices: indices at which the instrument reported saturation
+    :param bucket_size: number of points reduced to each entry of the min/max envelope
+    :param tophat_factor: footprint of the baseline correction as a fraction of the trace length
+    :return: dict of summary values
+    """
+    data = np.asarray(data)
+    if offscale_indices is None:
+        offscale_indices = []
+    if not data.size:
+        return None
+    padding = -data.size % bucket_size
+    buckets = np.pad(data, (0, padding), mode='edge').reshape(-1, bucket_size)
+    return {
+        'bucket_size': bucket_size,
+        'envelope_min': buckets.min(axis=1).tolist(),
+        'envelope_max': buckets.max(axis=1).tolist(),
+        'max_data_point': data.max().item(),
+        'baseline': float(np.median(data)),
+        'signal_level': float(correct_baseline(data.astype(np.float64), tophat_factor).max()),
+        'saturation_count': len([_ for _ in offscale_indices if 0 <= _ < data.size])
+    }
 
 
-def savitzky_golay(y, window_length, polyorder, derivative=0, rate=1):
-    return savgol_filter(y, window_length=window_length, polyorder=polyorder, deriv=derivative, delta=rate)
+def summary_max(trace_summary, start, stop, data_max):
+    """
+    Exact maximum of a trace between start and stop from its summary.  Buckets of the envelope lying wholly within the
+    range are taken from the summary, the partial buckets at either edge are only read from the trace when their
+    envelope exceeds the maximum found so far.
+    :param trace_summary: summary produced by summarize_trace
+    :param start: first index of the range
+    :param stop: index after the end of the range
+    :param data_max: function returning the maximum of the trace between two indices
+    :return: maximum of the trace within the range
+    """
+    bucket_size = trace_summary['bucket_size']
+    envelope_max = trace_summary['envelope_max']
+    first_bucket = -(-start // bucket_size)
+    last_bucket = stop // bucket_size
+    maximum = max(envelope_max[first_bucket:last_bucket], default=None)
+    if first_bucket > last_bucket:
+        edges = [(start, stop)]
+    else:
+        edges = [(start, first_bucket * bucket_size), (last_bucket * bucket_size, stop)]
+    for edge_start, edge_stop in edges:
+        if edge_start < edge_stop and (maximum is None or envelope_max[edge_start // bucket_size] > maximum):
+            edge_max = data_max(edge_start, edge_stop)
+            maximum = edge_max if maximum is None else max(maximum, edge_max)
+    return maximum
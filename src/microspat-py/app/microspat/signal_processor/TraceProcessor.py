@@ -17,18 +17,150 @@
 """
 
 import itertools
+import math
 import logging
+from collections import defaultdict
 
 import numpy as np
 from scipy import interpolate
-from scipy.signal import find_peaks_cwt, argrelmax
-from .SignalProcessor import smooth_signal, correct_baseline
+from scipy.ndimage import maximum_filter1d
+from scipy.signal import argrelmax
+from .SignalCache import processed_signal, processed_signal_cache, signal_cache_key
+from .SignalProcessor import smooth_signal, correct_baseline, find_stacked_peaks_cwt
 
 
 class NoLadderException(Exception):
     pass
 
 
+def estimate_log_slope(peak_indices, ladder, tolerance=.1):
+    """
+    Estimate the log of the scan index to base size ratio as the densest cluster of ratios between consecutive peak
+    spacings and consecutive ladder spacings.  Correctly matched spacings, and any peak spacing and ladder spacing
+    of the same base pair width, all agree on this ratio while incorrect pairings scatter.
+    """
+    ratios = np.sort(np.log(np.diff(peak_indices)[:, None] / np.diff(ladder)[None, :]).ravel())
+    support = np.searchsorted(ratios, ratios + tolerance) - np.searchsorted(ratios, ratios - tolerance)
+    return np.median(ratios[support == support.max()])
+
+
+def align_ladder_peaks(peak_indices, ladder, max_skipped_peaks=3, max_skipped_sizes=5, skip_cost=1.,
+                       slope_tolerance=.15, position_tolerance=.25):
+    """
+    Assign peak indices to ladder sizes by monotone alignment.  Peaks and ladder sizes may both be left unassigned.
+
+    The first pass is a dynamic program over (peak, size) assignments in which each step between consecutive
+    assignments is scored by how far its spacing ratio deviates from the estimated ratio of scan index to base size.
+    A quadratic fit of the first pass assignment is then used to realign peaks by position, which prefers the peak
+    nearest the expected index when several peaks have similar spacing.
+    :param peak_indices: sorted peak indices
+    :param ladder: sorted ladder base sizes
+    :param max_skipped_peaks: maximum number of consecutive unassigned peaks between two assigned peaks
+    :param max_skipped_sizes: maximum number of consecutive unassigned ladder sizes between two assigned sizes
+    :param skip_cost: cost of leaving a peak or ladder size unassigned
+    :param slope_tolerance: log spacing ratio deviation at which a step costs as much as a skip
+    :param position_tolerance: distance from the expected index, as a fraction of the smallest ladder spacing, at which
+    an assignment costs as much as a skip
+    :return: (assigned peak indices, assigned ladder sizes)
+    """
+    peaks = np.asarray(peak_indices, dtype=float)
+    sizes = np.asarray(ladder, dtype=float)
+    m, n = len(peaks), len(sizes)
+    if m < 2 or n < 2:
+        return list(peak_indices[:1]), list(ladder[:1])
+
+    log_slope = estimate_log_slope(peaks, sizes)
+
+    # First pass, spacing ratio alignment, vectorized over ladder sizes.
+    log_size_spacing = {dj: np.log(sizes[dj:] - sizes[:-dj]) for dj in range(1, min(max_skipped_sizes + 2, n))}
+    cost = np.zeros((m, n))
+    back_i = np.full((m, n), -1, dtype=int)
+    back_j = np.full((m, n), -1, dtype=int)
+    size_idx = np.arange(n)
+    for i in range(m):
+        best = skip_cost * (i + size_idx)
+        for prev_i in range(max(0, i - max_skipped_peaks - 1), i):
+            log_peak_spacing = math.log(peaks[i] - peaks[prev_i])
+            for dj, log_spacing in log_size_spacing.items():
+                deviation = (log_peak_spacing - log_spacing - log_slope) / slope_tolerance
+                c = cost[prev_i, :-dj] + skip_cost * (i - prev_i - 1 + dj - 1) + deviation * deviation
+                improved = c < best[dj:]
+                best[dj:][improved] = c[improved]
+                back_i[i, dj:][improved] = prev_i
+                back_j[i, dj:][improved] = size_idx[:-dj][improved]
+        cost[i] = best
+
+    trailing = skip_cost * ((m - 1 - np.arange(m))[:, None] + (n - 1 - size_idx)[None, :])
+    i, j = np.unravel_index(np.argmin(cost + trailing), cost.shape)
+    assignment = []
+    while i >= 0:
+        assignment.append((i, j))
+        i, j = back_i[i, j], back_j[i, j]
+    assignment.reverse()
+
+    if len(assignment) < 4:
+        return [peak_indices[i] for i, _ in assignment], [ladder[j] for _, j in assignment]
+
+    # Second pass, positional alignment against a smooth fit of the first pass.
+    assigned_peaks = peaks[[i for i, _ in assignment]]
+    assigned_sizes = sizes[[j for _, j in assignment]]
+    expected = np.polyval(np.polyfit(assigned_sizes, assigned_peaks, 2), sizes)
+    tolerance = position_tolerance * np.diff(sizes).min() * np.exp(log_slope)
+    match_cost = np.minimum(((peaks[:, None] - expected[None, :]) / tolerance) ** 2, 4 * skip_cost)
+
+    total = np.zeros((m + 1, n + 1))
+    total[:, 0] = skip_cost * np.arange(m + 1)
+    total[0, :] = skip_cost * np.arange(n + 1)
+    for i in range(1, m + 1):
+        for j in range(1, n + 1):
+            total[i, j] = min(total[i - 1, j - 1] + match_cost[i - 1, j - 1],
+                              total[i - 1, j] + skip_cost,
+                              total[i, j - 1] + skip_cost)
+
+    i, j = m, n
+    assignment = []
+    while i > 0 and j > 0:
+        if total[i, j] == total[i - 1, j - 1] + match_cost[i - 1, j - 1]:
+            assignment.append((i - 1, j - 1))
+            i, j = i - 1, j - 1
+        elif total[i, j] == total[i - 1, j] + skip_cost:
+            i -= 1
+        else:
+            j -= 1
+    assignment.reverse()
+
+    return [peak_indices[i] for i, _ in assignment], [ladder[j] for _, j in assignment]
+
+
+def snap_to_local_maxima(traces, rows, peak_indices, window_size):
+    """
+    Vectorized equivalent of GenericChannelProcessor.find_peak_local_maxima_iterative over stacked traces.  Each peak
+    moves to the first maximum of its trace within [peak - window_size // 2, peak + window_size // 2) when that maximum
+    is higher than the trace at the peak.  Peaks whose window runs past the end of the trace are left in place.
+    :param traces: 2-D array, one trace per row
+    :param rows: row of traces for each peak
+    :param peak_indices: index of each peak within its row
+    :param window_size: width of the search window
+    :return: array of snapped peak indices
+    """
+    half_window = int(window_size) // 2
+    peak_indices = np.array(peak_indices, dtype=int)
+    if not half_window or not peak_indices.size:
+        return peak_indices
+    rows = np.asarray(rows, dtype=int)
+    traces = np.asarray(traces, dtype=np.float64)
+
+    window_max = maximum_filter1d(traces, size=2 * half_window, axis=1, mode='constant', cval=-np.inf)
+    move = (traces.shape[1] > peak_indices + half_window) & \
+           (window_max[rows, peak_indices] > traces[rows, peak_indices])
+
+    window = peak_indices[move][:, None] + np.arange(-half_window, half_window)
+    heights = traces[rows[move][:, None], np.clip(window, 0, None)]
+    heights[window < 0] = -np.inf
+    peak_indices[move] = window[np.arange(window.shape[0]), heights.argmax(axis=1)]
+    return peak_indices
+
+
 class GenericChannelProcessor(object):
     def __init__(self, channel, scanning_parameters=None, **kwargs):
         if scanning_parameters is None:
@@ -36,6 +168,7 @@ class GenericChannelProcessor(object):
 
         self.channel = channel
         self.bleedthrough_channels = kwargs.get('bleedthrough_channels', [])
+        self.scan_range = kwargs.get('scan_range', None)
 
         self.scanning_method = scanning_parameters.get('scanning_method', 'relmax')
         self.maxima_window = scanning_parameters.get('maxima_window', 10)
@@ -45,6 +178,8 @@ class GenericChannelProcessor(object):
         self.smoothing_window = scanning_parameters.get('smoothing_window', 11)
         self.smoothing_order = scanning_parameters.get('smoothing_order', 7)
         self.tophat_factor = scanning_parameters.get('tophat_factor', .005)
+        self.baseline_method = scanning_parameters.get('baseline_method', 'tophat')
+        self.baseline_percentile = scanning_parameters.get('baseline_percentile', 10)
 
         # CWT peak identification parameters
         if 'cwt_min_width' and 'cwt_max_width' in scanning_parameters:
@@ -55,7 +190,59 @@ class GenericChannelProcessor(object):
         self.noise_perc = scanning_parameters.get('noise_perc', 13)
         self.gap_threshold = scanning_parameters.get('gap_threshold', 2)
 
+    @property
+    def signal_parameters(self):
+        return {
+            'smoothing_window': self.smoothing_window,
+            'smoothing_order': self.smoothing_order,
+            'tophat_factor': self.tophat_factor,
+            'baseline_method': self.baseline_method,
+            'baseline_percentile': self.baseline_percentile
+        }
+
+    def scan_window(self, trace_length, scan_range):
+        """
+        Slice of the trace to be processed for peaks within scan_range to be found as in a scan of the whole trace,
+        padded by the support of the smoothing and baseline filters, the relative maximum search and the local maxima
+        window.
+        :param trace_length: length of the whole trace
+        :param scan_range: (start, stop) indices of the range of interest
+        :return: (start, stop) indices of the slice
+        """
+        start, stop = scan_range
+        padding = (self.maxima_window // 2 + self.argrelmax_window + self.smoothing_window +
+                   2 * max(int(round(trace_length * self.tophat_factor)), 1) + 1)
+        return max(0, start - padding), min(trace_length, stop + padding)
+
+    def windowed_scanning(self, trace_length, scan_range):
+        """
+        Only relmax scanning is restricted to a window, as the noise estimate of cwt scanning depends on the length of
+        the trace.  Windows are not stored in the signal cache, which holds whole processed traces, so callers first
+        check cached_signal and scan a cached trace whole.
+        """
+        if scan_range is None or self.scanning_method != 'relmax':
+            return False
+        start, stop = self.scan_window(trace_length, scan_range)
+        return stop - start >= self.smoothing_window
+
+    def cached_signal(self, channel):
+        """
+        :return: processed trace of a stored channel held in the signal cache, or None
+        """
+        channel_id = getattr(channel, 'id', None)
+        if channel_id is None:
+            return None
+        return processed_signal_cache.get(signal_cache_key(channel_id, channel.data, **self.signal_parameters))
+
     def find_peak_local_maxima(self, peak_indices):
+        trace = np.asarray(self.channel.data)
+        return snap_to_local_maxima(trace[None, :], np.zeros(len(peak_indices), dtype=int), peak_indices,
+                                    self.maxima_window).tolist()
+
+    def find_peak_local_maxima_iterative(self, peak_indices):
+        """
+        Reference implementation of find_peak_local_maxima.
+        """
         trace = self.channel.data
         window_size = int(self.maxima_window)
         temp = []
@@ -80,14 +267,22 @@ class GenericChannelProcessor(object):
         raise NotImplementedError("find_peaks not implemented for {0}".format(type(self).__name__))
 
     def find_peak_indices_by_cwt(self):
-        peak_indices = find_peaks_cwt(self.channel.data, widths=self.widths,
-                                      min_snr=self.min_snr, noise_perc=self.noise_perc,
-                                      gap_thresh=self.gap_threshold)
+        peak_indices = find_stacked_peaks_cwt(np.asarray(self.channel.data)[None, :], widths=self.widths,
+                                              min_snr=self.min_snr, noise_perc=self.noise_perc,
+                                              gap_thresh=self.gap_threshold)[0]
         return peak_indices
 
     def find_peak_indices_by_relmax(self):
-        signal = smooth_signal(np.array(self.channel.data), self.smoothing_window, self.smoothing_order)
-        signal = correct_baseline(signal, self.tophat_factor)
+        data = self.channel.data
+        if self.windowed_scanning(len(data), self.scan_range) and self.cached_signal(self.channel) is None:
+            start, stop = self.scan_window(len(data), self.scan_range)
+            signal = smooth_signal(np.asarray(data[start:stop], dtype=np.float64), self.smoothing_window,
+                                   self.smoothing_order)
+            signal = correct_baseline(signal, method=self.baseline_method, percentile=self.baseline_percentile,
+                                      window_size=max(int(round(len(data) * self.tophat_factor)), 1))
+            return (argrelmax(signal, order=self.argrelmax_window)[0] + start).tolist()
+
+        signal = processed_signal(self.channel.data, getattr(self.channel, 'id', None), **self.signal_parameters)
         peak_indices = argrelmax(signal, order=self.argrelmax_window)[0].tolist()
         return peak_indices
 
@@ -121,6 +316,7 @@ class LadderProcessor(GenericChannelProcessor):
         self.maximum_missing_peak_count = filter_parameters.get('maximum_missing_peak_count', 5)
         self.allow_bleedthrough = filter_parameters.get('allow_bleedthrough', True)
         self.remove_outliers = filter_parameters.get('remove_outliers', True)
+        self.sizing_method = filter_parameters.get('sizing_method', 'combinatorial')
 
     @property
     def sizing_quality(self):
@@ -166,10 +362,14 @@ class LadderProcessor(GenericChannelProcessor):
                 return self._base_sizes
         else:
             peak_indices = sorted(peak_indices)
-        spline, sq, peaks = self.generate_spline(peak_indices, manual_peak_override=True)
-        r = lambda x: round(x, self.base_size_precision)
-        base_sizes = map(r, map(float, map(spline, range(1, len(self.channel.data) + 1))))
-        self._base_sizes = list(base_sizes)
+        if self.sizing_method == 'alignment':
+            spline, sq, peaks = self.generate_spline_by_alignment(peak_indices)
+        elif self.sizing_method == 'combinatorial':
+            spline, sq, peaks = self.generate_spline(peak_indices, manual_peak_override=True)
+        else:
+            raise ValueError("{0} is not a valid sizing method.".format(self.sizing_method))
+        base_sizes = spline(np.arange(1, len(self.channel.data) + 1, dtype=np.float64))
+        self._base_sizes = np.round(base_sizes, self.base_size_precision).tolist()
         self._sq = sq
         self._peak_indices = peak_indices
         return self._base_sizes
@@ -223,6 +423,30 @@ class LadderProcessor(GenericChannelProcessor):
             else:
                 return [refined_spline, refined_residual, peak_indices]
 
+    def generate_spline_by_alignment(self, peak_indices):
+        """
+        Generate the spline from a monotone alignment of peaks to ladder sizes, found in polynomial time, rather than
+        by fitting every combination of peaks or ladder sizes.  Sizing quality is the residual of the spline fit to
+        the aligned peaks, as in generate_spline.
+        :param peak_indices: Indices of peaks to calculate ladder
+        :return: [spline, residual, aligned peak indices]
+        """
+        if len(peak_indices) < len(self.ladder) - self.maximum_missing_peak_count:
+            raise NoLadderException("Not enough ladder peaks identified to generate accurate spline.")
+
+        if len(peak_indices) > len(self.ladder) + self.outlier_limit:
+            raise NoLadderException("Too many peaks identified to generate accurate spline.")
+
+        peaks, ladder_subset = align_ladder_peaks(sorted(peak_indices), sorted(self.ladder),
+                                                  max_skipped_peaks=self.outlier_limit,
+                                                  max_skipped_sizes=self.maximum_missing_peak_count)
+
+        if len(peaks) < max(len(self.ladder) - self.maximum_missing_peak_count, 4):
+            raise NoLadderException("Not enough ladder peaks aligned to generate accurate spline.")
+
+        spline = interpolate.UnivariateSpline(peaks, ladder_subset, k=3)
+        return [spline, spline.get_residual(), peaks]
+
     def remove_size_outliers(self, peak_indices):
         peak_indices = [x for x in peak_indices if self.min_peak_height < self.channel.data[x] < self.max_peak_height]
         return peak_indices
@@ -273,12 +497,141 @@ class LadderProcessor(GenericChannelProcessor):
 
 
 class MicrosatelliteProcessor(GenericChannelProcessor):
-    def __init__(self, channel, scanning_parameters=None):
-        GenericChannelProcessor.__init__(self, channel, scanning_parameters)
+    def __init__(self, channel, scanning_parameters=None, scan_range=None):
+        """
+        :param scan_range: (start, stop) indices to which peaks are restricted, giving the peaks of a whole trace scan
+        within that range.  Relmax scans process only a window around the range.
+        """
+        GenericChannelProcessor.__init__(self, channel, scanning_parameters, scan_range=scan_range)
 
     def find_peaks(self):
         peak_indices = self.find_peak_indices()
         peak_indices.sort()
         peak_indices = self.find_peak_local_maxima(peak_indices)
         peak_indices = sorted(list(set(peak_indices)))
+        if self.scan_range is not None:
+            start, stop = self.scan_range
+            peak_indices = [_ for _ in peak_indices if start <= _ < stop]
         return peak_indices
+
+
+class BatchMicrosatelliteProcessor(GenericChannelProcessor):
+    """
+    Scans many channels sharing scanning parameters at once.  Traces of equal length are stacked into a single array
+    and smoothed, baseline corrected and searched for maxima along the trace axis, or wavelet transformed together,
+    giving the same peaks as MicrosatelliteProcessor.find_peaks on each channel.
+    """
+    def __init__(self, channels, scanning_parameters=None, scan_ranges=None):
+        """
+        :param scan_ranges: (start, stop) indices to which scanning of each channel is restricted, or None
+        """
+        GenericChannelProcessor.__init__(self, None, scanning_parameters)
+        self.channels = channels
+        self.scanning_parameters = scanning_parameters
+        if scan_ranges is None:
+            scan_ranges = [None] * len(channels)
+        self.scan_ranges = scan_ranges
+
+    def find_peaks(self):
+        """
+        :return: list of peak indices for each channel, in the order channels were given
+        """
+        if self.scanning_method not in ['relmax', 'cwt']:
+            return [MicrosatelliteProcessor(channel, self.scanning_parameters, scan_range).find_peaks()
+                    for channel, scan_range in zip(self.channels, self.scan_ranges)]
+
+        channel_peaks = [[] for _ in self.channels]
+        channels_by_length = defaultdict(list)
+        for idx, channel in enumerate(self.channels):
+            channels_by_length[len(channel.data)].append(idx)
+
+        for length, idxs in channels_by_length.items():
+            if not length:
+                continue
+            windowed = [_ for _ in idxs if self.windowed_scanning(length, self.scan_ranges[_]) and
+                        self.cached_signal(self.channels[_]) is None]
+            if windowed:
+                traces = np.array([self.channels[_].data for _ in windowed])
+                scan_ranges = [self.scan_ranges[_] for _ in windowed]
+                for idx, peak_indices in zip(windowed, self.find_windowed_peaks(traces, scan_ranges)):
+                    channel_peaks[idx] = peak_indices
+
+            idxs = [_ for _ in idxs if _ not in windowed]
+            if idxs:
+                traces = np.array([self.channels[_].data for _ in idxs])
+                channel_ids = [getattr(self.channels[_], 'id', None) for _ in idxs]
+                for idx, peak_indices in zip(idxs, self.find_stacked_peaks(traces, channel_ids)):
+                    if self.scan_ranges[idx] is not None:
+                        start, stop = self.scan_ranges[idx]
+                        peak_indices = [_ for _ in peak_indices if start <= _ < stop]
+                    channel_peaks[idx] = peak_indices
+        return channel_peaks
+
+    def find_windowed_peaks(self, traces, scan_ranges):
+        """
+        Relmax scan of only the windows of stacked traces around their scan ranges.  Windows are widened to a common
+        length so they can be processed as one array.
+        :param traces: 2-D array, one whole trace per row
+        :param scan_ranges: (start, stop) indices of the range of interest in each row
+        :return: sorted peak indices within the scan range of each row
+        """
+        trace_count, trace_length = traces.shape
+        windows = np.array([self.scan_window(trace_length, _) for _ in scan_ranges])
+        window_length = (windows[:, 1] - windows[:, 0]).max()
+        starts = np.minimum(windows[:, 0], trace_length - window_length)
+
+        signal = traces[np.arange(trace_count)[:, None], starts[:, None] + np.arange(window_length)]
+        signal = smooth_signal(signal.astype(np.float64), self.smoothing_window, self.smoothing_order, axis=1)
+        signal = correct_baseline(signal, axis=1, method=self.baseline_method, percentile=self.baseline_percentile,
+                                  window_size=max(int(round(trace_length * self.tophat_factor)), 1))
+        rows, peak_indices = argrelmax(signal, axis=1, order=self.argrelmax_window)
+        peak_indices = snap_to_local_maxima(traces, rows, peak_indices + starts[rows], self.maxima_window)
+
+        scan_ranges = np.array(scan_ranges)
+        in_range = (peak_indices >= scan_ranges[rows, 0]) & (peak_indices < scan_ranges[rows, 1])
+        rows, peak_indices = rows[in_range], peak_indices[in_range]
+        bounds = np.searchsorted(rows, np.arange(trace_count + 1))
+        return [np.unique(peak_indices[bounds[i]:bounds[i + 1]]).tolist() for i in range(trace_count)]
+
+    def find_stacked_peaks(self, traces, channel_ids=None):
+        """
+        :param traces: 2-D array, one trace per row
+        :param channel_ids: ids of the channels in each row, used to store the processed rows in the signal cache
+        :return: sorted peak indices for each row
+        """
+        if self.scanning_method == 'cwt':
+            row_peaks = find_stacked_peaks_cwt(traces, widths=self.widths, min_snr=self.min_snr,
+                                               noise_perc=self.noise_perc, gap_thresh=self.gap_threshold)
+            rows = np.repeat(np.arange(traces.shape[0]), [len(_) for _ in row_peaks])
+            peak_indices = np.array([_ for peaks in row_peaks for _ in peaks], dtype=int)
+        else:
+            rows, peak_indices = self.find_stacked_relmax(traces, channel_ids)
+        peak_indices = snap_to_local_maxima(traces, rows, peak_indices, self.maxima_window)
+
+        bounds = np.searchsorted(rows, np.arange(traces.shape[0] + 1))
+        return [np.unique(peak_indices[bounds[i]:bounds[i + 1]]).tolist() for i in range(traces.shape[0])]
+
+    def find_stacked_relmax(self, traces, channel_ids=None):
+        """
+        Rows already processed are read from the signal cache, the rest are processed together and stored in it.
+        :return: row and index of each relative maximum of the processed traces
+        """
+        keys = [signal_cache_key(channel_id, trace, **self.signal_parameters) if channel_id is not None else None
+                for channel_id, trace in zip(channel_ids or [None] * len(traces), traces)]
+        signal = np.empty(traces.shape)
+        uncached = []
+        for row, key in enumerate(keys):
+            cached = processed_signal_cache.get(key) if key else None
+            if cached is None:
+                uncached.append(row)
+            else:
+                signal[row] = cached
+        if uncached:
+            processed = smooth_signal(traces[uncached].astype(np.float64), self.smoothing_window, self.smoothing_order,
+                                      axis=1)
+            signal[uncached] = correct_baseline(processed, self.tophat_factor, axis=1, method=self.baseline_method,
+                                                percentile=self.baseline_percentile)
+            for row in uncached:
+                if keys[row]:
+                    processed_signal_cache.set(keys[row], signal[row])
+        return argrelmax(signal, axis=1, order=self.argrelmax_window)
@@ -18,6 +18,8 @@
 
 import csv
 
+import sqlalchemy
+
 
 class CaseInsensitiveDict(dict):
     """
@@ -64,3 +66,27 @@ def subset(l, subset_size, pop=False):
             ss = l[i: i + subset_size]
         yield ss
         i += subset_size
+
+
+def add_missing_columns(engine, metadata):
+    """
+    Add columns declared in metadata that are missing from existing tables, so that databases created by earlier
+    versions remain usable.  Columns are added with their scalar default, if any.
+    """
+    inspector = sqlalchemy.inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    preparer = engine.dialect.identifier_preparer
+    for table in metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing_columns = set(_['name'] for _ in inspector.get_columns(table.name))
+        for column in table.columns:
+            if column.name in existing_columns:
+                continue
+            ddl = 'ALTER TABLE {} ADD COLUMN {} {}'.format(preparer.quote(table.name), preparer.quote(column.name),
+                                                          column.type.compile(dialect=engine.dialect))
+            if column.default is not None and column.default.is_scalar:
+                default = sqlalchemy.literal(column.default.arg, type_=column.type)
+                ddl += ' DEFAULT {}'.format(default.compile(dialect=engine.dialect,
+                                                            compile_kwargs={'literal_binds': True}))
+            engine.execute(ddl)
@@ -99,8 +99,18 @@ class ProductionConfig(Config):
         Config.init_app(app)
 
 
+class TestingConfig(Config):
+    TESTING = True
+
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+
+    LOGGING_LOCATION = os.devnull
+    LOGGING_LEVEL = logging.ERROR
+
+
 config = {
     'production': ProductionConfig,
     'development': DevelopmentConfig,
+    'testing': TestingConfig,
     'default': ProductionConfig
 }
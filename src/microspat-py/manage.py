@@ -17,7 +17,12 @@
 """
 
 import os
+
+import sqlalchemy
+
+from app.custom_sql_types.custom_types import NumericArrayEncodedData
 from app.microspat.models import *
+from app.utils.utils import add_missing_columns
 
 
 if os.path.exists('.env'):
@@ -88,6 +93,40 @@ def vacuum():
         print("Database does not support VACUUM command.")
 
 
+@manager.command
+def migrateDB(batch_size=500):
+    """
+    Upgrade a database created by an earlier version. Missing columns and sizing digests are also added whenever the
+    application starts. This command additionally re-encodes numeric array columns still stored as compressed JSON
+    into the binary array format.
+    """
+    add_missing_columns(db.engine, db.metadata)
+    batch_size = int(batch_size)
+    for table in db.metadata.sorted_tables:
+        pk = list(table.primary_key.columns)
+        if len(pk) != 1:
+            continue
+        pk = pk[0]
+        for column in table.columns:
+            if not isinstance(column.type, NumericArrayEncodedData):
+                continue
+            raw = sqlalchemy.type_coerce(column, sqlalchemy.LargeBinary)
+            update = table.update().where(pk == sqlalchemy.bindparam('_id')).values(
+                {column.name: sqlalchemy.bindparam('_value')})
+            ids = [_[0] for _ in db.engine.execute(sqlalchemy.select([pk]).where(column.isnot(None)))]
+            migrated = 0
+            for i in range(0, len(ids), batch_size):
+                rows = db.engine.execute(sqlalchemy.select([pk, raw]).where(pk.in_(ids[i:i + batch_size])))
+                values = [{'_id': row_id, '_value': column.type.decode_legacy(value)}
+                          for row_id, value in rows if not column.type.is_encoded(value)]
+                if values:
+                    db.engine.execute(update, values)
+                    migrated += len(values)
+            print(f"Migrated {migrated} values in {table.name}.{column.name}")
+    print(f"Stored sizing digests of {Well.store_missing_sizing_digests(batch_size)} wells")
+    vacuum()
+
+
 @manager.command
 def initDB():
     db.create_all()
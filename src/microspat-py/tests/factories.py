@@ -0,0 +1,72 @@
+"""
+Small synthetic plates stored directly in the database, sized without going through FSA parsing.
+"""
+import datetime
+import hashlib
+
+import numpy as np
+
+from app import db
+from app.microspat.models import Channel, Ladder, Locus, LocusSet, Plate, Sample, Well
+from app.microspat.models.utils import sizing_digest
+
+LADDER = [50, 60, 90, 100, 120, 150, 160, 180, 190, 200, 220, 240, 260, 280, 290, 300, 320, 340, 360, 380, 400]
+TRACE_LENGTH = 8000
+BASE_SIZES = np.round(np.arange(TRACE_LENGTH) * .05, 2)
+
+
+def trace(sizes, height=3000, width=3., seed=0):
+    """
+    :param sizes: base sizes at which to place peaks
+    :return: integer trace with a gaussian peak at each size over a noisy baseline
+    """
+    rng = np.random.RandomState(seed)
+    x = np.arange(TRACE_LENGTH)
+    y = 50 + rng.normal(0, 5, TRACE_LENGTH)
+    for size in sizes:
+        y += height * np.exp(-.5 * ((x - np.searchsorted(BASE_SIZES, size)) / width) ** 2)
+    return np.round(y).astype(int)
+
+
+def make_ladder(label='Ladder'):
+    ladder = Ladder(label=label, base_sizes=LADDER, color='red')
+    db.session.add(ladder)
+    return ladder
+
+
+def make_locus_set(label='Locus Set', min_base_length=100, max_base_length=200):
+    locus = Locus(color='blue', label=f'{label} Locus', min_base_length=min_base_length,
+                  max_base_length=max_base_length, nucleotide_repeat_length=2)
+    locus_set = LocusSet(label=label, loci=[locus])
+    db.session.add(locus_set)
+    return locus_set
+
+
+def make_sample_plate(ladder, locus, samples_peaks, label='Plate'):
+    """
+    :param samples_peaks: {sample barcode: base sizes of peaks in its trace}
+    :return: {sample barcode: Channel}
+    """
+    plate = Plate(label=label, date_run=datetime.date(2020, 1, 2), well_arrangement=96,
+                  plate_hash=hashlib.md5(label.encode()).hexdigest())
+    db.session.add(plate)
+    ladder_peak_indices = np.searchsorted(BASE_SIZES, LADDER).tolist()
+    channels = {}
+    for idx, (barcode, sizes) in enumerate(samples_peaks.items()):
+        sample = Sample(barcode=barcode, designation='sample')
+        well = Well(well_label=f'A{idx + 1:02}', base_sizes=BASE_SIZES, ladder_peak_indices=ladder_peak_indices,
+                    sizing_quality=0, offscale_indices=[],
+                    fsa_hash=hashlib.md5(f'{label} {barcode}'.encode()).hexdigest())
+        well.sizing_digest = sizing_digest(BASE_SIZES)
+        well.plate = plate
+        well.ladder = ladder
+        channel = Channel(wavelength=500, color='blue', data=trace(sizes, seed=idx))
+        channel.summarize()
+        channel.well = well
+        channel.sample = sample
+        db.session.add_all([sample, well, channel])
+        db.session.flush()
+        channel.add_locus(locus.id)
+        channels[barcode] = channel
+    db.session.flush()
+    return channels
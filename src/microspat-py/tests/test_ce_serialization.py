@@ -0,0 +1,24 @@
+import json
+
+from app import db
+from app.microspat.models import Channel, Well
+
+from factories import BASE_SIZES, make_ladder, make_locus_set, make_sample_plate
+
+
+def test_details_serialize_stored_arrays_as_lists(app):
+    ladder = make_ladder()
+    locus_set = make_locus_set()
+    make_sample_plate(ladder, locus_set.loci[0], {'S1': [120], 'S2': [150]})
+    db.session.commit()
+    db.session.expire_all()
+
+    well = Well.query.filter(Well.well_label == 'A01').one()
+    details = json.loads(json.dumps(well.serialize_details()))
+    assert details['base_sizes'] == BASE_SIZES.tolist()
+
+    channel = Channel.query.filter(Channel.well_id == well.id).one()
+    details = json.loads(json.dumps(channel.serialize_details()))
+    assert details['data'] == channel.data.tolist()
+    assert details['other_channels'] == []
+    assert json.loads(json.dumps(channel.non_recursive_details()))['data'] == channel.data.tolist()
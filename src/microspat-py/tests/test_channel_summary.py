@@ -0,0 +1,46 @@
+import numpy as np
+from sqlalchemy import inspect
+from sqlalchemy.orm import subqueryload
+
+from app import db
+from app.microspat.models import Channel, Well
+from app.microspat.schemas import ChannelListSchema, ChannelSchema
+
+from factories import make_ladder, make_locus_set, make_sample_plate
+
+
+def stored_channel():
+    ladder = make_ladder()
+    locus_set = make_locus_set()
+    channel = make_sample_plate(ladder, locus_set.loci[0], {'S1': [120, 180]})['S1']
+    db.session.commit()
+    channel_id, well_id = channel.id, channel.well_id
+    db.session.expire_all()
+    return channel_id, well_id
+
+
+def test_trace_summary_is_deferred(app):
+    channel_id, _ = stored_channel()
+
+    channel = Channel.query.get(channel_id)
+    ChannelSchema().dump(channel)
+    ChannelListSchema().dump(channel)
+
+    assert 'trace_summary' in inspect(channel).unloaded
+
+
+def test_max_data_point_from_undeferred_trace_summary(app):
+    channel_id, well_id = stored_channel()
+    expected = Channel.query.get(channel_id).max_data_point
+    db.session.expire_all()
+
+    well = Well.query.options(subqueryload(Well.channels).undefer(Channel.trace_summary)).get(well_id)
+    channel = well.channels[0]
+    assert 'trace_summary' not in inspect(channel).unloaded
+
+    channel.max_data_point = 0
+    channel.find_max_data_point()
+    assert channel.max_data_point == expected
+
+    start, stop = np.searchsorted(well.base_sizes, [100, 200])
+    assert channel.max_data_point == np.max(channel.data[start - 1:stop + 1])
@@ -0,0 +1,94 @@
+import numpy as np
+import pytest
+
+from app import db
+from app.microspat.signal_processor.TraceProcessor import LadderProcessor, NoLadderException, align_ladder_peaks
+
+from factories import LADDER, make_ladder
+
+TRACE_LENGTH = 9000
+
+
+class Channel(object):
+    def __init__(self, data):
+        self.data = data
+
+
+def ladder_peak_index(size):
+    return int(round(1500 + 15 * size + .004 * size ** 2))
+
+
+def ladder_trace(peak_indices, seed=0):
+    rng = np.random.RandomState(seed)
+    x = np.arange(TRACE_LENGTH)
+    y = 50 + rng.normal(0, 5, TRACE_LENGTH)
+    for peak_index in peak_indices:
+        y += rng.uniform(1000, 3000) * np.exp(-.5 * ((x - peak_index) / 3.) ** 2)
+    return np.round(y).astype(int).tolist()
+
+
+def ladder_processor(sizing_method, data=None):
+    return LadderProcessor(Channel(data or [0] * TRACE_LENGTH), LADDER,
+                           filter_parameters={'sizing_method': sizing_method})
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_alignment_of_clean_ladder(seed):
+    rng = np.random.RandomState(seed)
+    peak_indices = [ladder_peak_index(_) + rng.randint(-2, 3) for _ in LADDER]
+    assert align_ladder_peaks(peak_indices, LADDER) == (peak_indices, LADDER)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_alignment_with_missing_and_extra_peaks(seed):
+    rng = np.random.RandomState(seed)
+    true_peaks = {ladder_peak_index(_) + rng.randint(-2, 3): _ for _ in LADDER}
+    missing = rng.choice(list(true_peaks), 3, replace=False).tolist() + [min(true_peaks)]
+    peak_indices = [_ for _ in true_peaks if _ not in missing]
+    spacing = np.diff(sorted(true_peaks)).min()
+    peak_indices += [int(_) for _ in rng.uniform(min(true_peaks), max(true_peaks), 2)
+                     if np.abs(np.array(list(true_peaks)) - _).min() > spacing / 3]
+
+    peaks, sizes = align_ladder_peaks(sorted(peak_indices), LADDER)
+
+    assert len(peaks) == len(true_peaks) - len(missing)
+    assert all(true_peaks.get(peak) == size for peak, size in zip(peaks, sizes))
+
+
+def test_alignment_of_too_few_peaks():
+    assert align_ladder_peaks([ladder_peak_index(50)], LADDER) == ([ladder_peak_index(50)], [50])
+    assert align_ladder_peaks([], LADDER) == ([], [50])
+
+
+@pytest.mark.parametrize('peak_indices', [
+    [ladder_peak_index(_) for _ in LADDER],
+    [ladder_peak_index(_) for _ in LADDER if _ not in (60, 290)],
+    sorted([ladder_peak_index(_) for _ in LADDER] + [ladder_peak_index(75), ladder_peak_index(245)]),
+], ids=['clean', 'missing', 'extra'])
+def test_alignment_sizing_matches_combinatorial(peak_indices):
+    combinatorial = ladder_processor('combinatorial')
+    alignment = ladder_processor('alignment')
+
+    np.testing.assert_allclose(alignment.get_base_sizes(peak_indices),
+                               combinatorial.get_base_sizes(peak_indices), atol=.011)
+    assert alignment.sizing_quality == pytest.approx(combinatorial.sizing_quality, abs=1e-6)
+
+
+def test_alignment_sizing_of_too_few_peaks():
+    with pytest.raises(NoLadderException):
+        ladder_processor('alignment').get_base_sizes([ladder_peak_index(_) for _ in LADDER[:10]])
+
+
+def test_ladder_sizing_method_selects_alignment(app):
+    ladder = make_ladder()
+    ladder.sizing_method = 'alignment'
+    db.session.flush()
+
+    peak_indices = [ladder_peak_index(_) for _ in LADDER]
+    data = ladder_trace(peak_indices)
+    processor = LadderProcessor(Channel(data), ladder.base_sizes, ladder.filter_parameters)
+    base_sizes = processor.get_base_sizes()
+
+    assert processor.sizing_method == 'alignment'
+    assert processor.sizing_quality < ladder.sq_limit
+    np.testing.assert_allclose([base_sizes[_ - 1] for _ in peak_indices], LADDER, atol=.5)
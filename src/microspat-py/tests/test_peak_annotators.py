@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+from app.microspat.peak_annotator.PeakAnnotators import (annotate_crosstalk_neighbour_max, annotate_cumulative_crosstalk,
+                                                         annotate_signal_crosstalk, crosstalk_neighbour_max,
+                                                         cumulative_sums, peak_area_iterative, peak_areas)
+from app.microspat.signal_processor.SignalProcessor import correct_baseline, smooth_signal
+
+
+def random_trace(rng, length, peak_count):
+    x = np.arange(length)
+    trace = rng.rand(length) * 40 + 100 + 50 * np.sin(x / 700.)
+    for center in rng.randint(0, length, peak_count):
+        trace += rng.randint(100, 20000) * np.exp(-((x - center) / rng.uniform(2, 8)) ** 2)
+    return trace.astype(int)
+
+
+@pytest.mark.parametrize('seed', range(10))
+@pytest.mark.parametrize('min_relative_area_contribution, noise_threshold', [(.001, 50), (.01, 10), (0, 50)])
+def test_peak_areas_match_iterative(seed, min_relative_area_contribution, noise_threshold):
+    rng = np.random.RandomState(seed)
+    for length in (50, 500, 8000):
+        data = random_trace(rng, length, rng.randint(1, 60))
+        smoothed_data = correct_baseline(smooth_signal(data))
+        peak_indices = sorted(set(rng.randint(0, length, 40).tolist() + [0, 1, length - 2, length - 1]))
+
+        res = peak_areas(smoothed_data, data, peak_indices, min_relative_area_contribution, noise_threshold)
+
+        for idx, peak_index in enumerate(peak_indices):
+            expected = peak_area_iterative(smoothed_data, data, peak_index, min_relative_area_contribution,
+                                           noise_threshold)
+            assert res['left_tail'][idx] == expected['left_tail']
+            assert res['right_tail'][idx] == expected['right_tail']
+            assert res['peak_area'][idx] == pytest.approx(expected['peak_area'], rel=1e-9)
+
+
+def test_peak_areas_of_no_peaks():
+    data = random_trace(np.random.RandomState(0), 500, 5)
+    res = peak_areas(correct_baseline(smooth_signal(data)), data, [])
+    assert all(len(_) == 0 for _ in res.values())
+
+
+@pytest.mark.parametrize('seed', range(10))
+@pytest.mark.parametrize('idx_dist', [0, 1, 3])
+def test_crosstalk_matches_signal_crosstalk(seed, idx_dist):
+    rng = np.random.RandomState(seed)
+    length = rng.randint(25, 3000)
+    high = 5000 if seed % 2 else 33000
+    data = rng.randint(-50, high, length)
+    others = [rng.randint(-50, high, length + rng.randint(0, 4)) for _ in range(rng.randint(1, 5))]
+    peak_indices = np.arange(length)
+
+    expected = annotate_signal_crosstalk(others, idx_dist)(data, peak_indices.tolist())['crosstalk_ratio']
+
+    data_sums = cumulative_sums(data)
+    other_trace_sums = [cumulative_sums(_) for _ in others]
+    cumulative = annotate_cumulative_crosstalk(data_sums, other_trace_sums, idx_dist)(data, peak_indices)
+    np.testing.assert_allclose(cumulative['crosstalk_ratio'], expected, rtol=1e-12)
+
+    neighbour_max = crosstalk_neighbour_max(data_sums, other_trace_sums, idx_dist)
+    precomputed = annotate_crosstalk_neighbour_max(neighbour_max, idx_dist)(data, peak_indices)
+    np.testing.assert_array_equal(precomputed['crosstalk_ratio'], expected)
+
+
+def test_crosstalk_of_shorter_traces():
+    rng = np.random.RandomState(0)
+    data = rng.randint(0, 5000, 100)
+    others = [rng.randint(0, 5000, 90)]
+    peak_indices = [0, 50, 89, 90, 99]
+
+    expected = annotate_signal_crosstalk(others)(data, peak_indices)['crosstalk_ratio']
+    res = annotate_cumulative_crosstalk(cumulative_sums(data), [cumulative_sums(_) for _ in others])(data, peak_indices)
+
+    np.testing.assert_allclose(res['crosstalk_ratio'], expected, rtol=1e-12)
+    assert crosstalk_neighbour_max(cumulative_sums(data), [cumulative_sums(_) for _ in others]) is None
@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from app.microspat.peak_annotator.PeakFilters import (peak_proximity_filter, peak_proximity_filter_reference,
+                                                      proximity_filter_rows)
+from app.microspat.peak_annotator.PeakTable import PeakTable
+
+
+def random_peaks(rng, peak_count, tied):
+    """
+    :param tied: draw sizes and heights from a few values, so that many peaks share them
+    """
+    if tied:
+        sizes = rng.randint(0, 40, peak_count) * .5
+        heights = rng.randint(0, 4, peak_count) * 1000
+    else:
+        sizes = rng.rand(peak_count) * 300
+        heights = rng.randint(0, 40000, peak_count)
+    return [{'peak_index': idx, 'peak_size': float(size), 'peak_height': int(height)}
+            for idx, (size, height) in enumerate(zip(sizes, heights))]
+
+
+@pytest.mark.parametrize('seed', range(20))
+@pytest.mark.parametrize('tied', [False, True])
+@pytest.mark.parametrize('min_peak_distance', [0, .5, 2, 10])
+def test_proximity_filter_matches_reference(seed, tied, min_peak_distance):
+    rng = np.random.RandomState(seed)
+    peak_annotations = random_peaks(rng, rng.randint(1, 80), tied)
+    expected = list(peak_proximity_filter_reference(min_peak_distance)(peak_annotations))
+
+    rows = proximity_filter_rows([_['peak_size'] for _ in peak_annotations],
+                                 [_['peak_height'] for _ in peak_annotations], min_peak_distance)
+    assert [peak_annotations[_] for _ in rows] == expected
+
+    assert peak_proximity_filter(min_peak_distance)(peak_annotations) == expected
+
+    peak_table = peak_proximity_filter(min_peak_distance)(PeakTable.from_dicts(peak_annotations))
+    assert isinstance(peak_table, PeakTable)
+    assert peak_table.to_dicts() == expected
+
+
+def test_proximity_filter_of_equal_peaks():
+    peak_annotations = [{'peak_index': idx, 'peak_size': 100., 'peak_height': 1000} for idx in range(4)]
+    expected = list(peak_proximity_filter_reference(1)(peak_annotations))
+
+    assert peak_proximity_filter(1)(peak_annotations) == expected
+    assert peak_proximity_filter(1)(PeakTable.from_dicts(peak_annotations)).to_dicts() == expected
+
+
+def test_proximity_filter_of_no_peaks():
+    assert list(peak_proximity_filter_reference(1)([])) == []
+    assert proximity_filter_rows([], [], 1).size == 0
+    assert peak_proximity_filter(1)([]) == []
+    assert len(peak_proximity_filter(1)(PeakTable.from_dicts([]))) == 0
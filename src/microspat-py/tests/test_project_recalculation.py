@@ -0,0 +1,71 @@
+from app import db
+from app.microspat.models import BinEstimatorProject, GenotypingProject, ProjectChannelAnnotations
+
+from factories import make_ladder, make_locus_set, make_sample_plate
+
+
+def annotation(project, channel):
+    return ProjectChannelAnnotations.query.filter(ProjectChannelAnnotations.project_id == project.id).filter(
+        ProjectChannelAnnotations.channel_id == channel.id).one()
+
+
+def peak_sizes(channel_annotation, min_peak_height=1000):
+    return sorted(round(_['peak_size']) for _ in channel_annotation.annotated_peaks
+                  if _['peak_height'] > min_peak_height)
+
+
+def make_project(samples_peaks):
+    ladder = make_ladder()
+    locus_set = make_locus_set()
+    locus = locus_set.loci[0]
+    db.session.flush()
+    channels = make_sample_plate(ladder, locus, samples_peaks)
+    bin_estimator = BinEstimatorProject(title='Bins', locus_set_id=locus_set.id)
+    db.session.add(bin_estimator)
+    db.session.flush()
+    bin_estimator.add_samples([_.sample_id for _ in channels.values()])
+    bin_estimator.analyze_locus(locus.id)
+    project = GenotypingProject(title='Project', locus_set_id=locus_set.id, bin_estimator_id=bin_estimator.id)
+    db.session.add(project)
+    db.session.flush()
+    return project, locus, channels
+
+
+def test_adding_samples_keeps_existing_channel_annotations(app):
+    project, locus, channels = make_project({'first': [130, 150], 'second': [170]})
+    project.add_samples([channels['first'].sample_id])
+    project.analyze_locus(locus.id)
+    first = annotation(project, channels['first'])
+    assert peak_sizes(first) == [130, 150]
+    fingerprints = first.scanning_fingerprint, first.filter_fingerprint
+
+    project.add_samples([channels['second'].sample_id])
+    project.analyze_locus(locus.id)
+
+    assert peak_sizes(first) == [130, 150]
+    assert (first.scanning_fingerprint, first.filter_fingerprint) == fingerprints
+    assert peak_sizes(annotation(project, channels['second'])) == [170]
+
+
+def test_changing_bin_estimator_keeps_current_channel_annotations(app):
+    project, locus, channels = make_project({'first': [130, 150]})
+    project.add_samples([channels['first'].sample_id])
+    project.analyze_locus(locus.id)
+
+    project.change_bin_estimator(project.bin_estimator_id)
+    project.analyze_locus(locus.id)
+
+    assert peak_sizes(annotation(project, channels['first'])) == [130, 150]
+
+
+def test_changed_filter_parameters_refilter_channel_annotations(app):
+    project, locus, channels = make_project({'first': [130, 150]})
+    project.add_samples([channels['first'].sample_id])
+    project.analyze_locus(locus.id)
+
+    locus_parameters = project.get_locus_parameters(locus.id)
+    locus_parameters.min_peak_height = 100000
+    db.session.flush()
+    project.analyze_locus(locus.id)
+
+    assert peak_sizes(annotation(project, channels['first'])) == []
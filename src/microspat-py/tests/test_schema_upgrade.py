@@ -0,0 +1,62 @@
+import sqlalchemy
+
+from app import create_app, db
+from app.microspat.models import Ladder, Well
+
+from config import config
+from factories import make_ladder, make_locus_set, make_sample_plate
+
+ADDED_COLUMNS = {
+    ('ladder', 'sizing_method'),
+    ('ladder', 'baseline_method'),
+    ('ladder', 'baseline_percentile'),
+    ('channel', 'trace_summary'),
+    ('well', 'sizing_digest'),
+    ('project_channel_annotations', 'scanning_fingerprint'),
+    ('project_channel_annotations', 'filter_fingerprint'),
+}
+
+
+def create_earlier_schema(url):
+    """
+    Create every table without the columns added since the previous release, holding a single ladder.
+    """
+    metadata = sqlalchemy.MetaData()
+    for table in db.metadata.sorted_tables:
+        sqlalchemy.Table(table.name, metadata,
+                         *[_.copy() for _ in table.columns if (table.name, _.name) not in ADDED_COLUMNS])
+    engine = sqlalchemy.create_engine(url)
+    metadata.create_all(engine)
+    engine.execute(metadata.tables['ladder'].insert().values(id=1, label='Ladder', base_sizes=[50, 100], color='red'))
+    engine.dispose()
+
+
+def test_startup_adds_missing_columns(tmp_path, monkeypatch):
+    url = f"sqlite:///{tmp_path / 'earlier.sqlite'}"
+    create_earlier_schema(url)
+    monkeypatch.setattr(config['testing'], 'SQLALCHEMY_DATABASE_URI', url)
+
+    app = create_app('testing')
+    with app.app_context():
+        inspector = sqlalchemy.inspect(db.engine)
+        for table, column in ADDED_COLUMNS:
+            assert column in [_['name'] for _ in inspector.get_columns(table)]
+        ladder = Ladder.query.one()
+        assert (ladder.sizing_method, ladder.baseline_method, ladder.baseline_percentile) == ('combinatorial', 'tophat',
+                                                                                               10)
+        db.session.remove()
+        db.engine.dispose()
+
+
+def test_missing_sizing_digests_are_stored(app):
+    ladder = make_ladder()
+    locus_set = make_locus_set()
+    db.session.flush()
+    channels = make_sample_plate(ladder, locus_set.loci[0], {'first': [150], 'second': [170]})
+    db.session.commit()
+    digests = dict(Well.query.values(Well.id, Well.sizing_digest))
+    db.engine.execute(Well.__table__.update().values(sizing_digest=None))
+
+    assert Well.store_missing_sizing_digests(batch_size=1) == len(channels)
+    assert dict(Well.query.values(Well.id, Well.sizing_digest)) == digests
+    assert Well.store_missing_sizing_digests() == 0
@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+
+from app.microspat.signal_processor.SignalProcessor import (baseline_window, correct_baseline,
+                                                            correct_baseline_reference, tophat_baseline)
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('tophat_factor', [.0001, .005, .0064, .05])
+def test_tophat_baseline_matches_white_tophat(seed, tophat_factor):
+    rng = np.random.RandomState(seed)
+    x = np.arange(8000)
+    signal = rng.normal(0, 20, (3, 8000)) + 200 * np.sin(x / 900.)
+    for center in rng.randint(0, 8000, 30):
+        signal += rng.randint(100, 20000) * np.exp(-((x - center) / rng.uniform(2, 8)) ** 2)
+
+    window_size = baseline_window(signal[0], tophat_factor)
+    np.testing.assert_array_equal(signal[0] - tophat_baseline(signal[0], window_size),
+                                  correct_baseline_reference(signal[0], tophat_factor))
+    np.testing.assert_array_equal(correct_baseline(signal[0], tophat_factor),
+                                  correct_baseline_reference(signal[0], tophat_factor))
+    np.testing.assert_array_equal(correct_baseline(signal, tophat_factor, axis=1),
+                                  correct_baseline_reference(signal, tophat_factor, axis=1))
+    np.testing.assert_array_equal(correct_baseline(signal.T, tophat_factor, axis=0),
+                                  correct_baseline_reference(signal.T, tophat_factor, axis=0))
+
+
+def test_unknown_baseline_method():
+    with pytest.raises(ValueError):
+        correct_baseline(np.zeros(100), method='median')
@@ -0,0 +1,97 @@
+import numpy as np
+import pytest
+
+from app.microspat.signal_processor.SignalCache import processed_signal_cache, signal_cache_key
+from app.microspat.signal_processor.TraceProcessor import (BatchMicrosatelliteProcessor, MicrosatelliteProcessor,
+                                                           snap_to_local_maxima)
+
+
+class Channel(object):
+    def __init__(self, data, id=None):
+        self.data = data
+        self.id = id
+
+
+@pytest.fixture(autouse=True)
+def empty_signal_cache():
+    processed_signal_cache.clear()
+    yield
+    processed_signal_cache.clear()
+
+
+def random_trace(rng, length, peak_count):
+    x = np.arange(length)
+    trace = rng.rand(length) * 40 + 100 + 50 * np.sin(x / 700.)
+    for center in rng.randint(0, length, peak_count):
+        trace += rng.randint(100, 20000) * np.exp(-((x - center) / rng.uniform(2, 8)) ** 2)
+    return trace.astype(int).tolist()
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('maxima_window', [0, 1, 2, 10, 11])
+def test_snap_to_local_maxima_matches_iterative(seed, maxima_window):
+    rng = np.random.RandomState(seed)
+    traces = [random_trace(rng, length, 20) for length in (30, 2000, 2000)]
+    processors = [MicrosatelliteProcessor(Channel(_), {'maxima_window': maxima_window}) for _ in traces]
+    trace_peaks = [sorted(set(rng.randint(0, len(_), 50).tolist() + [0, 1, len(_) - 2, len(_) - 1])) for _ in traces]
+
+    for processor, peak_indices in zip(processors, trace_peaks):
+        expected = processor.find_peak_local_maxima_iterative(peak_indices)
+        assert processor.find_peak_local_maxima(peak_indices) == expected
+
+    stacked = np.array(traces[1:])
+    rows = np.repeat([0, 1], [len(_) for _ in trace_peaks[1:]])
+    snapped = snap_to_local_maxima(stacked, rows, np.concatenate(trace_peaks[1:]), maxima_window)
+    expected = np.concatenate([processor.find_peak_local_maxima_iterative(peak_indices)
+                               for processor, peak_indices in zip(processors[1:], trace_peaks[1:])])
+    np.testing.assert_array_equal(snapped, expected)
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('scanning_parameters', [{}, {'baseline_method': 'rolling_percentile'},
+                                                 {'argrelmax_window': 3, 'smoothing_window': 21, 'maxima_window': 4}])
+def test_windowed_scanning_matches_whole_trace(seed, scanning_parameters):
+    rng = np.random.RandomState(seed)
+    length = 8000
+    channels = [Channel(random_trace(rng, length, 80)) for _ in range(6)]
+    starts = rng.randint(0, length - 500, len(channels)).tolist()
+    scan_ranges = [(start, start + int(rng.randint(1, 2000))) for start in starts]
+    scan_ranges[0] = (0, 300)
+    scan_ranges[1] = (length - 300, length)
+
+    expected = []
+    for channel, (start, stop) in zip(channels, scan_ranges):
+        processor = MicrosatelliteProcessor(channel, scanning_parameters, scan_range=(start, stop))
+        assert processor.windowed_scanning(length, (start, stop))
+        peak_indices = MicrosatelliteProcessor(channel, scanning_parameters).find_peaks()
+        expected.append([_ for _ in peak_indices if start <= _ < stop])
+        assert processor.find_peaks() == expected[-1]
+
+    assert BatchMicrosatelliteProcessor(channels, scanning_parameters, scan_ranges).find_peaks() == expected
+
+
+def test_windowed_scanning_reads_cached_signal():
+    channels = [Channel([100] * 2000, id=1), Channel([100] * 2000, id=2)]
+    processor = MicrosatelliteProcessor(channels[0], {}, scan_range=(400, 600))
+    assert processor.find_peaks() == []
+    assert len(processed_signal_cache) == 0
+
+    # A cached trace is scanned in place of processing the window.
+    for channel, peak_index in zip(channels, [500, 550]):
+        signal = np.zeros(2000)
+        signal[peak_index] = 1000
+        processed_signal_cache.set(signal_cache_key(channel.id, channel.data, **processor.signal_parameters), signal)
+
+    assert processor.find_peaks() == [500]
+    assert BatchMicrosatelliteProcessor(channels, {}, [(400, 600), (400, 600)]).find_peaks() == [[500], [550]]
+
+
+def test_stacked_scanning_stores_and_reads_cached_signal():
+    rng = np.random.RandomState(0)
+    channels = [Channel(random_trace(rng, 4000, 30), id=idx) for idx in range(4)]
+    expected = [MicrosatelliteProcessor(Channel(_.data), {}).find_peaks() for _ in channels]
+
+    assert BatchMicrosatelliteProcessor(channels[:2], {}).find_peaks() == expected[:2]
+    assert len(processed_signal_cache) == 2
+    assert BatchMicrosatelliteProcessor(channels, {}).find_peaks() == expected
+    assert len(processed_signal_cache) == 4